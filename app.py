@@ -1,7 +1,8 @@
-from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for
+from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for, make_response, abort
+from werkzeug.security import safe_join
 import pyodbc
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta
 import io
 import os
 import sys
@@ -12,10 +13,41 @@ import socket
 import urllib.request
 import webbrowser
 import shutil
+import json
+import bisect
+import re
+import csv
+import random
+import cProfile
+import pstats
+import gzip
+import tempfile
+import hashlib
+import uuid
+import mimetypes
+import zipfile
+import itertools
+from collections import OrderedDict, deque, namedtuple
+import pickle
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from openpyxl import Workbook, load_workbook
 from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
 from openpyxl.utils import get_column_letter
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # 未安裝 pyarrow 時欄式匯出改用 gzip CSV
+    pa = None
+    pq = None
+
+try:
+    import brotli
+except ImportError:  # 未安裝 brotli 時只提供 gzip 壓縮
+    brotli = None
+
 # -----------------------
 # Path helpers (frozen vs dev)
 # -----------------------
@@ -101,9 +133,47 @@ _last_heartbeat_ts = time.time()
 LOCAL_EXPORT_DIR = os.path.join(APP_DIR, "exports")
 os.makedirs(LOCAL_EXPORT_DIR, exist_ok=True)
 
+# 效能分析輸出目錄（與 exports 同層，啟用分析時才建立）
+PROFILE_DIR = os.path.join(APP_DIR, "profiles")
+
 # 網路共用資料夾路徑
 NETWORK_SHARE_PATH = r"\\sambasy\public\ProductionReportSystem"
 
+# 上傳紀錄（檔名 -> 內容雜湊），用於略過已上傳且內容相同的檔案
+UPLOAD_LEDGER_PATH = os.path.join(APP_DIR, "upload_ledger.json")
+_UPLOAD_LEDGER_RETENTION_DAYS = 30
+
+# 打包模式：每次上傳/列印打包成單一 zip（含 manifest）一次傳送；請求可用 {"bundle": true/false} 覆寫
+UPLOAD_BUNDLE_MODE = False
+
+# 列印清單異動日誌（重新啟動時還原清單）
+JOURNAL_PATH = os.path.join(APP_DIR, "queue_journal.jsonl")
+
+# 同一資料列重複儲存時合併為一筆修改申請（有輸入的欄位以後存的為準，保留修改歷程）
+MERGE_REPEATED_EDITS = True
+
+# 列印 Excel 輸出方式：per_batch 每 2 筆一個檔案；consolidated 全部合併為一個檔案（每 2 筆一個工作表）
+PRINT_WORKBOOK_MODE = "per_batch"
+
+# 排程批次處理：依時段自動上傳當天記錄、預先生成列印檔案（預設停用，仍以手動按鈕為主）
+SCHEDULER_ENABLED = False
+SCHEDULE_WINDOWS = (
+    {"name": "hourly", "every_min": 60, "tasks": ("upload",)},
+    {"name": "end_of_shift", "at": ("07:40", "19:40"), "tasks": ("upload", "prepare_print")},
+)
+SCHEDULE_MAX_RECORDS_PER_RUN = 100   # 單次最多上傳幾筆，其餘稍後分批處理
+
+# 回寫模式：上傳時符合條件的當天修改直接寫入 DayWorkDYProduct/TimeWorkBase（其餘仍上傳 CSV）
+WRITEBACK_ENABLED = False
+
+# exports/ 保留政策（背景定期清理）
+RETENTION_INTERVAL_MIN = 30
+RETENTION_ORPHAN_GRACE_MIN = 30        # 未被清單引用的檔案超過此時間才處理（避開生成/上傳中的檔案）
+RETENTION_ARCHIVE_ENABLED = True       # True：孤兒檔壓縮到 exports/archive/；False：直接刪除
+RETENTION_ARCHIVE_SUBDIR = "archive"
+RETENTION_ARCHIVE_MAX_AGE_DAYS = 90
+RETENTION_MAX_DIR_MB = 500             # 超過時由最舊的封存開始刪除（清單引用中的檔案不會刪除）
+
 # -----------------------
 # DB config
 # -----------------------
@@ -126,9 +196,21 @@ def get_db_connection():
     )
     return pyodbc.connect(conn_str)
 
-def query_production_report(dy_serial_num: str):
-    """查詢生產日報表資料"""
-    sql = r"""
+def normalize_dy_serial(raw) -> str:
+    """正規化生產日報表序號：去空白、自動補 DY 前綴、轉大寫（空值回傳空字串）"""
+    dy_serial_num = str(raw or "").strip()
+    if not dy_serial_num:
+        return ""
+
+    # 如果沒有 DY 前綴，自動添加
+    if not dy_serial_num.upper().startswith("DY"):
+        dy_serial_num = "DY" + dy_serial_num
+
+    # 統一轉為大寫
+    return dy_serial_num.upper()
+
+# 生產日報表查詢（SELECT/FROM 與排序分開，供單一序號查詢與日期區間匯出共用）
+REPORT_SELECT_SQL = r"""
     SELECT 
         c.DySerialNum AS [生產日報表序號],
         CONVERT(varchar(10), c.CDate, 23) AS [工作日期],
@@ -157,7 +239,12 @@ def query_production_report(dy_serial_num: str):
         b.OtherHours2 AS [除外時間2],
         b.ExtraName3 AS [除外名稱3],
         b.OtherHours3 AS [除外時間3],
-        c.EditTime AS [編輯時間]
+        c.EditTime AS [編輯時間],
+        a.OrdinalNum AS [序次]
+"""
+
+# 報表的資料表關聯（明細查詢與彙總共用）
+REPORT_FROM_SQL = r"""
     FROM dbo.TimeWorkBase a
     LEFT JOIN dbo.DayWorkDYProduct b 
         ON a.DySerialNum = b.DySerialNum 
@@ -169,12 +256,114 @@ def query_production_report(dy_serial_num: str):
         ON a.PDSerialNum = e.SerialNum
     LEFT JOIN dbo.Jang1Base f 
         ON a.MachineNr = f.customernr
-    WHERE c.DySerialNum = ?
+"""
+
+REPORT_SELECT_SQL += REPORT_FROM_SQL
+
+REPORT_ORDER_SQL = r"""
     ORDER BY 
         COALESCE(TRIM(f.PordDept), N'') ASC,
         a.WorkerNum ASC,
         a.StartDate ASC
+"""
+
+# 同一序號同時只執行一次查詢，其餘請求等待並共用結果（single-flight）
+_inflight_queries = {}  # 正規化序號 -> _InFlightQuery
+_inflight_lock = threading.Lock()
+_query_stats = {"db_queries": 0, "coalesced": 0, "failed": 0}
+
+
+class _InFlightQuery:
+    __slots__ = ('event', 'result', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.waiters = 0
+
+
+def query_production_report(dy_serial_num: str):
+    """
+    查詢生產日報表資料（失敗返回 None）
+    同一序號已有查詢進行中時不再送出，等待該查詢完成後取得結果的複本
+    """
+    key = normalize_dy_serial(dy_serial_num)
+    with _inflight_lock:
+        flight = _inflight_queries.get(key)
+        leader = flight is None
+        if leader:
+            flight = _inflight_queries[key] = _InFlightQuery()
+            _query_stats["db_queries"] += 1
+        else:
+            flight.waiters += 1
+            _query_stats["coalesced"] += 1
+
+    if not leader:
+        flight.event.wait()
+        return None if flight.result is None else flight.result.copy()
+
+    try:
+        flight.result = _query_production_report_db(dy_serial_num)
+    finally:
+        with _inflight_lock:
+            del _inflight_queries[key]
+            if flight.result is None:
+                _query_stats["failed"] += 1
+        flight.event.set()
+    if flight.waiters:
+        logger.info(f"查詢合併：{key} 共用給 {flight.waiters} 個同時請求")
+    return flight.result
+
+
+_BATCH_QUERY_CHUNK = 1000  # SQL Server 單一查詢最多 2100 個參數
+
+
+def query_production_reports(dy_serial_nums: list):
+    """
+    以 IN 條件一次查詢多個序號（每 1000 個一段），返回 {序號: DataFrame}
+    查無資料的序號為空的 DataFrame；查詢失敗返回 None
     """
+    serials = list(dict.fromkeys(dy_serial_nums))
+    frames = []
+    try:
+        conn = get_db_connection()
+        try:
+            for i in range(0, len(serials), _BATCH_QUERY_CHUNK):
+                chunk = serials[i:i + _BATCH_QUERY_CHUNK]
+                placeholders = ", ".join("?" for _ in chunk)
+                sql = REPORT_SELECT_SQL + f"    WHERE c.DySerialNum IN ({placeholders})" + REPORT_ORDER_SQL
+                frames.append(pd.read_sql(sql, conn, params=chunk))
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.exception("批次查詢錯誤: %s", str(e))
+        return None
+
+    with _inflight_lock:
+        _query_stats["db_queries"] += len(frames)
+
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    if df.empty:
+        return {s: df.copy() for s in serials}
+    keys = df['生產日報表序號'].astype(str).str.strip().str.upper()
+    result = {}
+    for serial in serials:
+        result[serial] = df[keys == serial].reset_index(drop=True)
+    return result
+
+
+def get_query_stats() -> dict:
+    with _inflight_lock:
+        stats = dict(_query_stats)
+        stats["in_flight"] = len(_inflight_queries)
+    total = stats["db_queries"] + stats["coalesced"]
+    stats["saved_ratio"] = round(stats["coalesced"] / total, 4) if total else 0.0
+    return stats
+
+
+def _query_production_report_db(dy_serial_num: str):
+    """實際執行報表查詢"""
+    sql = REPORT_SELECT_SQL + "    WHERE c.DySerialNum = ?" + REPORT_ORDER_SQL
     try:
         conn = get_db_connection()
         df = pd.read_sql(sql, conn, params=[dy_serial_num])
@@ -186,479 +375,3548 @@ def query_production_report(dy_serial_num: str):
 
 
 # -----------------------
-# 列印清單管理（全域變數，不限筆數）
+# 查詢結果快取（供批次儲存比對原始資料）
 # -----------------------
-print_queue = []  # 每個元素是一個 dict，包含修改資訊
-pending_print_records = []  # 臨時存儲待列印的記錄（避免 print_queue 被修改）
+_QUERY_CACHE_TTL_SEC = 300
+_QUERY_CACHE_MAX_ENTRIES = 200
 
-# 判斷記錄是否為當天
-def is_same_day_record(record: dict) -> bool:
-    """判斷記錄的工作日期是否為當天"""
+_query_cache = {}  # dy_serial_num -> (查詢時間, 已格式化的 DataFrame)
+_query_cache_lock = threading.Lock()
+
+
+def format_report_frame(df):
+    """轉為前端顯示格式：datetime -> 字串、缺值 -> None（回傳新的 DataFrame）"""
+    df = df.copy()
+    for col in df.columns:
+        if str(df[col].dtype).startswith("datetime"):
+            df[col] = df[col].dt.strftime("%Y-%m-%d %H:%M:%S")
+    return df.astype(object).where(pd.notnull(df), None)
+
+
+def cache_report(dy_serial_num: str, df) -> None:
+    """將查詢結果放入快取（超過上限時移除最舊的項目）"""
+    with _query_cache_lock:
+        _query_cache[dy_serial_num] = (time.time(), df)
+        if len(_query_cache) > _QUERY_CACHE_MAX_ENTRIES:
+            oldest = min(_query_cache, key=lambda k: _query_cache[k][0])
+            del _query_cache[oldest]
+
+
+def get_cached_report(dy_serial_num: str):
+    """取得快取中的查詢結果，過期或不存在時重新查詢（查詢失敗回傳 None）"""
+    with _query_cache_lock:
+        entry = _query_cache.get(dy_serial_num)
+    if entry and time.time() - entry[0] <= _QUERY_CACHE_TTL_SEC:
+        return entry[1]
+
+    df = query_production_report(dy_serial_num)
+    if df is not None:
+        df = format_report_frame(df)
+        cache_report(dy_serial_num, df)
+    return df
+
+
+def get_cached_reports(dy_serial_nums: list) -> dict:
+    """
+    取得多個序號的查詢結果：快取未命中的序號以一次批次查詢取得
+    返回 {序號: DataFrame}；查無資料為空的 DataFrame，查詢失敗為 None
+    """
+    reports = {}
+    now = time.time()
+    with _query_cache_lock:
+        for serial in dy_serial_nums:
+            entry = _query_cache.get(serial)
+            if entry and now - entry[0] <= _QUERY_CACHE_TTL_SEC:
+                reports[serial] = entry[1]
+
+    missing = [s for s in dy_serial_nums if s not in reports]
+    if missing:
+        fetched = query_production_reports(missing)
+        for serial in missing:
+            df = None if fetched is None else fetched.get(serial)
+            if df is not None:
+                df = format_report_frame(df)
+                if not df.empty:
+                    cache_report(serial, df)
+            reports[serial] = df
+    return reports
+
+
+# -----------------------
+# 鄰近序號預先查詢（查詢後於背景載入接下來可能查詢的序號）
+# -----------------------
+PREFETCH_ENABLED = False
+PREFETCH_MODE = "next"        # next：序號遞增的後幾張；same_date：同一工作日期、序號較大的後幾張
+PREFETCH_AHEAD = 3
+_PREFETCH_MAX_AGE_SEC = 60    # 預先查詢的結果超過此時間未被使用則視為過期，改為重新查詢
+_PREFETCH_MAX_WORKERS = 2
+_PREFETCH_MAX_PENDING = 4     # 排隊中的預先查詢超過此數時略過，避免壓垮資料庫
+
+_prefetch_executor = ThreadPoolExecutor(max_workers=_PREFETCH_MAX_WORKERS, thread_name_prefix="prefetch")
+_prefetched = {}  # 序號 -> 載入時間（尚未被查詢使用）
+_prefetch_lock = threading.Lock()
+_prefetch_pending = 0
+_prefetch_stats = {"scheduled": 0, "skipped": 0, "loaded": 0, "hits": 0, "expired": 0, "failed": 0}
+
+_SERIAL_NUMBER_RE = re.compile(r'^(.*?)(\d+)$')
+
+
+def next_serials(dy_serial_num: str, count: int) -> list:
+    """序號數字部分遞增（保留前導零），無數字結尾時返回空列表"""
+    m = _SERIAL_NUMBER_RE.match(dy_serial_num)
+    if not m:
+        return []
+    prefix, digits = m.groups()
+    number = int(digits)
+    return [f"{prefix}{str(number + i).zfill(len(digits))}" for i in range(1, count + 1)]
+
+
+def same_date_serials(dy_serial_num: str, work_date: str, count: int) -> list:
+    """同一工作日期、序號大於目前序號的後幾張生產日報表"""
+    conn = get_db_connection()
     try:
-        # 嘗試多個可能的欄位名稱
-        work_date_str = (
-            record.get('work_date_original') or 
-            record.get('work_date_modified') or 
-            record.get('work_date') or 
-            ''
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT TOP {int(count)} DySerialNum FROM dbo.DayWorkDYBase "
+            "WHERE CDate = ? AND DySerialNum > ? ORDER BY DySerialNum",
+            (work_date, dy_serial_num),
         )
-        
-        logger.info(f"[日期判斷] 序號: {record.get('dy_serial_num')}, work_date_str: {work_date_str}")
-        
-        if not work_date_str or work_date_str == '':
-            logger.warning(f"[日期判斷] 序號 {record.get('dy_serial_num')} 沒有工作日期欄位")
-            return False
-        
-        # 獲取今天的日期（台灣時區）
-        today = datetime.now().date()
-        logger.info(f"[日期判斷] 今天日期: {today}")
-        
-        # 轉換為字串並處理
-        work_date_str = str(work_date_str).strip()
-        
-        # 移除時間部分，只保留日期
-        if ' ' in work_date_str:
-            date_part = work_date_str.split(' ')[0]
+        return [normalize_dy_serial(row[0]) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+def _expire_prefetched(now: float) -> None:
+    """移除過期或已被快取淘汰的預先查詢紀錄（呼叫端持有 _prefetch_lock）"""
+    with _query_cache_lock:
+        cached = set(_query_cache)
+    for serial, loaded_at in list(_prefetched.items()):
+        if now - loaded_at > _PREFETCH_MAX_AGE_SEC or serial not in cached:
+            del _prefetched[serial]
+            _prefetch_stats["expired"] += 1
+
+
+def take_prefetched_report(dy_serial_num: str):
+    """查詢時若有尚未使用且未過期的預先查詢結果則直接使用（只使用一次），否則返回 None"""
+    if not PREFETCH_ENABLED:
+        return None
+    with _prefetch_lock:
+        loaded_at = _prefetched.pop(dy_serial_num, None)
+        if loaded_at is None:
+            return None
+        if time.time() - loaded_at > _PREFETCH_MAX_AGE_SEC:
+            _prefetch_stats["expired"] += 1
+            return None
+    with _query_cache_lock:
+        entry = _query_cache.get(dy_serial_num)
+    if entry is None:
+        with _prefetch_lock:
+            _prefetch_stats["expired"] += 1
+        return None
+    with _prefetch_lock:
+        _prefetch_stats["hits"] += 1
+    return entry[1]
+
+
+def _run_prefetch(dy_serial_num: str, work_date: str) -> None:
+    global _prefetch_pending
+    try:
+        if PREFETCH_MODE == "same_date" and work_date:
+            serials = same_date_serials(dy_serial_num, work_date, PREFETCH_AHEAD)
         else:
-            date_part = work_date_str
-        
-        # 替換 / 為 -
-        date_part = date_part.replace('/', '-')
-        
-        logger.info(f"[日期判斷] 處理後的日期字串: {date_part}")
-        
-        # 解析日期
-        try:
-            work_date = datetime.strptime(date_part, '%Y-%m-%d').date()
-            result = work_date == today
-            logger.info(f"[日期判斷] 工作日期: {work_date}, 是否為當天: {result}")
-            return result
-        except ValueError as ve:
-            logger.error(f"[日期判斷] 日期格式錯誤: {date_part}, 錯誤: {str(ve)}")
-            return False
-        
+            serials = next_serials(dy_serial_num, PREFETCH_AHEAD)
+        with _query_cache_lock:
+            serials = [s for s in serials if s not in _query_cache]
+        if serials:
+            reports = get_cached_reports(serials)
+            now = time.time()
+            with _prefetch_lock:
+                for serial, df in reports.items():
+                    if df is not None and not df.empty:
+                        _prefetched[serial] = now
+                        _prefetch_stats["loaded"] += 1
     except Exception as e:
-        logger.exception(f"[日期判斷] 判斷失敗，序號: {record.get('dy_serial_num')}, 錯誤: {str(e)}")
-        return False
+        with _prefetch_lock:
+            _prefetch_stats["failed"] += 1
+        logger.warning(f"預先查詢失敗（{dy_serial_num}）: {str(e)}")
+    finally:
+        with _prefetch_lock:
+            _prefetch_pending -= 1
+
+
+def schedule_prefetch(dy_serial_num: str, df) -> None:
+    """查詢完成後排入背景預先查詢（排隊數已達上限時略過）"""
+    global _prefetch_pending
+    if not PREFETCH_ENABLED:
+        return
+    work_date = str(df['工作日期'].iloc[0] or '') if '工作日期' in df.columns and len(df) else ''
+    with _prefetch_lock:
+        _expire_prefetched(time.time())
+        if _prefetch_pending >= _PREFETCH_MAX_PENDING:
+            _prefetch_stats["skipped"] += 1
+            return
+        _prefetch_pending += 1
+        _prefetch_stats["scheduled"] += 1
+    _prefetch_executor.submit(_run_prefetch, dy_serial_num, work_date)
+
+
+def get_prefetch_stats() -> dict:
+    with _prefetch_lock:
+        stats = dict(_prefetch_stats)
+        stats["pending"] = _prefetch_pending
+        stats["unused"] = len(_prefetched)
+    stats["enabled"] = PREFETCH_ENABLED
+    stats["mode"] = PREFETCH_MODE
+    # 命中率：已載入的預先查詢結果中，實際被查詢使用的比例
+    stats["hit_rate"] = round(stats["hits"] / stats["loaded"], 4) if stats["loaded"] else 0.0
+    return stats
+
 
 # -----------------------
-# Excel 套表生成函數
+# 序號自動完成（記憶體前綴索引，依 EditTime 增量更新）
 # -----------------------
-def create_print_template(records: list) -> io.BytesIO:
+SUGGEST_INDEX_DAYS = 60        # 只索引最近幾天的生產日報表
+_SUGGEST_REFRESH_SEC = 60
+_SUGGEST_MAX_WORKERS_HINT = 3  # 每個序號最多顯示幾位工作者
+_SUGGEST_DEFAULT_LIMIT = 10
+
+_SUGGEST_SQL = r"""
+    SELECT
+        c.DySerialNum,
+        CONVERT(varchar(10), c.CDate, 23) AS CDate,
+        c.EditTime,
+        a.WorkerNum,
+        a.WorkerName
+    FROM dbo.DayWorkDYBase c
+    LEFT JOIN dbo.TimeWorkBase a
+        ON a.DySerialNum = c.DySerialNum
+"""
+
+# 讀取時直接取用目前的索引物件，更新時建立新物件再整個替換，查詢不需加鎖
+_suggest_index = {
+    "serials": [],      # 已排序的序號（bisect 前綴搜尋）
+    "entries": {},      # 序號 -> {"work_date", "workers": [(編號, 名稱)]}
+    "watermark": None,  # 已載入的最大 EditTime
+    "loaded_at": None,
+}
+
+
+def _load_suggest_rows(since):
+    """since 為 None 時載入最近 SUGGEST_INDEX_DAYS 天，否則只載入 EditTime 之後有異動的"""
+    if since is None:
+        sql = _SUGGEST_SQL + "    WHERE c.CDate >= ?"
+        params = [(datetime.now() - timedelta(days=SUGGEST_INDEX_DAYS)).strftime('%Y-%m-%d')]
+    else:
+        sql = _SUGGEST_SQL + "    WHERE c.EditTime > ?"
+        params = [since]
+    conn = get_db_connection()
+    try:
+        return pd.read_sql(sql, conn, params=params)
+    finally:
+        conn.close()
+
+
+def refresh_suggest_index() -> int:
+    """增量更新索引並移除超過保留天數的序號，返回本次異動的序號數"""
+    global _suggest_index
+    current = _suggest_index
+    df = _load_suggest_rows(current["watermark"])
+
+    entries = dict(current["entries"])
+    watermark = current["watermark"]
+    if not df.empty:
+        df["DySerialNum"] = df["DySerialNum"].astype(str).str.strip().str.upper()
+        changed = {}
+        rows = df[["DySerialNum", "CDate", "WorkerNum", "WorkerName"]].drop_duplicates()
+        for serial, work_date, num, name in rows.itertuples(index=False):
+            entry = changed.get(serial)
+            if entry is None:
+                entry = changed[serial] = {"work_date": str(work_date or ''), "workers": []}
+            if pd.notnull(num) and len(entry["workers"]) < _SUGGEST_MAX_WORKERS_HINT:
+                entry["workers"].append((str(num).strip(), str(name).strip() if pd.notnull(name) else ''))
+        entries.update(changed)
+        latest = df["EditTime"].max()
+        if pd.notnull(latest) and (watermark is None or latest > watermark):
+            watermark = latest.to_pydatetime() if hasattr(latest, "to_pydatetime") else latest
+
+    cutoff = (datetime.now() - timedelta(days=SUGGEST_INDEX_DAYS)).strftime('%Y-%m-%d')
+    entries = {s: e for s, e in entries.items() if e["work_date"] >= cutoff}
+
+    _suggest_index = {
+        "serials": sorted(entries),
+        "entries": entries,
+        "watermark": watermark,
+        "loaded_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    return 0 if df.empty else df["DySerialNum"].nunique()
+
+
+def suggest_serials(prefix: str, limit: int = _SUGGEST_DEFAULT_LIMIT,
+                    work_date: str = '', worker: str = '') -> list:
+    """依前綴找出序號（可再以工作日期、工作者編號/名稱篩選），只讀記憶體索引"""
+    index = _suggest_index
+    serials = index["serials"]
+    key = normalize_dy_serial(prefix)
+    worker = worker.strip().upper()
+    result = []
+    for pos in range(bisect.bisect_left(serials, key), len(serials)):
+        serial = serials[pos]
+        if not serial.startswith(key):
+            break
+        entry = index["entries"][serial]
+        if work_date and entry["work_date"] != work_date:
+            continue
+        if worker and not any(worker in num.upper() or worker in name.upper() for num, name in entry["workers"]):
+            continue
+        result.append({
+            "dy_serial_num": serial,
+            "work_date": entry["work_date"],
+            "workers": [{"worker_num": num, "worker_name": name} for num, name in entry["workers"]],
+        })
+        if len(result) >= limit:
+            break
+    return result
+
+
+def _suggest_index_monitor() -> None:
+    """背景載入索引，之後定期增量更新"""
+    while True:
+        try:
+            started = time.perf_counter()
+            changed = refresh_suggest_index()
+            if changed:
+                logger.info(f"[序號索引] 更新 {changed} 筆，共 {len(_suggest_index['serials'])} 筆，"
+                            f"耗時 {(time.perf_counter() - started) * 1000:.0f} ms")
+        except Exception as e:
+            logger.warning(f"[序號索引] 更新失敗: {str(e)}")
+        time.sleep(_SUGGEST_REFRESH_SEC)
+
+
+# -----------------------
+# 查詢結果編碼（欄式 / 字典編碼）與回應壓縮
+# -----------------------
+# 重複值多的欄位改以字典編碼（值清單 + 索引）
+DICT_ENCODED_COLUMNS = ('工作者名稱', '工序編號', '工序內容', '發工單號', '產品編號', '品名規格',
+                        '起工型態', '機台編號', '機台部門', '除外名稱1', '除外名稱2', '除外名稱3')
+QUERY_RESPONSE_FORMATS = ('records', 'columnar', 'dict')
+
+_COMPRESS_MIN_BYTES = 1024
+_COMPRESS_MIMETYPES = ('application/json', 'text/html', 'text/css', 'text/csv', 'application/javascript')
+_GZIP_LEVEL = 6
+_BROTLI_QUALITY = 5
+
+
+def encode_report_frame(df, fmt: str) -> dict:
     """
-    創建列印套表（新版本：一張Excel包含2張修改申請）
-    
-    重要：
-    - 只使用 A-F 欄（6欄）
-    - 縮放比例 56%
-    - 2 張修改申請左右排列（不再有下方的表格）
-    - 合併儲存格的資料要放在起始儲存格（左上角）
+    將已格式化的查詢結果轉為回應內容
+    records: [{欄名: 值}, ...]（預設，舊格式）
+    columnar: {"columns": [...], "rows": [[...], ...]}
+    dict: 同 columnar，另以 "dictionaries" 記錄字典編碼欄位，rows 中對應位置為索引
     """
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "生產日報表"
-    
-    # 設定頁面
-    ws.page_setup.orientation = ws.ORIENTATION_LANDSCAPE
-    ws.page_setup.paperSize = ws.PAPERSIZE_A4
-    
-    # 頁面邊界（根據範本）
-    ws.page_margins.left = 0.0
-    ws.page_margins.right = 0.0
-    ws.page_margins.top = 0.0
-    ws.page_margins.bottom = 0.3937007874015748  # 1公分
-    ws.page_margins.header = 0.0
-    ws.page_margins.footer = 0.0
-    
-    # 置中方式：水平置中和垂直置中
-    ws.print_options.horizontalCentered = True
-    ws.print_options.verticalCentered = True
-    
-    # 關鍵：設定縮放比例為 56%
-    ws.page_setup.scale = 56
-    
-    # 符合頁數設定
-    ws.page_setup.fitToWidth = 1
-    ws.page_setup.fitToHeight = 1
-    
-    # 設定頁尾
-    ws.oddFooter.right.text = "生管：__________"
-    ws.oddFooter.right.font = "新細明體,粗體"
-    ws.oddFooter.right.size = 36
-    
-    # 樣式定義（正確的字體大小）
-    title_font = Font(name='新細明體', size=90, bold=True)
-    normal_font = Font(name='新細明體', size=30)
-    
-    thin_border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
-    
-    # 標題（A1:F3 合併）
-    ws.merge_cells('A1:F3')
-    title_cell = ws['A1']
-    title_cell.value = "生產日報表 修改申請"
-    title_cell.font = title_font
-    title_cell.alignment = Alignment(horizontal='center', vertical='center')
-    ws.row_dimensions[1].height = 41.25
-    ws.row_dimensions[2].height = 41.25
-    ws.row_dimensions[3].height = 41.25
-    
-    # 定義欄位和其數值格式
-    fields = [
-        ('工作日期', 'work_date', 'mm-dd-yy'),
-        ('工作者編號', 'worker_num', 'General'),
-        ('機台代號', 'machine_num', 'General'),
-        ('工序編號', 'prod_num', 'General'),
-        ('完工數', 'finish_qty', 'General'),
-        ('不良數', 'bad_qty', 'General'),
-        ('起工時間', 'start_time', 'yyyy/m/d h:mm'),
-        ('完工時間', 'finish_time', 'yyyy/m/d h:mm'),
-        ('除外名稱1', 'extra_name1', 'General'),
-        ('除外時間1', 'extra_time1', 'General'),
-        ('除外名稱2', 'extra_name2', 'General'),
-        ('除外時間2', 'extra_time2', 'General'),
-        ('除外名稱3', 'extra_name3', 'General'),
-        ('除外時間3', 'extra_time3', 'General'),
-    ]
-    
-    # 2 個表格的配置（左右排列）
-    configs = [
-        # 左邊
-        {'start_row': 4, 'label_col': 'A', 'value_col': 'B', 'mod_col': 'C',
-         'delete_label': '生產日報表刪除', 'delete_value_col': 'C'},
-        # 右邊
-        {'start_row': 4, 'label_col': 'D', 'value_col': 'E', 'mod_col': 'F',
-         'delete_label': '生產日報表刪除', 'delete_value_col': 'F'},
-    ]
-    
-    # 固定畫出 2 個表格（左右排列）
-    for idx, config in enumerate(configs):
-        start_row = config['start_row']
-        col_label = config['label_col']
-        col_value = config['value_col']
-        col_mod = config['mod_col']
-        delete_label = config['delete_label']
-        delete_value_col = config['delete_value_col']
-        
-        # 取得資料
-        rec = records[idx] if idx < len(records) else {}
-        
-        current_row = start_row
-        
-        # 第 1 行：★生產日報表序號（value:mod 合併）
-        cell = ws[f'{col_label}{current_row}']
-        cell.value = "★生產日報表序號"
-        cell.font = normal_font
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        cell.border = thin_border
-        
-        # 合併 value:mod 欄，資料放在 value 欄（合併起始儲存格）
-        ws.merge_cells(f'{col_value}{current_row}:{col_mod}{current_row}')
-        cell = ws[f'{col_value}{current_row}']
-        cell.value = rec.get('dy_serial_num', '')
-        cell.font = normal_font
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        cell.border = thin_border
-        # 也要設定 mod 欄的框線
-        cell = ws[f'{col_mod}{current_row}']
-        cell.border = thin_border
-        ws.row_dimensions[current_row].height = 39.95
-        
-        current_row += 1
-        
-        # 第 2 行：發工單號（value:mod 合併）
-        cell = ws[f'{col_label}{current_row}']
-        cell.value = "發工單號"
-        cell.font = normal_font
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        cell.border = thin_border
-        
-        # 合併 value:mod 欄，資料放在 value 欄（合併起始儲存格）
-        ws.merge_cells(f'{col_value}{current_row}:{col_mod}{current_row}')
-        cell = ws[f'{col_value}{current_row}']
-        cell.value = rec.get('pd_num', '')
-        cell.font = normal_font
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        cell.border = thin_border
-        # 也要設定 mod 欄的框線
+    if fmt == 'records':
+        return {"data": df.to_dict("records")}
+
+    columns = [str(c) for c in df.columns]
+    values = df.values.tolist()
+    payload = {"columns": columns, "rows": values}
+    if fmt == 'dict':
+        dictionaries = {}
+        for pos, col in enumerate(columns):
+            if col not in DICT_ENCODED_COLUMNS:
+                continue
+            codes, uniques = pd.factorize(df[col])  # 缺值為 -1
+            uniques = uniques.tolist()
+            # 不重複值接近列數時編碼沒有效益
+            if len(uniques) * 2 > len(values):
+                continue
+            for row, code in zip(values, codes):
+                row[pos] = int(code) if code >= 0 else None
+            dictionaries[col] = uniques
+        payload["dictionaries"] = dictionaries
+    return payload
+
+
+def _negotiate_encoding(accept_encoding: str):
+    """依 Accept-Encoding 選擇壓縮方式（br 優先，其次 gzip；q=0 表示拒絕）"""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        token, _, params = part.strip().partition(';')
+        token = token.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if token:
+            accepted[token] = q
+    for encoding in (('br', 'gzip') if brotli is not None else ('gzip',)):
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress_response(response):
+    """依用戶端支援壓縮文字回應（串流、檔案下載與已壓縮的回應不處理）"""
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code >= 300
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in _COMPRESS_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = _negotiate_encoding(request.headers.get('Accept-Encoding', ''))
+    if encoding is None:
+        return response
+
+    body = response.get_data()
+    if len(body) < _COMPRESS_MIN_BYTES:
+        return response
+
+    if encoding == 'br':
+        body = brotli.compress(body, quality=_BROTLI_QUALITY)
+    else:
+        body = gzip.compress(body, compresslevel=_GZIP_LEVEL)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+# -----------------------
+# 欄式大量匯出（分段讀取，Parquet 或 gzip CSV）
+# -----------------------
+_EXPORT_CHUNK_SIZE = 5000
+_EXPORT_MAX_DAYS = 366
+
+# 匯出欄位型別（其餘欄位一律為字串）
+EXPORT_FLOAT_COLUMNS = ['實際工時', '完工數', '不良數', '除外時間1', '除外時間2', '除外時間3']
+EXPORT_DATETIME_COLUMNS = ['工作日期', '起工時間', '完工時間', '編輯時間']
+
+
+def coerce_export_dtypes(chunk: pd.DataFrame) -> pd.DataFrame:
+    """套用固定欄位型別，確保每一段的 schema 一致"""
+    for col in chunk.columns:
+        if col in EXPORT_FLOAT_COLUMNS:
+            chunk[col] = pd.to_numeric(chunk[col], errors='coerce').astype('float64')
+        elif col in EXPORT_DATETIME_COLUMNS:
+            chunk[col] = pd.to_datetime(chunk[col], errors='coerce')
+        else:
+            chunk[col] = chunk[col].astype('string')
+    return chunk
+
+
+def export_report_columnar(where_sql: str, params: list, fmt: str, filepath: str) -> int:
+    """
+    以 read_sql chunksize 分段讀取報表並寫入檔案，回傳總筆數
+    fmt = 'parquet'（需 pyarrow）或 'csv'（gzip 壓縮）
+    """
+    sql = REPORT_SELECT_SQL + where_sql + REPORT_ORDER_SQL
+    total = 0
+    writer = None
+    conn = get_db_connection()
+    try:
+        if fmt == 'parquet':
+            schema = None
+            for chunk in pd.read_sql(sql, conn, params=params, chunksize=_EXPORT_CHUNK_SIZE):
+                table = pa.Table.from_pandas(coerce_export_dtypes(chunk), schema=schema, preserve_index=False)
+                if writer is None:
+                    schema = table.schema
+                    writer = pq.ParquetWriter(filepath, schema, compression='zstd')
+                writer.write_table(table)
+                total += len(chunk)
+        else:
+            with gzip.open(filepath, 'wt', encoding='utf-8-sig', newline='') as f:
+                for chunk in pd.read_sql(sql, conn, params=params, chunksize=_EXPORT_CHUNK_SIZE):
+                    coerce_export_dtypes(chunk).to_csv(
+                        f, header=(total == 0), index=False, date_format='%Y-%m-%d %H:%M:%S'
+                    )
+                    total += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+        conn.close()
+    return total
+
+
+def _parse_export_range(data: dict):
+    """解析匯出的日期區間（含起訖日），格式錯誤或超過上限時拋出 ValueError"""
+    start = parse_work_date(data.get('startDate'))
+    end = parse_work_date(data.get('endDate')) or start
+    if start is None:
+        raise ValueError("請輸入生產日報表序號或匯出起始日期（YYYY-MM-DD）")
+    if end < start:
+        raise ValueError("結束日期不可早於起始日期")
+    if (end - start).days + 1 > _EXPORT_MAX_DAYS:
+        raise ValueError(f"匯出區間不可超過 {_EXPORT_MAX_DAYS} 天")
+    return start, end
+
+
+# -----------------------
+# 生產彙總（SQL 端先依日期/工作者/機台/部門分組，再以 pandas 彙總各維度）
+# -----------------------
+_SUMMARY_CACHE_TTL_SEC = 300          # 區間含今天（資料仍會變動）
+_SUMMARY_CACHE_PAST_TTL_SEC = 3600    # 區間都在今天之前
+_SUMMARY_CACHE_MAX_ENTRIES = 50
+
+_SUMMARY_SQL = r"""
+    SELECT
+        CONVERT(varchar(10), c.CDate, 23) AS work_date,
+        a.WorkerNum AS worker_num,
+        MAX(a.WorkerName) AS worker_name,
+        a.MachineNr AS machine_num,
+        TRIM(f.PordDept) AS department,
+        COUNT(*) AS row_count,
+        SUM(CAST(b.TrueHr AS decimal(18,4))) AS hours,
+        SUM(b.FinishQty) AS finish_qty,
+        SUM(b.BadQty) AS bad_qty,
+        SUM(ISNULL(b.OtherHours1, 0) + ISNULL(b.OtherHours2, 0) + ISNULL(b.OtherHours3, 0)) AS excluded_hours
+""" + REPORT_FROM_SQL + r"""
+    WHERE c.CDate >= ? AND c.CDate < ?
+    GROUP BY CONVERT(varchar(10), c.CDate, 23), a.WorkerNum, a.MachineNr, TRIM(f.PordDept)
+"""
+
+# 維度 -> 分組欄位
+SUMMARY_DIMENSIONS = {
+    "worker": ["worker_num", "worker_name"],
+    "machine": ["machine_num"],
+    "department": ["department"],
+    "day": ["work_date"],
+}
+_SUMMARY_MEASURES = ["row_count", "hours", "finish_qty", "bad_qty", "excluded_hours"]
+
+_summary_cache = {}  # (起, 訖) -> (時間, 結果)
+_summary_cache_lock = threading.Lock()
+
+
+def _summary_metrics(frame) -> None:
+    """不良率 = 不良數 / (完工數 + 不良數)；數值四捨五入（就地修改）"""
+    produced = frame["finish_qty"] + frame["bad_qty"]
+    frame["defect_rate"] = (frame["bad_qty"] / produced.where(produced > 0)).round(4)
+    frame["row_count"] = frame["row_count"].astype(int)
+    for col in ("hours", "excluded_hours", "finish_qty", "bad_qty"):
+        frame[col] = frame[col].round(2)
+
+
+def build_production_summary(base) -> dict:
+    """由最細分組結果計算各維度彙總與總計"""
+    for col in _SUMMARY_MEASURES:
+        base[col] = pd.to_numeric(base[col], errors="coerce").fillna(0)
+    for col in ("worker_num", "worker_name", "machine_num", "department"):
+        base[col] = base[col].fillna("").astype(str).str.strip()
+
+    summary = {}
+    for name, keys in SUMMARY_DIMENSIONS.items():
+        grouped = base.groupby(keys, sort=True, dropna=False)[_SUMMARY_MEASURES].sum().reset_index()
+        _summary_metrics(grouped)
+        summary[name] = grouped.astype(object).where(pd.notnull(grouped), None).to_dict("records")
+
+    totals = base[_SUMMARY_MEASURES].sum().to_frame().T
+    _summary_metrics(totals)
+    total = totals.astype(object).where(pd.notnull(totals), None).to_dict("records")[0]
+    return {"summary": summary, "totals": total}
+
+
+def get_production_summary(start, end) -> tuple:
+    """依日期區間（含起訖日）取得彙總，返回 (結果, 是否來自快取)；查詢失敗時拋出例外"""
+    key = (start, end)
+    ttl = _SUMMARY_CACHE_PAST_TTL_SEC if end < datetime.now().date() else _SUMMARY_CACHE_TTL_SEC
+    with _summary_cache_lock:
+        entry = _summary_cache.get(key)
+    if entry and time.time() - entry[0] <= ttl:
+        return entry[1], True
+
+    conn = get_db_connection()
+    try:
+        base = pd.read_sql(_SUMMARY_SQL, conn, params=[
+            start.strftime('%Y-%m-%d'), (end + timedelta(days=1)).strftime('%Y-%m-%d')
+        ])
+    finally:
+        conn.close()
+
+    result = build_production_summary(base)
+    result["generated_at"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with _summary_cache_lock:
+        _summary_cache[key] = (time.time(), result)
+        if len(_summary_cache) > _SUMMARY_CACHE_MAX_ENTRIES:
+            oldest = min(_summary_cache, key=lambda k: _summary_cache[k][0])
+            del _summary_cache[oldest]
+    return result, False
+
+
+# -----------------------
+# 修改申請記錄模型
+# -----------------------
+# 可修改的 14 個欄位（順序同 CSV 與列印套表）
+EDITABLE_FIELDS = (
+    'work_date', 'worker_num', 'machine_num', 'prod_num',
+    'finish_qty', 'bad_qty', 'start_time', 'finish_time',
+    'extra_name1', 'extra_time1', 'extra_name2', 'extra_time2',
+    'extra_name3', 'extra_time3',
+)
+
+# 列印套表的欄位名稱與數值格式（順序同 EDITABLE_FIELDS）
+PRINT_FIELDS = [
+    ('工作日期', 'work_date', 'mm-dd-yy'),
+    ('工作者編號', 'worker_num', 'General'),
+    ('機台代號', 'machine_num', 'General'),
+    ('工序編號', 'prod_num', 'General'),
+    ('完工數', 'finish_qty', 'General'),
+    ('不良數', 'bad_qty', 'General'),
+    ('起工時間', 'start_time', 'yyyy/m/d h:mm'),
+    ('完工時間', 'finish_time', 'yyyy/m/d h:mm'),
+    ('除外名稱1', 'extra_name1', 'General'),
+    ('除外時間1', 'extra_time1', 'General'),
+    ('除外名稱2', 'extra_name2', 'General'),
+    ('除外時間2', 'extra_time2', 'General'),
+    ('除外名稱3', 'extra_name3', 'General'),
+    ('除外時間3', 'extra_time3', 'General'),
+]
+
+# CSV 欄位順序
+CSV_COLUMNS = [
+    '生產日報表序號', '刪除(Y/N)', '發工單號', '工作日期', '工作者編號',
+    '機台編號', '工序編號', '完工數', '不良數', '起工時間', '完工時間',
+    '除外名稱1', '除外時間1', '除外名稱2', '除外時間2', '除外名稱3', '除外時間3',
+    '儲存時間'
+]
+
+# 可修改欄位對應的中文欄名（同 CSV 與查詢結果欄名）
+FIELD_LABELS = dict(zip(EDITABLE_FIELDS, CSV_COLUMNS[3:3 + len(EDITABLE_FIELDS)]))
+
+DATETIME_FIELDS = ('start_time', 'finish_time')
+NUMERIC_FIELDS = ('finish_qty', 'bad_qty', 'extra_time1', 'extra_time2', 'extra_time3')
+DATETIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y/%m/%d %H:%M:%S', '%Y/%m/%d %H:%M')
+
+
+def parse_work_date(value):
+    """解析工作日期（可含時間、/ 或 - 分隔），失敗回傳 None"""
+    date_part = str(value or '').strip().split(' ')[0].replace('/', '-')
+    if not date_part:
+        return None
+    try:
+        return datetime.strptime(date_part, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def parse_datetime(value):
+    """依 DATETIME_FORMATS 解析日期時間字串，失敗回傳 None"""
+    for fmt in DATETIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def _is_number(value: str) -> bool:
+    try:
+        return float(value) >= 0
+    except ValueError:
+        return False
+
+
+def _clean(value) -> str:
+    return '' if value is None else str(value).strip()
+
+
+class ModificationRecord:
+    """
+    列印清單中的一筆修改申請
+    - 儲存時驗證並正規化一次，之後視為不可變
+    - 以 __slots__ 儲存 14 個欄位的修改值；原本值共用查詢時的資料列快照（RowSnapshot）
+    - 屬性名稱與原本的 JSON key 相同（{field}_original 為唯讀屬性），print_template.html 可直接使用
+    """
+    __slots__ = (
+        'record_id', 'dy_serial_num', 'pd_num', 'delete_flag', 'date_type', 'saved_time',
+        'work_day', '_json', '_queue_json', 'pd_serial_num', 'ordinal_num', 'edit_time', 'snapshot',
+        'history', 'csv_path',
+    ) + tuple(f'{field}_modified' for field in EDITABLE_FIELDS)
+
+    @classmethod
+    def from_payload(cls, data: dict, saved_time: str = None, validate: bool = True,
+                     snapshot: 'RowSnapshot' = None) -> 'ModificationRecord':
+        """
+        由 /api/save 的 JSON 建立記錄，驗證失敗時拋出 ValueError（訊息可直接回傳前端）
+        validate=False 時略過逐筆格式檢查（呼叫端已做過批次驗證）
+        原本值依序取自：snapshot 參數 → 查詢時保存的資料列快照 → JSON 中的 {field}_original
+        """
+        rec = cls()
+        rec.record_id = uuid.uuid4().hex[:16]
+        rec.dy_serial_num = normalize_dy_serial(data.get('dy_serial_num'))
+        if not rec.dy_serial_num:
+            raise ValueError("缺少生產日報表序號")
+
+        # 資料列鍵值與查詢當時的編輯時間（回寫模式使用）
+        rec.pd_serial_num = _clean(data.get('pd_serial_num'))
+        rec.ordinal_num = _clean(data.get('ordinal_num'))
+        if snapshot is None:
+            snapshot = resolve_row_snapshot(rec.dy_serial_num, rec.pd_serial_num, rec.ordinal_num, data)
+        rec.snapshot = snapshot
+        rec.pd_num = snapshot.pd_num
+        rec.edit_time = snapshot.edit_time
+
+        rec.delete_flag = '是' if _clean(data.get('delete_flag')) == '是' else '否'
+        date_type = _clean(data.get('date_type'))
+        rec.date_type = date_type if date_type in ('same_day', 'different_day') else ''
+        rec.saved_time = saved_time or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        rec._json = None
+        rec._queue_json = None
+        rec.history = ()
+        rec.csv_path = None
+
+        for field in EDITABLE_FIELDS:
+            setattr(rec, f'{field}_modified', _clean(data.get(f'{field}_modified')))
+
+        # 驗證：勾選刪除或至少 1 個欄位有輸入
+        if not rec.is_delete and not any(rec.modified(f) for f in EDITABLE_FIELDS):
+            raise ValueError("尚未輸入任何修改資訊")
+
+        errors = rec.validate() if validate else []
+        if errors:
+            raise ValueError("；".join(errors))
+
+        # 工作日期只解析一次，之後判斷當天/非當天直接比較
+        rec.work_day = parse_work_date(rec.original('work_date') or rec.work_date_modified or data.get('work_date'))
+        if rec.work_day is None:
+            logger.warning(f"[日期判斷] 序號 {rec.dy_serial_num} 沒有可解析的工作日期，視為非當天")
+        return rec
+
+    @classmethod
+    def from_journal(cls, data: dict) -> 'ModificationRecord':
+        """由清單日誌（to_json 的內容）還原記錄，保留原本的識別碼、儲存時間與當時的原本值"""
+        snapshot = snapshot_from_payload(normalize_dy_serial(data.get('dy_serial_num')), data)
+        rec = cls.from_payload(data, saved_time=data.get('saved_time'), validate=False, snapshot=snapshot)
+        rec.record_id = data['record_id']
+        rec.history = tuple(data.get('history') or ())
+        if data.get('csv_file'):
+            rec.csv_path = os.path.join(LOCAL_EXPORT_DIR, data['csv_file'])
+        return rec
+
+    def history_entry(self) -> dict:
+        """修改歷程的一筆：儲存時間、是否刪除、有輸入的欄位"""
+        return {
+            'saved_time': self.saved_time,
+            'delete_flag': self.delete_flag,
+            'fields': {f: self.modified(f) for f in EDITABLE_FIELDS if self.modified(f)},
+        }
+
+    def merged_with(self, previous: 'ModificationRecord') -> 'ModificationRecord':
+        """
+        合併同一資料列較早的修改申請，返回新的記錄（兩筆原記錄不變）
+        本筆有輸入的欄位為準，未輸入的沿用 previous；本筆勾選刪除時刪除為準、不保留修改值
+        """
+        rec = ModificationRecord()
+        for slot in ModificationRecord.__slots__:
+            setattr(rec, slot, getattr(self, slot))
+        rec._json = None
+        rec._queue_json = None
+        rec.csv_path = None  # 合併後的記錄另外生成自己的 CSV
+        if not self.is_delete:
+            for field in EDITABLE_FIELDS:
+                if not self.modified(field):
+                    setattr(rec, f'{field}_modified', previous.modified(field))
+            rec.work_day = parse_work_date(rec.original('work_date') or rec.work_date_modified) or self.work_day
+        rec.history = (previous.history or (previous.history_entry(),)) + (self.history_entry(),)
+        return rec
+
+    @property
+    def edit_count(self) -> int:
+        return len(self.history) or 1
+
+    def validate(self) -> list:
+        """檢查修改值格式，回傳錯誤訊息列表"""
+        if self.is_delete:
+            return []
+
+        errors = []
+        if self.work_date_modified and parse_work_date(self.work_date_modified) is None:
+            errors.append(f"工作日期格式錯誤: {self.work_date_modified}")
+        for field in DATETIME_FIELDS:
+            value = self.modified(field)
+            if value and parse_datetime(value) is None:
+                errors.append(f"{FIELD_LABELS[field]}格式錯誤: {value}")
+        for field in NUMERIC_FIELDS:
+            value = self.modified(field)
+            if value and not _is_number(value):
+                errors.append(f"{FIELD_LABELS[field]}必須是非負數字: {value}")
+        return errors
+
+    @property
+    def is_delete(self) -> bool:
+        return self.delete_flag == '是'
+
+    @property
+    def delete_mark(self) -> str:
+        return 'Y' if self.is_delete else 'N'
+
+    def original(self, field: str) -> str:
+        return self.snapshot.values[_FIELD_INDEX[field]]
+
+    def modified(self, field: str) -> str:
+        return getattr(self, f'{field}_modified')
+
+    def to_csv_row(self) -> list:
+        """CSV 一列（順序同 CSV_COLUMNS）；刪除申請輸出原本值，否則輸出修改值"""
+        values = list(self.snapshot.values) if self.is_delete else [self.modified(f) for f in EDITABLE_FIELDS]
+        return [self.dy_serial_num, self.delete_mark, self.pd_num] + values + [self.saved_time]
+
+    def to_sheet(self) -> list:
+        """列印套表的 (原本, 修改為) 值（順序同 PRINT_FIELDS），日期時間欄位轉為 datetime"""
+        rows = []
+        for field in EDITABLE_FIELDS:
+            original = '' if self.is_delete else self.original(field)
+            modified = self.modified(field)
+            if field in DATETIME_FIELDS:
+                original = (parse_datetime(original) or original) if original else original
+                modified = (parse_datetime(modified) or modified) if modified else modified
+            rows.append((original, modified))
+        return rows
+
+    def to_json(self) -> dict:
+        """完整 dict（只含非空欄位，結果快取）；清單日誌使用，重新啟動後可還原原本值"""
+        if self._json is None:
+            data = {
+                'record_id': self.record_id,
+                'dy_serial_num': self.dy_serial_num,
+                'pd_num': self.pd_num,
+                'delete_flag': self.delete_flag,
+                'saved_time': self.saved_time,
+            }
+            if self.date_type:
+                data['date_type'] = self.date_type
+            for key in ('pd_serial_num', 'ordinal_num', 'edit_time'):
+                if getattr(self, key):
+                    data[key] = getattr(self, key)
+            for field in EDITABLE_FIELDS:
+                for kind in ('original', 'modified'):
+                    value = getattr(self, f'{field}_{kind}')
+                    if value:
+                        data[f'{field}_{kind}'] = value
+            if self.history:
+                data['history'] = list(self.history)
+            if self.csv_path:
+                data['csv_file'] = os.path.basename(self.csv_path)
+            self._json = data
+        return self._json
+
+    def to_queue_json(self) -> dict:
+        """清單狀態輪詢用：不含原本值（原本值留在伺服器端快照）與修改歷程（只給次數）"""
+        if self._queue_json is None:
+            data = {k: v for k, v in self.to_json().items()
+                    if not k.endswith('_original') and k not in ('history', 'csv_file')}
+            if self.history:
+                data['edit_count'] = self.edit_count
+            self._queue_json = data
+        return self._queue_json
+
+    def attach_csv(self, path: str) -> None:
+        """記下這筆記錄已生成的 CSV 路徑（上傳、列印、刪除都只使用這個檔案）"""
+        self.csv_path = path
+        self._json = None
+        self._queue_json = None
+
+    def has_csv(self) -> bool:
+        return bool(self.csv_path) and os.path.exists(self.csv_path)
+
+
+_FIELD_INDEX = {field: i for i, field in enumerate(EDITABLE_FIELDS)}
+
+
+def _original_property(field: str) -> property:
+    index = _FIELD_INDEX[field]
+    return property(lambda self: self.snapshot.values[index])
+
+
+for _field in EDITABLE_FIELDS:
+    setattr(ModificationRecord, f'{_field}_original', _original_property(_field))
+
+
+# -----------------------
+# 查詢資料列快照（原本值以 /api/query 回傳給前端的資料為準，儲存時不需回傳）
+# -----------------------
+_ROW_SNAPSHOT_TTL_SEC = 12 * 3600       # 查詢後超過此時間未儲存需重新查詢
+_ROW_SNAPSHOT_MAX_ENTRIES = 20000
+
+# 查詢結果中的一列：(序號, 製令序號, 序次) 與 14 個欄位的原本值（順序同 EDITABLE_FIELDS），建立後不可變
+RowSnapshot = namedtuple('RowSnapshot', ('key', 'pd_num', 'edit_time', 'values'))
+
+_row_snapshots = OrderedDict()  # key -> (RowSnapshot, 保存時間)
+_row_snapshots_lock = threading.Lock()
+
+
+def row_key(dy_serial_num: str, pd_serial_num: str, ordinal_num: str) -> tuple:
+    return (dy_serial_num, _clean(pd_serial_num), _clean(ordinal_num))
+
+
+def snapshot_from_row(dy_serial_num: str, source) -> RowSnapshot:
+    """由查詢結果的一列（已 format_report_frame）建立快照"""
+    return RowSnapshot(
+        key=row_key(dy_serial_num, _format_original_value(source.get('製令序號')),
+                    _format_original_value(source.get('序次'))),
+        pd_num=_format_original_value(source.get('發工單號')),
+        edit_time=_format_original_value(source.get('編輯時間')),
+        values=tuple(_format_original_value(source.get(FIELD_LABELS[field])) for field in EDITABLE_FIELDS),
+    )
+
+
+def snapshot_from_payload(dy_serial_num: str, data: dict) -> RowSnapshot:
+    """由 JSON 中的 {field}_original 建立快照（清單日誌與未帶資料列鍵值的舊版前端）"""
+    return RowSnapshot(
+        key=row_key(dy_serial_num, data.get('pd_serial_num'), data.get('ordinal_num')),
+        pd_num=_clean(data.get('pd_num')),
+        edit_time=_clean(data.get('edit_time')),
+        values=tuple(_clean(data.get(f'{field}_original')) for field in EDITABLE_FIELDS),
+    )
+
+
+def store_report_snapshots(dy_serial_num: str, df) -> None:
+    """保存 /api/query 回傳的每一列；同一列重新查詢時以新的快照取代"""
+    now = time.time()
+    snapshots = [snapshot_from_row(dy_serial_num, row) for _, row in df.iterrows()]
+    with _row_snapshots_lock:
+        for snapshot in snapshots:
+            if not all(snapshot.key):
+                continue
+            _row_snapshots[snapshot.key] = (snapshot, now)
+            _row_snapshots.move_to_end(snapshot.key)
+        while len(_row_snapshots) > _ROW_SNAPSHOT_MAX_ENTRIES:
+            _row_snapshots.popitem(last=False)
+
+
+def get_row_snapshot(key: tuple):
+    with _row_snapshots_lock:
+        entry = _row_snapshots.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[1] > _ROW_SNAPSHOT_TTL_SEC:
+            del _row_snapshots[key]
+            return None
+        return entry[0]
+
+
+def resolve_row_snapshot(dy_serial_num: str, pd_serial_num: str, ordinal_num: str, data: dict) -> RowSnapshot:
+    """
+    儲存時取得原本值：有資料列鍵值時使用查詢時保存的快照（不採用前端送來的原本值）
+    快照由最近一次查詢（任一工作站）覆寫，前端送回的編輯時間必須與快照相同，
+    否則頁面上的資料已過時（回寫的 EditTime 比對與原本值都會不正確），拋出 ValueError
+    快照已過期且前端未送原本值時拋出 ValueError
+    """
+    key = row_key(dy_serial_num, pd_serial_num, ordinal_num)
+    if all(key):
+        snapshot = get_row_snapshot(key)
+        if snapshot is not None:
+            if _clean(data.get('edit_time')) != snapshot.edit_time:
+                raise ValueError("查詢後此資料已被修改（編輯時間不符），請重新查詢後再儲存")
+            return snapshot
+        if not any(data.get(f'{field}_original') for field in EDITABLE_FIELDS):
+            raise ValueError("查詢資料已過期，請重新查詢後再儲存")
+    return snapshot_from_payload(dy_serial_num, data)
+
+
+def get_row_snapshot_stats() -> dict:
+    with _row_snapshots_lock:
+        return {"entries": len(_row_snapshots), "max_entries": _ROW_SNAPSHOT_MAX_ENTRIES}
+
+
+# -----------------------
+# 列印清單管理（全域變數，不限筆數）
+# -----------------------
+print_queue = []  # 每個元素是一個 ModificationRecord
+pending_print_records = []  # 臨時存儲待列印的記錄（避免 print_queue 被修改）
+
+# (序號, 製令序號, 序次) -> 清單中該資料列的記錄；清單整個替換後以 _rebuild_row_index 重建（呼叫端持有 _queue_lock）
+_queued_rows = {}
+
+# 上傳/列印進行中的記錄識別碼：這些記錄完成後會整筆移出清單，期間同一資料列的新修改不合併進去
+_dispatching_ids = set()
+
+
+def hold_for_dispatch(records: list) -> None:
+    with _queue_lock:
+        _dispatching_ids.update(r.record_id for r in records)
+
+
+def release_dispatch(records: list) -> None:
+    with _queue_lock:
+        _dispatching_ids.difference_update(r.record_id for r in records)
+
+
+def find_record_csv_files(records: list) -> tuple:
+    """返回 (每筆記錄自己的 CSV 檔名, 找不到 CSV 的序號)；不以序號比對，避免帶到期間新儲存的記錄"""
+    filenames, missing = [], []
+    for record in records:
+        if record.has_csv():
+            filenames.append(os.path.basename(record.csv_path))
+        else:
+            missing.append(record.dy_serial_num)
+    return filenames, missing
+
+
+def _queue_row_key(record: ModificationRecord):
+    """可合併的資料列鍵值；沒有完整鍵值（舊版前端）的記錄不合併"""
+    key = record.snapshot.key
+    return key if all(key) else None
+
+
+def _rebuild_row_index() -> None:
+    global _queued_rows
+    index = {}
+    for record in print_queue:
+        key = _queue_row_key(record)
+        if key is not None:
+            index[key] = record
+    _queued_rows = index
+
+
+def _merge_or_append(record: ModificationRecord) -> tuple:
+    """
+    加入清單；同一資料列已在清單中時合併並取代原位置（呼叫端持有 _queue_lock，日誌與檔案由呼叫端處理）
+    返回 (清單中的記錄, 被取代的記錄或 None)
+    """
+    key = _queue_row_key(record) if MERGE_REPEATED_EDITS else None
+    previous = _queued_rows.get(key) if key is not None else None
+    if previous is not None and previous.record_id in _dispatching_ids:
+        previous = None
+    position = None
+    if previous is not None:
+        position = next((i for i, r in enumerate(print_queue) if r is previous), None)
+    if position is None:
+        print_queue.append(record)
+        if key is not None:
+            _queued_rows[key] = record
+        return record, None
+
+    merged = record.merged_with(previous)
+    print_queue[position] = merged
+    _queued_rows[key] = merged
+    return merged, previous
+
+
+def _remove_record_csv(record: ModificationRecord) -> None:
+    """刪除記錄已生成的 CSV（尚未生成時不需處理）"""
+    try:
+        if record.has_csv():
+            os.remove(record.csv_path)
+            logger.info(f"已刪除 CSV: {os.path.basename(record.csv_path)}")
+    except OSError as e:
+        logger.warning(f"刪除 CSV 失敗（序號 {record.dy_serial_num}）: {str(e)}")
+
+
+def queue_record(record: ModificationRecord) -> tuple:
+    """單筆儲存加入清單（同一資料列合併），寫入日誌並刪除被取代記錄的 CSV；返回 (清單中的記錄, 被取代的記錄或 None)"""
+    with _queue_lock:
+        queued, previous = _merge_or_append(record)
+        if previous is not None:
+            journal_replace([(previous, queued)])
+            _remove_record_csv(previous)
+        else:
+            journal_add([queued])
+    return queued, previous
+
+# 判斷記錄是否為當天
+def is_same_day_record(record: ModificationRecord) -> bool:
+    """判斷記錄的工作日期是否為當天（工作日期已在儲存時解析）"""
+    return record.work_day is not None and record.work_day == datetime.now().date()
+
+# -----------------------
+# Excel 套表生成函數
+# -----------------------
+def create_print_template(records: list) -> io.BytesIO:
+    """
+    創建列印套表（新版本：一張Excel包含2張修改申請）
+    
+    重要：
+    - 只使用 A-F 欄（6欄）
+    - 縮放比例 56%
+    - 2 張修改申請左右排列（不再有下方的表格）
+    - 合併儲存格的資料要放在起始儲存格（左上角）
+    """
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "生產日報表"
+    _fill_print_sheet(ws, records, _print_styles())
+    
+    output = io.BytesIO()
+    wb.save(output)
+    output.seek(0)
+    return output
+
+
+def create_consolidated_print_workbook(batches: list) -> io.BytesIO:
+    """
+    合併列印模式：所有批次寫入同一個活頁簿，每 2 筆一個工作表（版面同 create_print_template，
+    各工作表各自保有 56% A4 橫向設定），樣式物件共用
+    """
+    wb = Workbook()
+    styles = _print_styles()
+    for page, batch in enumerate(batches, start=1):
+        ws = wb.active if page == 1 else wb.create_sheet()
+        ws.title = f"生產日報表{page}"
+        _fill_print_sheet(ws, batch, styles)
+    
+    output = io.BytesIO()
+    wb.save(output)
+    output.seek(0)
+    return output
+
+
+def _print_styles() -> dict:
+    """列印套表的字型與框線（正確的字體大小）"""
+    return {
+        'title_font': Font(name='新細明體', size=90, bold=True),
+        'normal_font': Font(name='新細明體', size=30),
+        'thin_border': Border(
+            left=Side(style='thin'),
+            right=Side(style='thin'),
+            top=Side(style='thin'),
+            bottom=Side(style='thin')
+        ),
+    }
+
+
+def _fill_print_sheet(ws, records: list, styles: dict) -> None:
+    """在工作表畫出一頁套表（最多 2 張修改申請左右排列）"""
+    # 設定頁面
+    ws.page_setup.orientation = ws.ORIENTATION_LANDSCAPE
+    ws.page_setup.paperSize = ws.PAPERSIZE_A4
+    
+    # 頁面邊界（根據範本）
+    ws.page_margins.left = 0.0
+    ws.page_margins.right = 0.0
+    ws.page_margins.top = 0.0
+    ws.page_margins.bottom = 0.3937007874015748  # 1公分
+    ws.page_margins.header = 0.0
+    ws.page_margins.footer = 0.0
+    
+    # 置中方式：水平置中和垂直置中
+    ws.print_options.horizontalCentered = True
+    ws.print_options.verticalCentered = True
+    
+    # 關鍵：設定縮放比例為 56%
+    ws.page_setup.scale = 56
+    
+    # 符合頁數設定
+    ws.page_setup.fitToWidth = 1
+    ws.page_setup.fitToHeight = 1
+    
+    # 設定頁尾
+    ws.oddFooter.right.text = "生管：__________"
+    ws.oddFooter.right.font = "新細明體,粗體"
+    ws.oddFooter.right.size = 36
+    
+    # 樣式（同一活頁簿共用）
+    title_font = styles['title_font']
+    normal_font = styles['normal_font']
+    thin_border = styles['thin_border']
+    
+    # 標題（A1:F3 合併）
+    ws.merge_cells('A1:F3')
+    title_cell = ws['A1']
+    title_cell.value = "生產日報表 修改申請"
+    title_cell.font = title_font
+    title_cell.alignment = Alignment(horizontal='center', vertical='center')
+    ws.row_dimensions[1].height = 41.25
+    ws.row_dimensions[2].height = 41.25
+    ws.row_dimensions[3].height = 41.25
+    
+    # 2 個表格的配置（左右排列）
+    configs = [
+        # 左邊
+        {'start_row': 4, 'label_col': 'A', 'value_col': 'B', 'mod_col': 'C',
+         'delete_label': '生產日報表刪除', 'delete_value_col': 'C'},
+        # 右邊
+        {'start_row': 4, 'label_col': 'D', 'value_col': 'E', 'mod_col': 'F',
+         'delete_label': '生產日報表刪除', 'delete_value_col': 'F'},
+    ]
+    
+    # 固定畫出 2 個表格（左右排列）
+    for idx, config in enumerate(configs):
+        start_row = config['start_row']
+        col_label = config['label_col']
+        col_value = config['value_col']
+        col_mod = config['mod_col']
+        delete_label = config['delete_label']
+        delete_value_col = config['delete_value_col']
+        
+        # 取得資料（不足 2 筆時右邊留白）
+        rec = records[idx] if idx < len(records) else None
+        sheet_values = rec.to_sheet() if rec else [('', '')] * len(PRINT_FIELDS)
+        
+        current_row = start_row
+        
+        # 第 1 行：★生產日報表序號（value:mod 合併）
+        cell = ws[f'{col_label}{current_row}']
+        cell.value = "★生產日報表序號"
+        cell.font = normal_font
+        cell.alignment = Alignment(horizontal='center', vertical='center')
+        cell.border = thin_border
+        
+        # 合併 value:mod 欄，資料放在 value 欄（合併起始儲存格）
+        ws.merge_cells(f'{col_value}{current_row}:{col_mod}{current_row}')
+        cell = ws[f'{col_value}{current_row}']
+        cell.value = rec.dy_serial_num if rec else ''
+        cell.font = normal_font
+        cell.alignment = Alignment(horizontal='center', vertical='center')
+        cell.border = thin_border
+        # 也要設定 mod 欄的框線
+        cell = ws[f'{col_mod}{current_row}']
+        cell.border = thin_border
+        ws.row_dimensions[current_row].height = 39.95
+        
+        current_row += 1
+        
+        # 第 2 行：發工單號（value:mod 合併）
+        cell = ws[f'{col_label}{current_row}']
+        cell.value = "發工單號"
+        cell.font = normal_font
+        cell.alignment = Alignment(horizontal='center', vertical='center')
+        cell.border = thin_border
+        
+        # 合併 value:mod 欄，資料放在 value 欄（合併起始儲存格）
+        ws.merge_cells(f'{col_value}{current_row}:{col_mod}{current_row}')
+        cell = ws[f'{col_value}{current_row}']
+        cell.value = rec.pd_num if rec else ''
+        cell.font = normal_font
+        cell.alignment = Alignment(horizontal='center', vertical='center')
+        cell.border = thin_border
+        # 也要設定 mod 欄的框線
+        cell = ws[f'{col_mod}{current_row}']
+        cell.border = thin_border
+        ws.row_dimensions[current_row].height = 39.95
+        
+        current_row += 1
+        
+        # 第 3 行：刪除行（不合併，各自獨立）
+        cell = ws[f'{col_label}{current_row}']
+        cell.value = delete_label
+        cell.font = normal_font
+        cell.alignment = Alignment(horizontal='center', vertical='center')
+        cell.border = thin_border
+        
+        # 刪除值的處理
+        delete_mark = rec.delete_mark if rec else ''
+        
+        # 原本欄位（col_value）
+        cell = ws[f'{col_value}{current_row}']
+        cell.font = normal_font
+        cell.alignment = Alignment(horizontal='center', vertical='center')
+        cell.border = thin_border
+        # 根據 delete_value_col 決定是否要在這裡顯示刪除標記
+        if delete_value_col == col_value:
+            cell.value = delete_mark
+        
+        # 修改為欄位（col_mod）
         cell = ws[f'{col_mod}{current_row}']
+        cell.font = normal_font
+        cell.alignment = Alignment(horizontal='center', vertical='center')
         cell.border = thin_border
+        # 根據 delete_value_col 決定是否要在這裡顯示刪除標記
+        if delete_value_col == col_mod:
+            cell.value = delete_mark
+        
         ws.row_dimensions[current_row].height = 39.95
         
-        current_row += 1
+        current_row += 1
+        
+        # 第 4 行：原本/修改為標題（不合併）
+        cell = ws[f'{col_value}{current_row}']
+        cell.value = "原本"
+        cell.font = normal_font
+        cell.alignment = Alignment(horizontal='center', vertical='center')
+        cell.border = thin_border
+        
+        cell = ws[f'{col_mod}{current_row}']
+        cell.value = "修改為"
+        cell.font = normal_font
+        cell.alignment = Alignment(horizontal='center', vertical='center')
+        cell.border = thin_border
+        
+        ws.row_dimensions[current_row].height = 39.95
+        
+        current_row += 1
+        
+        # 14 個欄位（全部不合併）
+        for (field_name, field_key, number_format), (original_value, modified_value) in zip(PRINT_FIELDS, sheet_values):
+            cell = ws[f'{col_label}{current_row}']
+            cell.value = field_name
+            cell.font = normal_font
+            cell.alignment = Alignment(horizontal='center', vertical='center')
+            cell.border = thin_border
+            
+            # 處理原本值（刪除操作時 to_sheet 已留空，日期時間已轉為 datetime）
+            cell = ws[f'{col_value}{current_row}']
+            cell.value = original_value
+            cell.font = normal_font
+            cell.alignment = Alignment(horizontal='center', vertical='center')
+            cell.border = thin_border
+            cell.number_format = number_format
+            
+            # 處理修改值
+            cell = ws[f'{col_mod}{current_row}']
+            cell.value = modified_value
+            cell.font = normal_font
+            cell.alignment = Alignment(horizontal='center', vertical='center')
+            cell.border = thin_border
+            cell.number_format = number_format
+            
+            ws.row_dimensions[current_row].height = 39.95
+            current_row += 1
+    
+    # 底部合併儲存格（第 22-23 行合併，但內容為空）
+    ws.merge_cells('A22:F23')
+    # 不設定值，保持為空
+    ws.row_dimensions[22].height = 41.25
+    ws.row_dimensions[23].height = 41.25
+    
+    # 設定欄寬（按照範本）
+    ws.column_dimensions['A'].width = 57.28515625
+    ws.column_dimensions['B'].width = 40.7109375
+    ws.column_dimensions['C'].width = 40.0  # 修正為 40
+    ws.column_dimensions['D'].width = 57.28515625
+    ws.column_dimensions['E'].width = 40.7109375
+    ws.column_dimensions['F'].width = 40.0  # 修正為 40
+
+
+# -----------------------
+# Excel 平行生成（多行程）
+# -----------------------
+# openpyxl 屬 CPU 密集且持有 GIL，大量非當天記錄時改由行程池分散到多核心
+EXCEL_PARALLEL_ENABLED = True
+_EXCEL_PARALLEL_MIN_BATCHES = 4   # 批次數少於此值時行程啟動成本不划算，維持單行程
+_EXCEL_PARALLEL_MAX_WORKERS = max(1, min(8, (os.cpu_count() or 1) - 1))
+
+_excel_pool = None
+_excel_pool_lock = threading.Lock()
+_excel_pool_broken = False
+_mp_freeze_support_ready = False  # 打包後須先呼叫 freeze_support 才能啟動子行程
+
+
+def _build_workbook_bytes(batch: list) -> bytes:
+    """子行程工作：將一個批次（最多 2 筆）轉成 Excel 內容"""
+    return create_print_template(batch).getvalue()
+
+
+def _parallel_excel_available() -> bool:
+    if not EXCEL_PARALLEL_ENABLED or _excel_pool_broken or _EXCEL_PARALLEL_MAX_WORKERS < 2:
+        return False
+    if getattr(sys, 'frozen', False) and not _mp_freeze_support_ready:
+        return False
+    return True
+
+
+def _get_excel_pool():
+    global _excel_pool
+    with _excel_pool_lock:
+        if _excel_pool is None:
+            _excel_pool = ProcessPoolExecutor(max_workers=_EXCEL_PARALLEL_MAX_WORKERS)
+            logger.info(f"已建立 Excel 生成行程池（{_EXCEL_PARALLEL_MAX_WORKERS} 個行程）")
+        return _excel_pool
+
+
+def _disable_excel_pool(reason: str) -> None:
+    """行程池無法使用時改回單行程模式（之後不再嘗試）"""
+    global _excel_pool, _excel_pool_broken
+    with _excel_pool_lock:
+        _excel_pool_broken = True
+        pool, _excel_pool = _excel_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False)
+    logger.warning(f"Excel 平行生成不可用，改為單行程模式: {reason}")
+
+
+def build_workbooks(batches: list) -> list:
+    """
+    依序返回每個批次的 Excel 內容（順序與 batches 相同）
+    批次數足夠且行程池可用時平行生成，否則（或失敗時）單行程生成
+    """
+    if len(batches) >= _EXCEL_PARALLEL_MIN_BATCHES and _parallel_excel_available():
+        try:
+            return list(_get_excel_pool().map(_build_workbook_bytes, batches))
+        except (BrokenProcessPool, OSError, ImportError, pickle.PicklingError) as e:
+            _disable_excel_pool(str(e))
+    return [_build_workbook_bytes(batch) for batch in batches]
+
+
+def create_multiple_excel_files(records: list) -> list:
+    """
+    根據記錄數量生成多個 Excel 檔案（每 2 筆一個檔案）
+    **只為非當天記錄生成 Excel**（當天記錄只需要 CSV）
+    返回生成的檔案路徑列表
+    """
+    if not records:
+        return []
+    
+    # 只為非當天記錄生成 Excel
+    different_day_records = [r for r in records if not is_same_day_record(r)]
+    
+    if not different_day_records:
+        logger.info("沒有非當天記錄，不生成 Excel")
+        return []
+    
+    logger.info(f"準備為 {len(different_day_records)} 筆非當天記錄生成 Excel")
+    
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    excel_files = []
+    
+    # 每 2 筆記錄一頁（取 2 筆，最後可能只有 1 筆）
+    batches = [different_day_records[i:i+2] for i in range(0, len(different_day_records), 2)]
+    
+    # 合併模式：所有頁面寫入同一個 Excel（每頁一個工作表）
+    if PRINT_WORKBOOK_MODE == "consolidated":
+        filename = f"生產日報表修改申請_{len(different_day_records)}筆_合併{len(batches)}頁_{timestamp}.xlsx"
+        filepath = os.path.join(LOCAL_EXPORT_DIR, filename)
+        with open(filepath, 'wb') as f:
+            f.write(create_consolidated_print_workbook(batches).getvalue())
+        logger.info(f"已生成合併 Excel: {filename}（{len(batches)} 頁，非當天記錄）")
+        return [filepath]
+    
+    # 內容可平行生成；檔名與寫檔順序固定在主行程決定
+    for batch_num, (batch, content) in enumerate(zip(batches, build_workbooks(batches)), start=1):
+        filename = f"生產日報表修改申請_{len(batch)}筆_批次{batch_num}_{timestamp}.xlsx"
+        filepath = os.path.join(LOCAL_EXPORT_DIR, filename)
+        
+        with open(filepath, 'wb') as f:
+            f.write(content)
+        
+        excel_files.append(filepath)
+        logger.info(f"已生成 Excel 批次 {batch_num}: {filename}（非當天記錄）")
+    
+    return excel_files
+
+
+def generate_print_urls(records: list) -> list:
+    """
+    生成單一列印頁面 URL，包含所有記錄
+    返回只有一個 URL 的列表
+    """
+    if not records:
+        return []
+    
+    # 生成包含所有記錄索引的單一 URL
+    all_indices = ','.join(str(i) for i in range(len(records)))
+    url = f"/print_page?indices={all_indices}"
+    
+    return [url]  # 返回只包含一個 URL 的列表
+
+
+# -----------------------
+# CSV 生成函數
+# -----------------------
+def create_csv_export(record: ModificationRecord) -> str:
+    """生成CSV檔案，返回檔案路徑"""
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filename = f"生產日報表修改_{record.dy_serial_num}_{timestamp}.csv"
+    filepath = os.path.join(LOCAL_EXPORT_DIR, filename)
+    
+    # 同一秒內同序號有多筆（例如批次儲存）時加上流水號，避免覆蓋
+    seq = 1
+    while os.path.exists(filepath):
+        seq += 1
+        filepath = os.path.join(LOCAL_EXPORT_DIR, f"生產日報表修改_{record.dy_serial_num}_{timestamp}_{seq}.csv")
+    
+    # 單列資料直接以 csv 模組寫出（欄位順序見 CSV_COLUMNS）
+    with open(filepath, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_COLUMNS)
+        writer.writerow(record.to_csv_row())
+    
+    logger.info(f"CSV 已生成: {filepath}")
+    return filepath
+
+
+# -----------------------
+# 網路共用資料夾健康狀態（背景定期檢查並快取）
+# -----------------------
+_SHARE_PROBE_INTERVAL_SEC = 15        # 可連線時的檢查間隔
+_SHARE_PROBE_RETRY_SEC = 5            # 無法連線時縮短間隔，盡快偵測恢復
+_SHARE_PROBE_TIMEOUT_SEC = 3          # 單次檢查逾時即視為無法連線
+_SHARE_THROUGHPUT_INTERVAL_SEC = 300  # 傳輸速度量測間隔
+_SHARE_THROUGHPUT_PROBE_BYTES = 256 * 1024
+
+_share_state = {
+    "available": None,          # None = 尚未檢查
+    "checked_at": None,
+    "latency_ms": None,
+    "throughput_kbps": None,
+    "throughput_checked_at": None,
+    "error": None,
+}
+_share_state_lock = threading.Lock()
+_share_probe_wakeup = threading.Event()
+_share_probe_running = threading.Lock()  # 同時只允許一個檢查（UNC 逾時的執行緒可能卡住很久）
+
+
+def _probe_share(measure_throughput: bool, result: dict) -> None:
+    """實際檢查共用資料夾（在獨立執行緒執行，可能因 UNC 逾時而阻塞）"""
+    started = time.perf_counter()
+    if not os.path.isdir(NETWORK_SHARE_PATH):
+        result['error'] = "網路路徑不存在或無法訪問"
+        return
+    result['latency_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+    if measure_throughput:
+        probe_path = os.path.join(NETWORK_SHARE_PATH, f".prs_probe_{socket.gethostname()}_{os.getpid()}.tmp")
+        payload = os.urandom(_SHARE_THROUGHPUT_PROBE_BYTES)
+        started = time.perf_counter()
+        with open(probe_path, 'wb') as f:
+            f.write(payload)
+        elapsed = time.perf_counter() - started
+        os.remove(probe_path)
+        result['throughput_kbps'] = round(len(payload) / 1024 / max(elapsed, 1e-6), 1)
+
+    result['available'] = True
+
+
+def check_share_once(measure_throughput: bool = False) -> bool:
+    """檢查一次共用資料夾並更新快取狀態（最多等待 _SHARE_PROBE_TIMEOUT_SEC 秒）"""
+    if not _share_probe_running.acquire(blocking=False):
+        # 上一次檢查仍卡在 UNC 逾時中，沿用目前狀態
+        return bool(_share_state["available"])
+
+    result = {}
+
+    def run():
+        try:
+            _probe_share(measure_throughput, result)
+        except Exception as e:
+            result['error'] = str(e)
+        finally:
+            _share_probe_running.release()
+
+    worker = threading.Thread(target=run, daemon=True)
+    worker.start()
+    worker.join(_SHARE_PROBE_TIMEOUT_SEC)
+
+    available = bool(result.get('available'))
+    if worker.is_alive():
+        result['error'] = f"檢查逾時（>{_SHARE_PROBE_TIMEOUT_SEC}s）"
+
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with _share_state_lock:
+        previous = _share_state["available"]
+        _share_state["available"] = available
+        _share_state["checked_at"] = now
+        _share_state["latency_ms"] = result.get('latency_ms')
+        _share_state["error"] = None if available else result.get('error')
+        if 'throughput_kbps' in result:
+            _share_state["throughput_kbps"] = result['throughput_kbps']
+            _share_state["throughput_checked_at"] = now
+
+    if previous is not available:
+        if available:
+            logger.info(f"網路資料夾可連線: {NETWORK_SHARE_PATH}（{result.get('latency_ms')} ms）")
+        else:
+            logger.error(f"網路資料夾無法連線: {NETWORK_SHARE_PATH}（{result.get('error')}）")
+    return available
+
+
+def _share_health_monitor():
+    """背景定期檢查共用資料夾；無法連線時縮短間隔"""
+    last_throughput = 0.0
+    while True:
+        measure = time.time() - last_throughput >= _SHARE_THROUGHPUT_INTERVAL_SEC
+        try:
+            available = check_share_once(measure_throughput=measure)
+            if available and measure:
+                last_throughput = time.time()
+        except Exception as e:
+            logger.warning(f"網路資料夾檢查失敗: {str(e)}")
+            available = False
+
+        _share_probe_wakeup.wait(_SHARE_PROBE_INTERVAL_SEC if available else _SHARE_PROBE_RETRY_SEC)
+        _share_probe_wakeup.clear()
+
+
+def request_share_probe() -> None:
+    """要求背景監控立即重新檢查（例如上傳失敗後）"""
+    _share_probe_wakeup.set()
+
+
+def is_share_available() -> bool:
+    """依快取狀態判斷共用資料夾是否可用；尚未檢查過時同步檢查一次"""
+    available = _share_state["available"]
+    if available is None:
+        return check_share_once()
+    return available
+
+
+def _share_unavailable_message() -> str:
+    error = _share_state["error"] or "無法連線"
+    return f"網路資料夾目前無法使用（{error}），請稍後再試：{NETWORK_SHARE_PATH}"
+
+
+def get_share_status() -> dict:
+    with _share_state_lock:
+        status = dict(_share_state)
+    status["path"] = NETWORK_SHARE_PATH
+    return status
+
+
+# -----------------------
+# 網路路徑上傳函數
+# -----------------------
+_upload_ledger = None  # 延遲載入
+_upload_ledger_lock = threading.Lock()
+
+
+def file_sha256(filepath: str) -> str:
+    """計算檔案內容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _load_upload_ledger() -> dict:
+    global _upload_ledger
+    if _upload_ledger is None:
+        try:
+            with open(UPLOAD_LEDGER_PATH, encoding='utf-8') as f:
+                _upload_ledger = json.load(f)
+        except FileNotFoundError:
+            _upload_ledger = {}
+        except Exception as e:
+            logger.warning(f"讀取上傳紀錄失敗，重新建立: {str(e)}")
+            _upload_ledger = {}
+    return _upload_ledger
+
+
+def _save_upload_ledger() -> None:
+    """寫入上傳紀錄（先寫暫存檔再取代，並移除過舊的項目）"""
+    cutoff = (datetime.now() - timedelta(days=_UPLOAD_LEDGER_RETENTION_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+    for name in [n for n, e in _upload_ledger.items() if e.get('uploaded_at', '') < cutoff]:
+        del _upload_ledger[name]
+
+    tmp_path = UPLOAD_LEDGER_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(_upload_ledger, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, UPLOAD_LEDGER_PATH)
+
+
+def is_already_uploaded(filename: str, sha256: str) -> bool:
+    """上傳紀錄中是否已有同檔名且內容相同的檔案"""
+    with _upload_ledger_lock:
+        entry = _load_upload_ledger().get(filename)
+    return bool(entry) and entry.get('sha256') == sha256
+
+
+def record_upload(filename: str, sha256: str, size: int) -> None:
+    with _upload_ledger_lock:
+        _load_upload_ledger()[filename] = {
+            'sha256': sha256,
+            'size': size,
+            'uploaded_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        try:
+            _save_upload_ledger()
+        except Exception as e:
+            logger.warning(f"寫入上傳紀錄失敗: {str(e)}")
+
+
+def upload_to_network_share(local_filepath: str) -> bool:
+    """
+    將檔案上傳到網路共用資料夾
+    - 先複製為暫存檔名，完成後再更名為正式檔名（不會留下複製一半的檔案）
+    - 同檔名且內容雜湊相同、已上傳過的檔案直接略過（重試時只補傳缺少的檔案）
+    """
+    filename = os.path.basename(local_filepath)
+    try:
+        sha256 = file_sha256(local_filepath)
+        if is_already_uploaded(filename, sha256):
+            logger.info(f"檔案已上傳過且內容相同，略過: {filename}")
+            return True
+
+        # 檢查網路路徑是否可用（使用背景監控的快取狀態，不在此阻塞）
+        if not is_share_available():
+            logger.error(f"網路路徑不存在或無法訪問: {NETWORK_SHARE_PATH}")
+            return False
+        
+        dest_path = os.path.join(NETWORK_SHARE_PATH, filename)
+        tmp_path = os.path.join(NETWORK_SHARE_PATH, f".{filename}.{sha256[:12]}.uploading")
         
-        # 第 3 行：刪除行（不合併，各自獨立）
-        cell = ws[f'{col_label}{current_row}']
-        cell.value = delete_label
-        cell.font = normal_font
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        cell.border = thin_border
+        try:
+            shutil.copy2(local_filepath, tmp_path)
+            os.replace(tmp_path, dest_path)
+        except Exception:
+            try:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
         
-        # 刪除值的處理
-        delete_value = rec.get('delete_flag', '')
-        if delete_value == '是':
-            delete_mark = 'Y'
-        elif delete_value == '否':
-            delete_mark = 'N'
+        record_upload(filename, sha256, os.path.getsize(local_filepath))
+        logger.info(f"檔案已上傳: {dest_path}（sha256={sha256[:12]}）")
+        return True
+        
+    except Exception as e:
+        logger.exception(f"上傳失敗: {str(e)}")
+        request_share_probe()
+        return False
+
+
+def create_upload_bundle(filenames: list, records: list, kind: str) -> str:
+    """
+    將一次上傳的檔案打包成單一 zip（含 manifest.json），返回本機檔案路徑
+    檔名與內容只由成員檔案決定，重試時產生相同的 zip，可由上傳紀錄略過
+    """
+    files = []
+    for filename in sorted(filenames):
+        filepath = os.path.join(LOCAL_EXPORT_DIR, filename)
+        files.append({
+            "name": filename,
+            "type": os.path.splitext(filename)[1].lstrip('.'),
+            "size": os.path.getsize(filepath),
+            "sha256": file_sha256(filepath),
+        })
+
+    bundle_id = hashlib.sha256(''.join(f["sha256"] for f in files).encode('ascii')).hexdigest()[:16]
+    manifest = {
+        "bundle_id": bundle_id,
+        "kind": kind,  # same_day（上傳）/ different_day（列印）
+        "records": [
+            {
+                "dy_serial_num": r.dy_serial_num,
+                "day_type": "same_day" if is_same_day_record(r) else "different_day",
+                "delete": r.is_delete,
+                "saved_time": r.saved_time,
+            }
+            for r in records
+        ],
+        "files": files,
+    }
+
+    # zip 內的時間固定取最後儲存時間，確保同一批內容產生相同的 zip
+    latest = max((r.saved_time for r in records), default='1980-01-01 00:00:00')
+    date_time = datetime.strptime(latest, '%Y-%m-%d %H:%M:%S').timetuple()[:6]
+
+    bundle_path = os.path.join(LOCAL_EXPORT_DIR, f"生產日報表上傳批次_{kind}_{bundle_id}.zip")
+    with zipfile.ZipFile(bundle_path, 'w') as zf:
+        for f in files:
+            info = zipfile.ZipInfo(f["name"], date_time=date_time)
+            # xlsx 本身已壓縮，直接存放
+            info.compress_type = zipfile.ZIP_STORED if f["type"] == 'xlsx' else zipfile.ZIP_DEFLATED
+            with open(os.path.join(LOCAL_EXPORT_DIR, f["name"]), 'rb') as fp:
+                zf.writestr(info, fp.read())
+        info = zipfile.ZipInfo("manifest.json", date_time=date_time)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        zf.writestr(info, json.dumps(manifest, ensure_ascii=False, indent=2))
+
+    logger.info(f"已打包上傳批次 {os.path.basename(bundle_path)}：{len(files)} 個檔案，{len(records)} 筆記錄")
+    return bundle_path
+
+
+def upload_batch_files(filenames: list, records: list, kind: str, bundle: bool) -> list:
+    """
+    上傳一批檔案，返回上傳失敗的檔名列表
+    bundle=True 時打包成單一 zip 一次傳送（減少 SMB 每個檔案開關的往返）
+    """
+    if bundle:
+        try:
+            bundle_path = create_upload_bundle(filenames, records, kind)
+        except Exception as e:
+            logger.exception(f"打包上傳批次失敗: {str(e)}")
+            return list(filenames)
+        try:
+            if upload_to_network_share(bundle_path):
+                logger.info(f"上傳成功：{os.path.basename(bundle_path)}（{len(filenames)} 個檔案）")
+                return []
+            logger.error(f"上傳失敗：{os.path.basename(bundle_path)}")
+            return list(filenames)
+        finally:
+            try:
+                os.remove(bundle_path)
+            except OSError:
+                pass
+
+    failed_files = []
+    for filename in filenames:
+        filepath = os.path.join(LOCAL_EXPORT_DIR, filename)
+        if upload_to_network_share(filepath):
+            logger.info(f"上傳成功：{filename}")
+        else:
+            failed_files.append(filename)
+            logger.error(f"上傳失敗：{filename}")
+    return failed_files
+
+
+# -----------------------
+# 批次儲存（以查詢結果比對原始值 + 向量化驗證）
+# -----------------------
+# 修改申請清單與相關檔案的異動鎖（批次儲存需一次性加入或全部撤回）
+_queue_lock = threading.RLock()
+
+
+def _format_original_value(value) -> str:
+    """查詢結果值轉為與前端相同的字串（整數值的浮點數不顯示 .0）"""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def _parse_datetime_series(values: pd.Series) -> pd.Series:
+    """向量化解析日期時間（DATETIME_FORMATS），空值或格式錯誤為 NaT"""
+    normalized = values.str.replace('/', '-', regex=False)
+    parsed = pd.to_datetime(normalized, format='%Y-%m-%d %H:%M:%S', errors='coerce')
+    return parsed.combine_first(pd.to_datetime(normalized, format='%Y-%m-%d %H:%M', errors='coerce'))
+
+
+def validate_modification_frame(frame: pd.DataFrame) -> dict:
+    """
+    向量化檢查批次修改：日期/時間格式、數量、完工時間晚於起工時間
+    frame 每列一筆修改，欄位為 {field}_original / {field}_modified / delete_flag
+    回傳 {列索引: [錯誤訊息, ...]}（只包含有錯誤的列）
+    """
+    errors = {}
+
+    def flag(mask: pd.Series, make_message):
+        for idx in mask[mask].index:
+            errors.setdefault(idx, []).append(make_message(idx))
+
+    active = frame['delete_flag'] != '是'
+
+    # 工作日期
+    work_date = frame['work_date_modified']
+    parsed_date = pd.to_datetime(
+        work_date.str.split(' ').str[0].str.replace('/', '-', regex=False),
+        format='%Y-%m-%d', errors='coerce',
+    )
+    flag(active & (work_date != '') & parsed_date.isna(),
+         lambda i: f"{FIELD_LABELS['work_date']}格式錯誤: {work_date[i]}")
+
+    # 起工/完工時間
+    effective = {}
+    for field in DATETIME_FIELDS:
+        modified = frame[f'{field}_modified']
+        parsed = _parse_datetime_series(modified)
+        flag(active & (modified != '') & parsed.isna(),
+             lambda i, f=field, col=modified: f"{FIELD_LABELS[f]}格式錯誤: {col[i]}")
+        # 未修改時以原本值比較
+        effective[field] = parsed.where(modified != '', _parse_datetime_series(frame[f'{field}_original']))
+
+    flag(active & (effective['finish_time'] < effective['start_time']),
+         lambda i: f"完工時間不可早於起工時間（{effective['start_time'][i]:%Y-%m-%d %H:%M} > {effective['finish_time'][i]:%Y-%m-%d %H:%M}）")
+
+    # 數量與除外時間：非負數字
+    for field in NUMERIC_FIELDS:
+        modified = frame[f'{field}_modified']
+        numbers = pd.to_numeric(modified.where(modified != ''), errors='coerce')
+        flag(active & (modified != '') & ~(numbers >= 0),
+             lambda i, f=field, col=modified: f"{FIELD_LABELS[f]}必須是非負數字: {col[i]}")
+
+    return errors
+
+
+def build_batch_records(items: list) -> tuple:
+    """
+    將批次修改轉為 ModificationRecord 列表
+    - 所有序號一次批次查詢（使用查詢結果快取），原本值一律以伺服器資料為準
+    - 修改值與原本值相同視為未修改
+    - 任一筆有錯誤則不建立任何記錄
+    回傳 (records, errors)，errors 為 [{"index", "dy_serial_num", "messages"}]
+    """
+    errors = {}
+    rows = []
+    snapshots = {}
+
+    # 所有序號以一次批次查詢取得（已在快取中的不再查詢）
+    reports = get_cached_reports([
+        s for s in {normalize_dy_serial(item.get('dy_serial_num')) for item in items if isinstance(item, dict)} if s
+    ])
+    for idx, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors[idx] = ["格式錯誤"]
+            rows.append(None)
+            continue
+
+        serial = normalize_dy_serial(item.get('dy_serial_num'))
+        if not serial:
+            errors[idx] = ["缺少生產日報表序號"]
+            rows.append(None)
+            continue
+
+        df = reports.get(serial)
+        if df is None:
+            errors[idx] = ["資料庫查詢錯誤"]
+            rows.append(None)
+            continue
+        if df.empty:
+            errors[idx] = ["查無資料"]
+            rows.append(None)
+            continue
+
+        try:
+            row_index = int(item.get('row_index') or 0)
+        except (TypeError, ValueError):
+            row_index = -1
+        if not 0 <= row_index < len(df):
+            errors[idx] = [f"無效的資料列索引: {item.get('row_index')}"]
+            rows.append(None)
+            continue
+
+        snapshot = snapshot_from_row(serial, df.iloc[row_index])
+        snapshots[idx] = snapshot
+        row = {
+            'dy_serial_num': serial,
+            'delete_flag': '是' if _clean(item.get('delete_flag')) == '是' else '否',
+            'date_type': item.get('date_type'),
+            'pd_serial_num': snapshot.key[1],
+            'ordinal_num': snapshot.key[2],
+        }
+        for field, original in zip(EDITABLE_FIELDS, snapshot.values):
+            modified = _clean(item.get(f'{field}_modified'))
+            row[f'{field}_original'] = original
+            row[f'{field}_modified'] = '' if modified == original else modified
+        rows.append(row)
+
+    valid = [(idx, row) for idx, row in enumerate(rows) if row is not None]
+    if valid:
+        frame = pd.DataFrame([row for _, row in valid], index=[idx for idx, _ in valid])
+        for idx, messages in validate_modification_frame(frame).items():
+            errors.setdefault(idx, []).extend(messages)
+
+    records = []
+    saved_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    for idx, row in valid:
+        if idx in errors:
+            continue
+        try:
+            records.append(ModificationRecord.from_payload(row, saved_time=saved_time, validate=False,
+                                                           snapshot=snapshots[idx]))
+        except ValueError as e:
+            errors.setdefault(idx, []).append(str(e))
+
+    error_list = [
+        {
+            "index": idx,
+            "dy_serial_num": normalize_dy_serial(items[idx].get('dy_serial_num')) if isinstance(items[idx], dict) else '',
+            "messages": messages,
+        }
+        for idx, messages in sorted(errors.items())
+    ]
+    return (records if not error_list else []), error_list
+
+
+_excel_lock = threading.Lock()  # 背景工作與批次儲存不可同時重建 Excel
+
+
+def regenerate_excel_files() -> list:
+    """刪除舊的 Excel 並依目前的列印清單重新生成（每 2 筆一個檔案）"""
+    with _excel_lock:
+        return _regenerate_excel_files()
+
+
+def _regenerate_excel_files() -> list:
+    try:
+        for f in os.listdir(LOCAL_EXPORT_DIR):
+            if f.startswith('生產日報表修改申請_') and f.endswith('.xlsx'):
+                os.remove(os.path.join(LOCAL_EXPORT_DIR, f))
+    except Exception as e:
+        logger.warning(f"清理舊檔案失敗: {str(e)}")
+
+    return create_multiple_excel_files(print_queue)
+
+
+def enqueue_batch_records(records: list) -> tuple:
+    """
+    整批加入列印清單並生成檔案（CSV 每筆一個，Excel 只重新生成一次）
+    同一資料列（清單中已有或同批次重複）合併為一筆
+    任一檔案生成失敗時撤回整批記錄與已生成的 CSV 並拋出例外
+    返回 (csv_files, excel_files)
+    """
+    global print_queue
+    csv_files = []
+    with _queue_lock:
+        previous_queue = list(print_queue)
+        queued, replaced = [], []
+        for record in records:
+            merged, previous = _merge_or_append(record)
+            if previous is not None:
+                # 同批次較早的記錄尚未寫入日誌與 CSV，直接捨棄
+                if any(q is previous for q in queued):
+                    queued = [q for q in queued if q is not previous]
+                else:
+                    replaced.append(previous)
+            queued.append(merged)
+        try:
+            for record in queued:
+                record.attach_csv(create_csv_export(record))
+                csv_files.append(record.csv_path)
+            excel_files = regenerate_excel_files()
+            final = {_queue_row_key(q): q for q in queued if _queue_row_key(q) is not None}
+            journal_replace([(previous, final[_queue_row_key(previous)]) for previous in replaced])
+            replacements = {id(final[_queue_row_key(previous)]) for previous in replaced}
+            journal_add([q for q in queued if id(q) not in replacements])
+        except Exception as e:
+            logger.exception(f"批次儲存失敗，撤回 {len(records)} 筆: {str(e)}")
+            print_queue = previous_queue
+            _rebuild_row_index()
+            for filepath in csv_files:
+                try:
+                    os.remove(filepath)
+                except OSError:
+                    pass
+            try:
+                regenerate_excel_files()
+            except Exception as regen_error:
+                logger.warning(f"撤回後重新生成 Excel 失敗: {str(regen_error)}")
+            raise
+        for previous in replaced:
+            _remove_record_csv(previous)
+    return csv_files, excel_files
+
+
+# -----------------------
+# 當天修改直接回寫資料庫（選用，取代 CSV 上傳）
+# -----------------------
+# 只回寫直接存放、不需連帶重算其他欄位的欄位；工作日期、工作者、工序、起完工與除外時間
+# 會影響工作者名稱/工序內容/實際工時等衍生資料，仍以 CSV 交由後續流程處理
+WRITEBACK_FIELD_COLUMNS = {
+    'finish_qty': ('DayWorkDYProduct', 'FinishQty'),
+    'bad_qty': ('DayWorkDYProduct', 'BadQty'),
+    'extra_name1': ('DayWorkDYProduct', 'ExtraName1'),
+    'extra_name2': ('DayWorkDYProduct', 'ExtraName2'),
+    'extra_name3': ('DayWorkDYProduct', 'ExtraName3'),
+    'machine_num': ('TimeWorkBase', 'MachineNr'),
+}
+
+
+def writeback_eligible(record: ModificationRecord) -> bool:
+    """可直接回寫：非刪除申請、帶有資料列鍵值與編輯時間，且只修改 WRITEBACK_FIELD_COLUMNS 的欄位"""
+    if record.is_delete or not (record.pd_serial_num and record.ordinal_num and record.edit_time):
+        return False
+    modified = [f for f in EDITABLE_FIELDS if record.modified(f)]
+    return bool(modified) and all(f in WRITEBACK_FIELD_COLUMNS for f in modified)
+
+
+def _writeback_value(field: str, value: str):
+    return float(value) if field in NUMERIC_FIELDS else value
+
+
+def _ordinal_param(value: str):
+    return int(value) if value.isdigit() else value
+
+
+class ReportWriteBack:
+    """
+    將修改批次回寫 DayWorkDYProduct / TimeWorkBase
+    - connect：返回 DB-API 連線（qmark 參數）的函數；正式環境為 get_db_connection，可換成 SQLite 替身
+    - 以 DayWorkDYBase.EditTime 做樂觀鎖：查詢後被他人修改過的生產日報表整張略過（回報衝突）
+    - EditTime 與資料列鍵值各以一次 SELECT（每 1000 個序號一段）取得並鎖定，更新一律以 executemany 送出
+    - 同一交易完成，發生錯誤或更新筆數不符時全部撤回
+    - lock_hint：SELECT 時的鎖定提示，讓比對到提交之間資料不會被改；SQLite 替身傳空字串
+    """
+
+    def __init__(self, connect, lock_hint: str = " WITH (UPDLOCK, HOLDLOCK)"):
+        self.connect = connect
+        self.lock_hint = lock_hint
+
+    def apply(self, records: list) -> dict:
+        """返回 {"applied", "conflicts"（已被他人修改）, "missing"（資料列已不存在）}"""
+        by_serial = OrderedDict()
+        for rec in records:
+            by_serial.setdefault(rec.dy_serial_num, []).append(rec)
+
+        applied, conflicts, missing = [], [], []
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            if hasattr(cursor, 'fast_executemany'):
+                cursor.fast_executemany = True
+            now = datetime.now().replace(microsecond=0)
+
+            # 比對 EditTime（查詢結果只到秒，比對同一秒內）
+            edit_times = self._fetch_edit_times(cursor, list(by_serial))
+            candidates = OrderedDict()
+            for serial, recs in by_serial.items():
+                expected = parse_datetime(recs[0].edit_time)
+                actual = edit_times.get(serial)
+                if (expected is None or actual is None or any(r.edit_time != recs[0].edit_time for r in recs)
+                        or not expected <= actual < expected + timedelta(seconds=1)):
+                    conflicts.extend(recs)
+                else:
+                    candidates[serial] = (recs, expected)
+
+            # 要更新的資料列必須存在，否則整張生產日報表改走 CSV
+            existing = self._fetch_row_keys(cursor, list(candidates))
+            for serial in list(candidates):
+                recs = candidates[serial][0]
+                if not all(self._row_key(table, r) in existing for r in recs for table in self._tables(r)):
+                    missing.extend(recs)
+                    del candidates[serial]
+
+            if candidates:
+                self._executemany(cursor,
+                                  "UPDATE DayWorkDYBase SET EditTime = ? "
+                                  "WHERE DySerialNum = ? AND EditTime >= ? AND EditTime < ?",
+                                  [(now, serial, expected, expected + timedelta(seconds=1))
+                                   for serial, (_, expected) in candidates.items()])
+                applied = [r for recs, _ in candidates.values() for r in recs]
+                for sql, params in self._update_batches(applied):
+                    self._executemany(cursor, sql, params)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        return {"applied": applied, "conflicts": conflicts, "missing": missing}
+
+    @staticmethod
+    def _executemany(cursor, sql: str, params: list) -> None:
+        """executemany 並檢查更新筆數（驅動程式無法提供時 rowcount 為 -1，此時只能信任 SELECT 時的鎖定）"""
+        cursor.executemany(sql, params)
+        if cursor.rowcount not in (-1, None) and cursor.rowcount != len(params):
+            raise RuntimeError(f"回寫筆數不符（預期 {len(params)}，實際 {cursor.rowcount}），已全部撤回")
+
+    def _chunks(self, serials: list):
+        for i in range(0, len(serials), _BATCH_QUERY_CHUNK):
+            chunk = serials[i:i + _BATCH_QUERY_CHUNK]
+            yield chunk, ", ".join("?" for _ in chunk)
+
+    def _fetch_edit_times(self, cursor, serials: list) -> dict:
+        result = {}
+        for chunk, placeholders in self._chunks(serials):
+            cursor.execute(f"SELECT DySerialNum, EditTime FROM DayWorkDYBase{self.lock_hint} "
+                           f"WHERE DySerialNum IN ({placeholders})", chunk)
+            for serial, edit_time in cursor.fetchall():
+                if isinstance(edit_time, str):
+                    edit_time = parse_datetime(edit_time)
+                result[str(serial).strip().upper()] = edit_time
+        return result
+
+    def _fetch_row_keys(self, cursor, serials: list) -> set:
+        keys = set()
+        tables = sorted({table for table, _ in WRITEBACK_FIELD_COLUMNS.values()})
+        for chunk, placeholders in self._chunks(serials):
+            for table in tables:
+                cursor.execute(f"SELECT DySerialNum, PDSerialNum, OrdinalNum FROM {table}{self.lock_hint} "
+                               f"WHERE DySerialNum IN ({placeholders})", chunk)
+                for serial, pd_serial, ordinal in cursor.fetchall():
+                    keys.add((table, str(serial).strip().upper(), str(pd_serial).strip(),
+                              _format_original_value(ordinal)))
+        return keys
+
+    @staticmethod
+    def _tables(rec: ModificationRecord) -> set:
+        return {WRITEBACK_FIELD_COLUMNS[f][0] for f in EDITABLE_FIELDS if rec.modified(f)}
+
+    @staticmethod
+    def _row_key(table: str, rec: ModificationRecord) -> tuple:
+        return (table, rec.dy_serial_num, rec.pd_serial_num, rec.ordinal_num)
+
+    @staticmethod
+    def _update_batches(records: list) -> list:
+        """依（資料表, 修改欄位組合）分組，返回 [(UPDATE 語法, 參數列表)]"""
+        groups = OrderedDict()
+        for rec in records:
+            by_table = OrderedDict()
+            for field in EDITABLE_FIELDS:
+                if rec.modified(field):
+                    table, column = WRITEBACK_FIELD_COLUMNS[field]
+                    by_table.setdefault(table, []).append((field, column))
+            for table, pairs in by_table.items():
+                key = (table, tuple(column for _, column in pairs))
+                params = [_writeback_value(field, rec.modified(field)) for field, _ in pairs]
+                params += [rec.dy_serial_num, rec.pd_serial_num, _ordinal_param(rec.ordinal_num)]
+                groups.setdefault(key, []).append(params)
+
+        batches = []
+        for (table, columns), params in groups.items():
+            assignments = ", ".join(f"{column} = ?" for column in columns)
+            sql = (f"UPDATE {table} SET {assignments} "
+                   f"WHERE DySerialNum = ? AND PDSerialNum = ? AND OrdinalNum = ?")
+            batches.append((sql, params))
+        return batches
+
+
+def sqlite_writeback_standin(path: str):
+    """
+    建立本機 SQLite 替身（只含回寫用到的資料表/欄位），返回可給 ReportWriteBack 的 connect 函數
+    （SQLite 不支援鎖定提示，請以 ReportWriteBack(connect, lock_hint="") 使用）
+    供離線驗證回寫流程，不用於正式環境
+    """
+    import sqlite3
+    sqlite3.register_adapter(datetime, lambda d: d.strftime('%Y-%m-%d %H:%M:%S'))
+
+    def connect():
+        return sqlite3.connect(path)
+
+    conn = connect()
+    with conn:
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS DayWorkDYBase (
+                DySerialNum TEXT PRIMARY KEY, CDate TEXT, EditTime TEXT);
+            CREATE TABLE IF NOT EXISTS DayWorkDYProduct (
+                DySerialNum TEXT, PDSerialNum TEXT, OrdinalNum INTEGER,
+                FinishQty REAL, BadQty REAL, ExtraName1 TEXT, ExtraName2 TEXT, ExtraName3 TEXT,
+                PRIMARY KEY (DySerialNum, PDSerialNum, OrdinalNum));
+            CREATE TABLE IF NOT EXISTS TimeWorkBase (
+                DySerialNum TEXT, PDSerialNum TEXT, OrdinalNum INTEGER, MachineNr TEXT,
+                PRIMARY KEY (DySerialNum, PDSerialNum, OrdinalNum));
+        """)
+    conn.close()
+    return connect
+
+
+_writeback_store = ReportWriteBack(get_db_connection)
+
+
+def writeback_same_day_records(records: list) -> tuple:
+    """
+    回寫模式下處理當天記錄：同一序號的記錄全部符合條件才回寫（同一張生產日報表一起比對 EditTime）
+    成功者移出清單並刪除本機 CSV；衝突（已被他人修改）與資料列已不存在的記錄改走 CSV 上傳，
+    不留在清單重複比對
+    返回 (已回寫, 衝突, 仍需上傳 CSV 的記錄)
+    """
+    by_serial = OrderedDict()
+    for rec in records:
+        by_serial.setdefault(rec.dy_serial_num, []).append(rec)
+    eligible = [r for recs in by_serial.values() if all(writeback_eligible(r) for r in recs) for r in recs]
+    if not eligible:
+        return [], [], records
+
+    result = _writeback_store.apply(eligible)
+    applied, conflicts, missing = result["applied"], result["conflicts"], result["missing"]
+    applied_ids = {r.record_id for r in applied}
+    remaining = [r for r in records if r.record_id not in applied_ids]
+
+    if applied:
+        with _queue_lock:
+            remove_from_queue(applied, 'writeback')
+            for record in applied:
+                _remove_record_csv(record)
+        logger.info(f"已直接回寫 {len(applied)} 筆當天記錄（序號：{sorted({r.dy_serial_num for r in applied})}）")
+    if conflicts:
+        logger.warning(f"回寫衝突（資料已被修改），改以 CSV 上傳：{sorted({r.dy_serial_num for r in conflicts})}")
+    if missing:
+        logger.warning(f"回寫資料列不存在，改以 CSV 上傳：{sorted({r.dy_serial_num for r in missing})}")
+    return applied, conflicts + missing, remaining
+
+
+# -----------------------
+# 試算表批次匯入（欄位同 create_csv_export 的 CSV）
+# -----------------------
+_IMPORT_MAX_ROWS = 2000
+_IMPORT_ROW_COLUMN = '資料列'  # 選填：查詢結果中的第幾列（從 1 起算），同一發工單號有多列時用來指定
+_IMPORT_CSV_ENCODINGS = ('utf-8-sig', 'cp950')  # Excel 另存 CSV 時可能是 Big5
+
+
+def _format_import_value(field: str, value) -> str:
+    """儲存格值轉為與前端輸入相同的字串（Excel 日期儲存格為 datetime）"""
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d' if field == 'work_date' else '%Y-%m-%d %H:%M:%S')
+    return _format_original_value(value)
+
+
+def _read_rows_with_header(rows) -> list:
+    """
+    第一個非空白列為標題，之後每列轉為 {欄名: 值}
+    返回 [(試算表列號, dict)]，超過 _IMPORT_MAX_ROWS 時拋出 ValueError
+    """
+    header = None
+    result = []
+    for row_number, row in enumerate(rows, 1):
+        if row is None or all(v is None or str(v).strip() == '' for v in row):
+            continue
+        if header is None:
+            header = [str(v).strip() if v is not None else '' for v in row]
+            if '生產日報表序號' not in header:
+                raise ValueError("找不到「生產日報表序號」欄位，請使用修改申請 CSV 的欄位格式")
+            continue
+        if len(result) >= _IMPORT_MAX_ROWS:
+            raise ValueError(f"單次匯入最多 {_IMPORT_MAX_ROWS} 筆")
+        result.append((row_number, {name: value for name, value in zip(header, row) if name}))
+    if header is None:
+        raise ValueError("檔案沒有資料")
+    return result
+
+
+def read_import_rows(file_storage) -> list:
+    """逐列讀取上傳的 xlsx（read_only 串流）或 CSV"""
+    filename = (file_storage.filename or '').lower()
+    stream = file_storage.stream
+    if filename.endswith('.xlsx'):
+        wb = load_workbook(stream, read_only=True, data_only=True)
+        try:
+            return _read_rows_with_header(wb.worksheets[0].iter_rows(values_only=True))
+        finally:
+            wb.close()
+    if filename.endswith('.csv'):
+        for encoding in _IMPORT_CSV_ENCODINGS:
+            stream.seek(0)
+            text = io.TextIOWrapper(stream, encoding=encoding, newline='')
+            try:
+                return _read_rows_with_header(csv.reader(text))
+            except UnicodeDecodeError:
+                continue
+            finally:
+                text.detach()
+        raise ValueError("無法辨識 CSV 編碼，請以 UTF-8 儲存")
+    raise ValueError("只支援 .xlsx 或 .csv 檔案")
+
+
+def match_report_row(df, pd_num: str, values: dict, row_hint: str):
+    """
+    找出匯入列對應的查詢結果資料列，返回 (row_index, 錯誤訊息)
+    依序使用：資料列欄位 → 發工單號 → 與原本值相同的欄位數最多者
+    """
+    if row_hint:
+        try:
+            row_index = int(float(row_hint)) - 1
+        except ValueError:
+            return None, f"無效的{_IMPORT_ROW_COLUMN}: {row_hint}"
+        if not 0 <= row_index < len(df):
+            return None, f"{_IMPORT_ROW_COLUMN} {row_hint} 超出範圍（共 {len(df)} 列）"
+        return row_index, ''
+
+    candidates = list(range(len(df)))
+    if pd_num:
+        candidates = [i for i in candidates if _format_original_value(df.iloc[i].get('發工單號')) == pd_num]
+        if not candidates:
+            return None, f"發工單號 {pd_num} 不在此生產日報表"
+    if len(candidates) == 1:
+        return candidates[0], ''
+
+    def score(i):
+        source = df.iloc[i]
+        return sum(1 for field, value in values.items()
+                   if value and value == _format_original_value(source.get(FIELD_LABELS[field])))
+
+    scores = [(score(i), i) for i in candidates]
+    best = max(s for s, _ in scores)
+    matched = [i for s, i in scores if s == best]
+    if len(matched) > 1:
+        return None, f"符合 {len(matched)} 筆資料列，請填寫「{_IMPORT_ROW_COLUMN}」欄位"
+    return matched[0], ''
+
+
+def build_import_items(rows: list) -> tuple:
+    """
+    匯入列轉為 build_batch_records 的輸入（所有序號以一次批次查詢取得）
+    返回 (items, 對應的試算表列號, errors)
+    """
+    serials = {normalize_dy_serial(_clean(values.get('生產日報表序號'))) for _, values in rows}
+    reports = get_cached_reports([s for s in serials if s])
+
+    items, row_numbers, errors = [], [], []
+    for row_number, values in rows:
+        serial = normalize_dy_serial(_clean(values.get('生產日報表序號')))
+        if not serial:
+            errors.append({"row": row_number, "dy_serial_num": '', "messages": ["缺少生產日報表序號"]})
+            continue
+        df = reports.get(serial)
+        if df is None:
+            errors.append({"row": row_number, "dy_serial_num": serial, "messages": ["資料庫查詢錯誤"]})
+            continue
+        if df.empty:
+            errors.append({"row": row_number, "dy_serial_num": serial, "messages": ["查無資料"]})
+            continue
+
+        modified = {field: _format_import_value(field, values.get(FIELD_LABELS[field]))
+                    for field in EDITABLE_FIELDS}
+        pd_num = _format_import_value('pd_num', values.get('發工單號'))
+        row_index, message = match_report_row(df, pd_num, modified,
+                                              _format_import_value('', values.get(_IMPORT_ROW_COLUMN)))
+        if row_index is None:
+            errors.append({"row": row_number, "dy_serial_num": serial, "messages": [message]})
+            continue
+
+        is_delete = _clean(values.get('刪除(Y/N)')).upper() in ('Y', '是')
+        item = {'dy_serial_num': serial, 'row_index': row_index, 'delete_flag': '是' if is_delete else '否'}
+        for field in EDITABLE_FIELDS:
+            item[f'{field}_modified'] = '' if is_delete else modified[field]
+        items.append(item)
+        row_numbers.append(row_number)
+    return items, row_numbers, errors
+
+
+# -----------------------
+# 列印清單異動日誌（write-ahead journal，當機/閒置結束後重新啟動可還原）
+# -----------------------
+# 每行一個 JSON 事件：snapshot（壓縮後的完整清單）/ add / remove / replace / csv（記錄生成的 CSV 檔名）
+_JOURNAL_COMPACT_EVENTS = 200  # 累積多少事件後重寫為單一 snapshot
+
+_journal_file = None
+_journal_events = 0
+_journal_lock = threading.Lock()
+
+
+def _journal_append(entry: dict) -> None:
+    """寫入一筆事件並 fsync；寫入失敗只記錄警告，不影響清單操作（呼叫端持有 _queue_lock）"""
+    global _journal_file, _journal_events
+    entry["ts"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    line = json.dumps(entry, ensure_ascii=False) + "\n"
+    with _journal_lock:
+        try:
+            if _journal_file is None:
+                _journal_file = open(JOURNAL_PATH, 'a', encoding='utf-8')
+            _journal_file.write(line)
+            _journal_file.flush()
+            os.fsync(_journal_file.fileno())
+            _journal_events += 1
+        except OSError as e:
+            logger.warning(f"寫入清單日誌失敗: {str(e)}")
+            return
+        need_compact = _journal_events >= _JOURNAL_COMPACT_EVENTS
+    if need_compact:
+        compact_journal()
+
+
+def journal_add(records: list) -> None:
+    _journal_append({"op": "add", "records": [r.to_json() for r in records]})
+
+
+def journal_remove(records: list, reason: str) -> None:
+    if records:
+        _journal_append({"op": "remove", "reason": reason, "ids": [r.record_id for r in records]})
+
+
+def journal_replace(pairs: list) -> None:
+    """同一資料列合併：[(被取代的記錄, 合併後的記錄)]，重播時保留原本在清單中的位置"""
+    for previous, merged in pairs:
+        _journal_append({"op": "replace", "id": previous.record_id, "record": merged.to_json()})
+
+
+def journal_csv(records: list) -> None:
+    """背景生成 CSV 後記下檔名，重新啟動後仍以同一個檔案上傳/刪除"""
+    if records:
+        _journal_append({"op": "csv", "files": {r.record_id: os.path.basename(r.csv_path) for r in records}})
+
+
+def compact_journal() -> None:
+    """以目前清單重寫日誌（先寫暫存檔再取代，過程中斷不會損毀原日誌）"""
+    global _journal_file, _journal_events
+    with _queue_lock:
+        line = json.dumps({
+            "op": "snapshot",
+            "ts": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "records": [r.to_json() for r in print_queue],
+        }, ensure_ascii=False) + "\n"
+        with _journal_lock:
+            tmp_path = JOURNAL_PATH + ".tmp"
+            try:
+                if _journal_file is not None:
+                    _journal_file.close()
+                    _journal_file = None
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(line)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, JOURNAL_PATH)
+                _journal_events = 0
+            except OSError as e:
+                logger.warning(f"壓縮清單日誌失敗: {str(e)}")
+
+
+def replay_journal() -> list:
+    """依序重播日誌，返回還原的記錄（最後一行寫入中斷等損毀行會略過）"""
+    records = OrderedDict()  # record_id -> ModificationRecord
+    if not os.path.exists(JOURNAL_PATH):
+        return []
+
+    def add(items):
+        for item in items:
+            try:
+                rec = ModificationRecord.from_journal(item)
+            except (ValueError, KeyError) as e:
+                logger.warning(f"日誌記錄無法還原，略過: {str(e)}")
+                continue
+            records[rec.record_id] = rec
+
+    with open(JOURNAL_PATH, encoding='utf-8') as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                logger.warning(f"清單日誌第 {lineno} 行損毀，略過")
+                continue
+            op = entry.get("op")
+            if op == "snapshot":
+                records.clear()
+                add(entry.get("records", []))
+            elif op == "add":
+                add(entry.get("records", []))
+            elif op == "remove":
+                for record_id in entry.get("ids", []):
+                    records.pop(record_id, None)
+            elif op == "csv":
+                for record_id, filename in (entry.get("files") or {}).items():
+                    if record_id in records:
+                        records[record_id].attach_csv(os.path.join(LOCAL_EXPORT_DIR, filename))
+            elif op == "replace":
+                old_id = entry.get("id")
+                if old_id not in records:
+                    add([entry.get("record", {})])
+                    continue
+                try:
+                    rec = ModificationRecord.from_journal(entry.get("record", {}))
+                except (ValueError, KeyError) as e:
+                    logger.warning(f"日誌記錄無法還原，略過: {str(e)}")
+                    continue
+                records = OrderedDict((rec.record_id, rec) if k == old_id else (k, v) for k, v in records.items())
+    return list(records.values())
+
+
+def remove_from_queue(records: list, reason: str) -> None:
+    """從清單移除指定記錄並寫入日誌（以記錄識別碼比對，不影響期間新加入的記錄）"""
+    global print_queue
+    removed_ids = {r.record_id for r in records}
+    with _queue_lock:
+        print_queue = [r for r in print_queue if r.record_id not in removed_ids]
+        _rebuild_row_index()
+        journal_remove(records, reason)
+
+
+def recover_print_queue() -> int:
+    """
+    啟動時重播日誌還原列印清單，並補齊檔案：
+    缺少 CSV 的記錄重新生成 CSV，Excel 一律依還原後的清單重新生成
+    """
+    global print_queue
+    started = time.perf_counter()
+    try:
+        records = replay_journal()
+    except OSError as e:
+        logger.warning(f"讀取清單日誌失敗: {str(e)}")
+        return 0
+
+    with _queue_lock:
+        print_queue = records
+        _rebuild_row_index()
+        compact_journal()
+
+    if records:
+        # 日誌記有每筆記錄的 CSV 檔名；沒有記錄或檔案已不存在時重新生成
+        missing = [rec for rec in records if not rec.has_csv()]
+        if missing:
+            submit_csv_job(missing)
+        submit_excel_job()
+        logger.info(f"已由日誌還原 {len(records)} 筆記錄（補生成 {len(missing)} 個 CSV），"
+                    f"耗時 {(time.perf_counter() - started) * 1000:.0f} ms")
+    return len(records)
+
+
+# -----------------------
+# 背景檔案生成工作（CSV / Excel 在回應儲存後才生成）
+# -----------------------
+_ASYNC_FILE_GENERATION = True   # False 時在請求中同步生成（舊行為）
+_FILE_JOB_HISTORY = 200         # 保留最近的工作紀錄數量
+_FILE_JOB_WAIT_TIMEOUT_SEC = 120
+
+# 單一工作執行緒：Excel 重新生成會刪除並重建全部檔案，必須依序執行
+_file_job_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="file-job")
+_file_jobs = OrderedDict()  # job_id -> FileJob
+_file_jobs_lock = threading.Lock()
+_file_job_seq = itertools.count(1)
+
+
+class FileJob:
+    """一個背景檔案生成工作（csv: 單筆記錄的 CSV；excel: 依目前清單重新生成全部 Excel）"""
+    __slots__ = ('job_id', 'kind', 'records', 'status', 'submitted_at', 'finished_at',
+                 'error', 'files', 'done_event')
+
+    def __init__(self, kind: str, records: list):
+        self.job_id = next(_file_job_seq)
+        self.kind = kind
+        self.records = records
+        self.status = 'pending'
+        self.submitted_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.finished_at = None
+        self.error = None
+        self.files = []
+        self.done_event = threading.Event()
+
+    def touches(self, records: list) -> bool:
+        """Excel 工作涵蓋整個清單；CSV 工作只涵蓋自己的記錄"""
+        if self.kind == 'excel':
+            return True
+        return any(r is own for r in records for own in self.records)
+
+    def to_json(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "dy_serial_nums": [r.dy_serial_num for r in self.records],
+            "status": self.status,
+            "submitted_at": self.submitted_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "files": [os.path.basename(f) for f in self.files],
+        }
+
+
+def _run_file_job(job: FileJob, func) -> None:
+    with _file_jobs_lock:
+        job.status = 'running'
+    try:
+        files = func()
+        status, error = 'done', None
+    except Exception as e:
+        logger.exception(f"背景檔案生成失敗（工作 {job.job_id}, {job.kind}）: {str(e)}")
+        files, status, error = [], 'failed', str(e)
+    with _file_jobs_lock:
+        job.files = files
+        job.status = status
+        job.error = error
+        job.finished_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    job.done_event.set()
+
+
+def _submit_file_job(kind: str, records: list, func) -> FileJob:
+    job = FileJob(kind, records)
+    with _file_jobs_lock:
+        _file_jobs[job.job_id] = job
+        # 只清除已完成的舊紀錄
+        while len(_file_jobs) > _FILE_JOB_HISTORY:
+            oldest_id, oldest = next(iter(_file_jobs.items()))
+            if not oldest.done_event.is_set():
+                break
+            del _file_jobs[oldest_id]
+
+    if _ASYNC_FILE_GENERATION:
+        _file_job_executor.submit(_run_file_job, job, func)
+    else:
+        _run_file_job(job, func)
+    return job
+
+
+def submit_csv_job(records: list) -> FileJob:
+    """背景生成 CSV（每筆記錄一個）；記錄在生成前已被移出清單時略過"""
+    def generate():
+        created = []
+        with _queue_lock:
+            try:
+                for record in records:
+                    if any(r is record for r in print_queue):
+                        record.attach_csv(create_csv_export(record))
+                        created.append(record)
+            finally:
+                journal_csv(created)
+        return [r.csv_path for r in created]
+    return _submit_file_job('csv', list(records), generate)
+
+
+def submit_excel_job() -> FileJob:
+    """背景重新生成 Excel；已有尚未開始的 Excel 工作時直接沿用（執行時會讀取最新清單）"""
+    with _file_jobs_lock:
+        for job in reversed(_file_jobs.values()):
+            if job.kind == 'excel' and job.status == 'pending':
+                return job
+    return _submit_file_job('excel', [], regenerate_excel_files)
+
+
+def wait_for_file_jobs(records: list, timeout: float = _FILE_JOB_WAIT_TIMEOUT_SEC) -> str:
+    """
+    等待與這些記錄相關、仍未完成的檔案生成工作
+    失敗的 CSV 工作、最近一次失敗的 Excel 工作在此同步重新生成一次（暫時性寫入錯誤不會一直擋住上傳）
+    全部成功返回空字串，否則返回錯誤訊息
+    """
+    with _file_jobs_lock:
+        jobs = [j for j in _file_jobs.values() if not j.done_event.is_set() and j.touches(records)]
+        failed = [j for j in _file_jobs.values()
+                  if j.status == 'failed' and j.kind == 'csv' and j.touches(records)]
+        # Excel 每次都依整個清單重新生成（會先刪除舊檔），只需看最近一次的結果
+        latest_excel = next((j for j in reversed(_file_jobs.values()) if j.kind == 'excel'), None)
+        if latest_excel is not None and latest_excel.status == 'failed':
+            failed.append(latest_excel)
+
+    deadline = time.time() + timeout
+    for job in jobs:
+        if not job.done_event.wait(max(0.0, deadline - time.time())):
+            return f"檔案仍在生成中（工作 {job.job_id}），請稍後再試"
+        if job.status == 'failed':
+            failed.append(job)
+
+    errors = []
+    for job in failed:
+        if job.kind == 'csv':
+            failed_serials = _retry_csv_job(job)
+            if failed_serials:
+                errors.append(f"序號 {', '.join(failed_serials)} 的 CSV 生成失敗：{job.error}")
+    excel_failed = [j for j in failed if j.kind == 'excel']
+    if excel_failed and not _retry_excel_jobs(excel_failed):
+        errors.append(f"Excel 生成失敗（工作 {excel_failed[-1].job_id}）：{excel_failed[-1].error}")
+    if errors:
+        return "；".join(errors)
+    return ""
+
+
+def _retry_excel_jobs(jobs: list) -> bool:
+    """依目前清單同步重新生成 Excel；成功時清除這些工作的失敗狀態並返回 True"""
+    try:
+        files = regenerate_excel_files()
+    except Exception as e:
+        logger.exception(f"重新生成 Excel 失敗: {str(e)}")
+        with _file_jobs_lock:
+            for job in jobs:
+                job.error = str(e)
+        return False
+
+    with _file_jobs_lock:
+        for job in jobs:
+            job.status = 'done'
+            job.error = None
+            job.files = files
+            job.finished_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    logger.info(f"已重新生成失敗工作 {', '.join(str(j.job_id) for j in jobs)} 的 Excel（{len(files)} 個）")
+    return True
+
+
+def _retry_csv_job(job: FileJob) -> list:
+    """
+    重新生成失敗 CSV 工作中仍在清單、且尚無 CSV 的記錄
+    全部成功時清除工作的失敗狀態；返回仍失敗的序號
+    """
+    files, created, failed_serials, last_error = [], [], [], None
+    with _queue_lock:
+        for record in job.records:
+            if not any(r is record for r in print_queue):
+                continue
+            try:
+                if not record.has_csv():
+                    record.attach_csv(create_csv_export(record))
+                    created.append(record)
+                files.append(record.csv_path)
+            except Exception as e:
+                logger.exception(f"重新生成 CSV 失敗（序號 {record.dy_serial_num}）: {str(e)}")
+                failed_serials.append(record.dy_serial_num)
+                last_error = str(e)
+        journal_csv(created)
+
+    with _file_jobs_lock:
+        if failed_serials:
+            job.error = last_error
         else:
-            delete_mark = ''
-        
-        # 原本欄位（col_value）
-        cell = ws[f'{col_value}{current_row}']
-        cell.font = normal_font
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        cell.border = thin_border
-        # 根據 delete_value_col 決定是否要在這裡顯示刪除標記
-        if delete_value_col == col_value:
-            cell.value = delete_mark
-        
-        # 修改為欄位（col_mod）
-        cell = ws[f'{col_mod}{current_row}']
-        cell.font = normal_font
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        cell.border = thin_border
-        # 根據 delete_value_col 決定是否要在這裡顯示刪除標記
-        if delete_value_col == col_mod:
-            cell.value = delete_mark
+            job.status = 'done'
+            job.error = None
+            job.files = files
+            job.finished_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    if not failed_serials:
+        logger.info(f"已重新生成失敗工作 {job.job_id} 的 CSV（{len(files)} 個）")
+    return failed_serials
+
+
+def get_file_jobs(limit: int = 50) -> list:
+    with _file_jobs_lock:
+        return [j.to_json() for j in list(_file_jobs.values())[-limit:]]
+
+
+# -----------------------
+# exports/ 保留政策（背景定期清理孤兒檔、封存、容量上限）
+# -----------------------
+_CSV_NAME_RE = re.compile(r'^生產日報表修改_(.+?)_\d{8}_\d{6}(?:_\d+)?\.csv$')
+_XLSX_NAME_RE = re.compile(r'^生產日報表修改申請_.*_(\d{8}_\d{6})\.xlsx$')
+_BUNDLE_PREFIX = '生產日報表上傳批次_'
+
+_retention_lock = threading.Lock()  # 同一時間只執行一次清理
+_retention_state = {
+    "runs": 0,
+    "last_run": None,
+    "last_report": None,
+    "total_reclaimed_bytes": 0,
+}
+
+
+def _archive_dir() -> str:
+    return os.path.join(LOCAL_EXPORT_DIR, RETENTION_ARCHIVE_SUBDIR)
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def find_export_orphans(entries: list) -> list:
+    """
+    比對列印清單找出未被引用的檔案（呼叫端持有 _queue_lock 與 _excel_lock）
+    - CSV：清單中記錄所記下的 CSV 以外都是孤兒
+    - Excel：只保留最近一次重新生成的那一組；清單沒有非當天記錄時全部都是孤兒
+    - 上傳批次 zip：上傳後即應刪除，留下的都是失敗殘留
+    返回 [(entry, 原因)]
+    """
+    referenced_csv = {os.path.basename(rec.csv_path) for rec in print_queue if rec.csv_path}
+    has_different_day = any(not is_same_day_record(r) for r in print_queue)
+
+    workbooks = []
+    orphans = []
+    for entry in entries:
+        name = entry.name
+        if _CSV_NAME_RE.match(name):
+            if name not in referenced_csv:
+                orphans.append((entry, 'unreferenced_csv'))
+            continue
+        m = _XLSX_NAME_RE.match(name)
+        if m:
+            workbooks.append((m.group(1), entry))
+            continue
+        if name.startswith(_BUNDLE_PREFIX) and name.endswith('.zip'):
+            orphans.append((entry, 'leftover_bundle'))
+
+    if workbooks:
+        current = max(ts for ts, _ in workbooks) if has_different_day else None
+        for ts, entry in workbooks:
+            if ts != current:
+                orphans.append((entry, 'stale_workbook'))
+    return orphans
+
+
+def _archive_files(entries: list) -> int:
+    """將檔案加入當月封存 zip，返回封存 zip 增加的位元組數"""
+    archive_dir = _archive_dir()
+    os.makedirs(archive_dir, exist_ok=True)
+    archive_path = os.path.join(archive_dir, f"exports_{datetime.now().strftime('%Y%m')}.zip")
+    before = os.path.getsize(archive_path) if os.path.exists(archive_path) else 0
+    with zipfile.ZipFile(archive_path, 'a', compression=zipfile.ZIP_DEFLATED) as zf:
+        existing = set(zf.namelist())
+        for entry in entries:
+            if entry.name not in existing:
+                zf.write(entry.path, arcname=entry.name)
+    return os.path.getsize(archive_path) - before
+
+
+def _enforce_archive_policy(report: dict, dry_run: bool) -> None:
+    """刪除過期的封存，並在 exports/ 超過容量上限時由最舊的封存開始刪除"""
+    archive_dir = _archive_dir()
+    if not os.path.isdir(archive_dir):
+        return
+    archives = sorted(
+        (e for e in os.scandir(archive_dir) if e.is_file() and e.name.endswith('.zip')),
+        key=lambda e: e.stat().st_mtime,
+    )
+    cutoff = time.time() - RETENTION_ARCHIVE_MAX_AGE_DAYS * 86400
+    limit = RETENTION_MAX_DIR_MB * 1024 * 1024
+    total = report["dir_bytes_before"] - report["reclaimed_bytes"]
+
+    for entry in archives:
+        size = entry.stat().st_size
+        if entry.stat().st_mtime >= cutoff and total <= limit:
+            continue
+        reason = 'expired_archive' if entry.stat().st_mtime < cutoff else 'size_limit'
+        report["removed_archives"].append({"name": entry.name, "size": size, "reason": reason})
+        if not dry_run:
+            try:
+                os.remove(entry.path)
+            except OSError as e:
+                report["errors"].append(f"{entry.name}: {str(e)}")
+                continue
+        total -= size
+        report["reclaimed_bytes"] += size
+
+    if total > limit:
+        logger.warning(f"[保留政策] exports/ 仍超過容量上限（{total // 1024 // 1024} MB），其餘檔案仍被清單引用")
+
+
+def run_retention(dry_run: bool = False) -> dict:
+    """執行一次保留政策，返回報告（dry_run 只列出會處理的檔案）"""
+    with _retention_lock:
+        started = time.perf_counter()
+        report = {
+            "started_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "dry_run": dry_run,
+            "scanned": 0,
+            "orphans": [],
+            "archived": 0,
+            "deleted": 0,
+            "removed_archives": [],
+            "reclaimed_bytes": 0,
+            "dir_bytes_before": _dir_size(LOCAL_EXPORT_DIR),
+            "errors": [],
+        }
+        grace_cutoff = time.time() - RETENTION_ORPHAN_GRACE_MIN * 60
+
+        # 只在比對清單時與存檔/檔案生成互斥，避免把剛生成、尚未加入清單比對的檔案當成孤兒；
+        # 孤兒都已超過寬限時間，封存與刪除在鎖外進行，不擋住存檔/上傳/列印
+        with _queue_lock, _excel_lock:
+            entries = [e for e in os.scandir(LOCAL_EXPORT_DIR) if e.is_file()]
+            report["scanned"] = len(entries)
+            targets = [(e, reason) for e, reason in find_export_orphans(entries)
+                       if e.stat().st_mtime < grace_cutoff]
+        report["orphans"] = [{"name": e.name, "size": e.stat().st_size, "reason": reason}
+                             for e, reason in targets]
+
+        if targets and not dry_run:
+            freed = 0
+            if RETENTION_ARCHIVE_ENABLED:
+                try:
+                    freed -= _archive_files([e for e, _ in targets])
+                except (OSError, zipfile.BadZipFile) as e:
+                    report["errors"].append(f"封存失敗: {str(e)}")
+                    targets = []
+            for entry, _ in targets:
+                # 比對後檔案被重新寫入（例如同名重新生成）時保留
+                try:
+                    stat = os.stat(entry.path)
+                except FileNotFoundError:
+                    continue
+                if stat.st_mtime >= grace_cutoff:
+                    continue
+                try:
+                    os.remove(entry.path)
+                except OSError as e:
+                    report["errors"].append(f"{entry.name}: {str(e)}")
+                    continue
+                freed += stat.st_size
+                if RETENTION_ARCHIVE_ENABLED:
+                    report["archived"] += 1
+                else:
+                    report["deleted"] += 1
+            report["reclaimed_bytes"] += max(freed, 0)
+        elif targets:
+            report["reclaimed_bytes"] += sum(e.stat().st_size for e, _ in targets)
+
+        _enforce_archive_policy(report, dry_run)
+        report["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+        if not dry_run:
+            _retention_state["runs"] += 1
+            _retention_state["last_run"] = report["started_at"]
+            _retention_state["total_reclaimed_bytes"] += report["reclaimed_bytes"]
+        _retention_state["last_report"] = report
+
+    if report["orphans"] or report["removed_archives"]:
+        logger.info(f"[保留政策] {'（試跑）' if dry_run else ''}處理 {len(report['orphans'])} 個孤兒檔、"
+                    f"{len(report['removed_archives'])} 個封存，釋放 {report['reclaimed_bytes'] / 1024:.1f} KB")
+    return report
+
+
+def get_retention_status() -> dict:
+    with _retention_lock:
+        return dict(_retention_state)
+
+
+def _retention_monitor() -> None:
+    """背景定期執行保留政策"""
+    while True:
+        time.sleep(RETENTION_INTERVAL_MIN * 60)
+        try:
+            run_retention()
+        except Exception as e:
+            logger.exception(f"[保留政策] 執行失敗: {str(e)}")
+
+
+# -----------------------
+# 排程批次處理（定時上傳當天記錄、預先準備列印檔案）
+# -----------------------
+_DISPATCH_WAIT_SEC = 30              # 手動上傳/列印等待排程完成的上限
+_SCHEDULE_TICK_SEC = 15
+_SCHEDULE_DEFER_RETRY_SEC = 60       # 因忙碌或網路資料夾無法連線而延後時，多久後重試
+_SCHEDULE_BACKLOG_RETRY_SEC = 30     # 單次處理上限未消化完時，多久後接著處理下一批
+_SCHEDULE_MAX_PENDING_JOBS = 20      # 背景檔案生成工作堆積超過此數時延後（使用者存檔優先）
+_SCHEDULE_HISTORY = 50
+
+# 手動上傳/列印與排程互斥，避免同一批檔案被兩邊同時上傳或刪除
+_dispatch_lock = threading.Lock()
+
+_schedule_lock = threading.Lock()
+_schedule_next_run = {}   # 時段名稱 -> 下次觸發時間 (epoch)
+_schedule_pending = {}    # 工作 -> {"window", "due", "attempts", "last_reason"}
+_schedule_history = deque(maxlen=_SCHEDULE_HISTORY)
+_schedule_stats = {"runs": 0, "deferred": 0, "failed": 0, "uploaded_records": 0}
+SCHEDULE_TASKS = ('upload', 'prepare_print')
+
+
+def upload_same_day_records(same_day_records: list, bundle: bool) -> dict:
+    """
+    上傳指定的當天記錄（CSV + 所有 Excel），成功後移出清單
+    手動上傳與排程共用，返回回應內容；呼叫端持有 _dispatch_lock
+    """
+    held = list(same_day_records)
+    hold_for_dispatch(held)
+    try:
+        return _upload_same_day_records(same_day_records, bundle)
+    finally:
+        release_dispatch(held)
+
+
+def _upload_same_day_records(same_day_records: list, bundle: bool) -> dict:
+    # 回寫已提交，之後的步驟失敗時訊息仍要帶上已回寫的筆數
+    writeback_note, conflict_note = "", ""
+    try:
+        with _queue_lock:
+            different_day_records = [r for r in print_queue if not is_same_day_record(r)]
         
-        ws.row_dimensions[current_row].height = 39.95
+        if not same_day_records:
+            return {"success": False, "message": "沒有當天記錄可上傳"}
         
-        current_row += 1
+        # 回寫模式：符合條件的記錄直接寫入資料庫，其餘（含衝突）照常上傳 CSV
+        if WRITEBACK_ENABLED:
+            try:
+                applied, conflicts, same_day_records = writeback_same_day_records(same_day_records)
+            except Exception as e:
+                logger.exception(f"回寫資料庫失敗: {str(e)}")
+                return {"success": False, "message": f"回寫資料庫失敗: {str(e)}"}
+            if applied:
+                writeback_note += f"已直接回寫資料庫 {len(applied)} 筆；"
+            if conflicts:
+                conflict_note = (f"其中 {len(conflicts)} 筆查詢後已被他人修改或資料列已不存在"
+                                 f"（序號：{', '.join(sorted({r.dy_serial_num for r in conflicts}))}），"
+                                 f"未直接回寫，已改以 CSV 上傳，請由後續流程人工確認；")
+            if not same_day_records:
+                return {
+                    "success": True,
+                    "message": writeback_note.rstrip('；'),
+                    "queue_count": len(print_queue),
+                }
         
-        # 第 4 行：原本/修改為標題（不合併）
-        cell = ws[f'{col_value}{current_row}']
-        cell.value = "原本"
-        cell.font = normal_font
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        cell.border = thin_border
+        if not is_share_available():
+            return {"success": False, "message": writeback_note + _share_unavailable_message()}
         
-        cell = ws[f'{col_mod}{current_row}']
-        cell.value = "修改為"
-        cell.font = normal_font
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-        cell.border = thin_border
+        # 等待這些記錄尚未完成的 CSV/Excel 生成工作
+        job_error = wait_for_file_jobs(same_day_records)
+        if job_error:
+            return {"success": False, "message": writeback_note + job_error}
         
-        ws.row_dimensions[current_row].height = 39.95
+        # 取得當天記錄的序號
+        same_day_serials = [r.dy_serial_num for r in same_day_records]
+        logger.info(f"準備上傳當天記錄：{same_day_serials}")
         
-        current_row += 1
+        # 找出這些記錄各自的 CSV 檔案
+        csv_files_to_upload, missing = find_record_csv_files(same_day_records)
+        if missing:
+            return {"success": False,
+                    "message": writeback_note + f"序號 {', '.join(sorted(set(missing)))} 的 CSV 不存在，請重新儲存後再上傳"}
         
-        # 14 個欄位（全部不合併）
-        for field_name, field_key, number_format in fields:
-            cell = ws[f'{col_label}{current_row}']
-            cell.value = field_name
-            cell.font = normal_font
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-            cell.border = thin_border
-            
-            # 處理原本值
-            cell = ws[f'{col_value}{current_row}']
-            
-            # 如果是刪除操作，原本欄位應該留空
-            if rec.get('delete_flag') == '是':
-                original_value = ''
-            else:
-                original_value = rec.get(f'{field_key}_original', '')
-                # 如果是日期時間欄位，轉換字串為 datetime 物件
-                if field_key in ['start_time', 'finish_time'] and original_value:
-                    try:
-                        if isinstance(original_value, str):
-                            # 嘗試解析不同格式的日期時間字串
-                            for fmt in ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y/%m/%d %H:%M:%S', '%Y/%m/%d %H:%M']:
-                                try:
-                                    original_value = datetime.strptime(original_value, fmt)
-                                    break
-                                except ValueError:
-                                    continue
-                    except Exception:
-                        pass  # 如果轉換失敗，保持原值
-            
-            cell.value = original_value
-            cell.font = normal_font
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-            cell.border = thin_border
-            cell.number_format = number_format
-            
-            # 處理修改值
-            cell = ws[f'{col_mod}{current_row}']
-            modified_value = rec.get(f'{field_key}_modified', '')
-            # 如果是日期時間欄位，轉換字串為 datetime 物件
-            if field_key in ['start_time', 'finish_time'] and modified_value:
-                try:
-                    if isinstance(modified_value, str):
-                        # 嘗試解析不同格式的日期時間字串
-                        for fmt in ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y/%m/%d %H:%M:%S', '%Y/%m/%d %H:%M']:
-                            try:
-                                modified_value = datetime.strptime(modified_value, fmt)
-                                break
-                            except ValueError:
-                                continue
-                except Exception:
-                    pass  # 如果轉換失敗，保持原值
-            cell.value = modified_value
-            cell.font = normal_font
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-            cell.border = thin_border
-            cell.number_format = number_format
-            
-            ws.row_dimensions[current_row].height = 39.95
-            current_row += 1
-    
-    # 底部合併儲存格（第 22-23 行合併，但內容為空）
-    ws.merge_cells('A22:F23')
-    # 不設定值，保持為空
-    ws.row_dimensions[22].height = 41.25
-    ws.row_dimensions[23].height = 41.25
-    
-    # 設定欄寬（按照範本）
-    ws.column_dimensions['A'].width = 57.28515625
-    ws.column_dimensions['B'].width = 40.7109375
-    ws.column_dimensions['C'].width = 40.0  # 修正為 40
-    ws.column_dimensions['D'].width = 57.28515625
-    ws.column_dimensions['E'].width = 40.7109375
-    ws.column_dimensions['F'].width = 40.0  # 修正為 40
-    
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    return output
-
-
-def create_multiple_excel_files(records: list) -> list:
-    """
-    根據記錄數量生成多個 Excel 檔案（每 2 筆一個檔案）
-    **只為非當天記錄生成 Excel**（當天記錄只需要 CSV）
-    返回生成的檔案路徑列表
-    """
-    if not records:
-        return []
-    
-    # 只為非當天記錄生成 Excel
-    different_day_records = [r for r in records if not is_same_day_record(r)]
-    
-    if not different_day_records:
-        logger.info("沒有非當天記錄，不生成 Excel")
-        return []
-    
-    logger.info(f"準備為 {len(different_day_records)} 筆非當天記錄生成 Excel")
-    
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    excel_files = []
-    
-    # 每 2 筆記錄生成一個 Excel
-    for i in range(0, len(different_day_records), 2):
-        batch = different_day_records[i:i+2]  # 取 2 筆（最後可能只有 1 筆）
-        batch_num = i // 2 + 1
+        # 找出所有 Excel 檔案（不管當天或非當天）
+        excel_files_to_upload = []
+        for filename in os.listdir(LOCAL_EXPORT_DIR):
+            if filename.startswith('生產日報表修改申請_') and filename.endswith('.xlsx'):
+                excel_files_to_upload.append(filename)
         
-        filename = f"生產日報表修改申請_{len(batch)}筆_批次{batch_num}_{timestamp}.xlsx"
-        filepath = os.path.join(LOCAL_EXPORT_DIR, filename)
+        files_to_upload = csv_files_to_upload + excel_files_to_upload
         
-        # 生成 Excel
-        excel_output = create_print_template(batch)
-        with open(filepath, 'wb') as f:
-            f.write(excel_output.getvalue())
+        if not files_to_upload:
+            return {"success": False, "message": writeback_note + "沒有檔案可上傳"}
         
-        excel_files.append(filepath)
-        logger.info(f"已生成 Excel 批次 {batch_num}: {filename}（非當天記錄）")
-    
-    return excel_files
+        logger.info(f"找到當天記錄的 CSV：{csv_files_to_upload}")
+        logger.info(f"找到所有 Excel：{excel_files_to_upload}")
+        
+        # 上傳檔案（打包模式時整批一次傳送）
+        failed_files = upload_batch_files(files_to_upload, same_day_records, 'same_day', bundle)
+        
+        if failed_files:
+            return {
+                "success": False,
+                "message": writeback_note + f"部分檔案上傳失敗: {', '.join(failed_files)}"
+            }
+        
+        # 上傳成功後，從修改申請清單中移除當天記錄
+        removed_count = len(same_day_records)
+        remove_from_queue(same_day_records, 'upload')
+        
+        logger.info(f"從清單移除 {removed_count} 筆當天記錄，剩餘 {len(print_queue)} 筆非當天記錄")
+        
+        # 刪除已上傳的本機檔案
+        try:
+            for filename in files_to_upload:
+                filepath = os.path.join(LOCAL_EXPORT_DIR, filename)
+                if os.path.exists(filepath):
+                    os.remove(filepath)
+                    logger.info(f"刪除本機檔案：{filename}")
+        except Exception as e:
+            logger.warning(f"清理本機檔案失敗: {str(e)}")
+        
+        # 不需要重新生成 Excel
+        # 非當天記錄的 Excel 已經在儲存時生成，不需要重複生成
+        if different_day_records:
+            logger.info(f"剩餘 {len(different_day_records)} 筆非當天記錄（Excel 已在儲存時生成）")
+        
+        return {
+            "success": True,
+            "message": writeback_note + f"已成功上傳 {removed_count} 筆當天記錄（{len(csv_files_to_upload)} 個 CSV + {len(excel_files_to_upload)} 個 Excel），" +
+                      conflict_note +
+                      (f"修改申請清單還有 {len(print_queue)} 筆記錄" if print_queue else "修改申請清單已清空"),
+            "queue_count": len(print_queue)
+        }
+        
+
+    except Exception as e:
+        logger.exception(f"上傳失敗: {str(e)}")
+        return {"success": False, "message": writeback_note + f"上傳失敗: {str(e)}"}
 
 
-def generate_print_urls(records: list) -> list:
+def _take_upload_chunk(records: list, limit: int) -> list:
+    """取前 limit 筆當天記錄，同一序號的記錄不拆到兩批（CSV 依序號比對）"""
+    if len(records) <= limit:
+        return records
+    chunk, serials = [], set()
+    for record in records:
+        if len(chunk) >= limit and record.dy_serial_num not in serials:
+            continue
+        chunk.append(record)
+        serials.add(record.dy_serial_num)
+    return chunk
+
+
+def _next_window_time(window: dict, now: float) -> float:
+    """every_min：每隔幾分鐘；at：每天固定時刻（HH:MM，可多個）"""
+    if window.get('every_min'):
+        return now + window['every_min'] * 60
+    current = datetime.fromtimestamp(now)
+    candidates = []
+    for hhmm in window.get('at', ()):
+        hour, minute = (int(x) for x in hhmm.split(':'))
+        at = current.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if at.timestamp() <= now:
+            at += timedelta(days=1)
+        candidates.append(at.timestamp())
+    return min(candidates) if candidates else float('inf')
+
+
+def _schedule_busy_reason(task: str) -> str:
+    """背壓檢查：返回延後原因，可執行時返回空字串"""
+    with _file_jobs_lock:
+        pending_jobs = sum(1 for j in _file_jobs.values() if not j.done_event.is_set())
+    if pending_jobs > _SCHEDULE_MAX_PENDING_JOBS:
+        return f"背景檔案生成工作堆積 {pending_jobs} 個"
+    if task == 'upload' and not is_share_available():
+        return "網路資料夾無法連線"
+    return ""
+
+
+def _run_scheduled_upload() -> tuple:
+    """返回 (結果, 處理筆數, 訊息)；結果為 done / backlog / failed"""
+    with _queue_lock:
+        same_day_records = [r for r in print_queue if is_same_day_record(r)]
+    if not same_day_records:
+        return 'done', 0, "沒有當天記錄"
+    chunk = _take_upload_chunk(same_day_records, SCHEDULE_MAX_RECORDS_PER_RUN)
+    result = upload_same_day_records(chunk, UPLOAD_BUNDLE_MODE)
+    if not result.get('success'):
+        return 'failed', 0, result.get('message', '')
+    outcome = 'backlog' if len(chunk) < len(same_day_records) else 'done'
+    return outcome, len(chunk), result.get('message', '')
+
+
+def _run_scheduled_prepare_print() -> tuple:
     """
-    生成單一列印頁面 URL，包含所有記錄
-    返回只有一個 URL 的列表
+    預先完成非當天記錄的 CSV / Excel 生成，操作員按「列印」時只需上傳
+    （不上傳、不移出清單：列印頁面仍需由操作員開啟）
     """
-    if not records:
-        return []
-    
-    # 生成包含所有記錄索引的單一 URL
-    all_indices = ','.join(str(i) for i in range(len(records)))
-    url = f"/print_page?indices={all_indices}"
-    
-    return [url]  # 返回只包含一個 URL 的列表
+    with _queue_lock:
+        different_day_records = [r for r in print_queue if not is_same_day_record(r)]
+    if not different_day_records:
+        return 'done', 0, "沒有非當天記錄"
+    has_excel = any(_XLSX_NAME_RE.match(name) for name in os.listdir(LOCAL_EXPORT_DIR))
+    if not has_excel:
+        # Excel 可能已隨當天記錄上傳後刪除，依目前清單重新生成
+        submit_excel_job()
+    job_error = wait_for_file_jobs(different_day_records)
+    if job_error:
+        return 'failed', 0, job_error
+    return 'done', len(different_day_records), f"已準備 {len(different_day_records)} 筆非當天記錄的列印檔案"
+
+
+_SCHEDULE_RUNNERS = {
+    'upload': _run_scheduled_upload,
+    'prepare_print': _run_scheduled_prepare_print,
+}
+
+
+def _run_schedule_task(task: str, window: str) -> str:
+    """執行一個排程工作並記錄；返回 done / backlog / deferred / failed"""
+    reason = _schedule_busy_reason(task)
+    # 手動上傳/列印進行中時不等待，留到下次重試
+    if not reason and not _dispatch_lock.acquire(blocking=False):
+        reason = "手動上傳/列印進行中"
+    if reason:
+        with _schedule_lock:
+            _schedule_stats["deferred"] += 1
+        logger.info(f"[排程] {window}/{task} 延後：{reason}")
+        return 'deferred'
+
+    started = time.perf_counter()
+    try:
+        outcome, count, message = _SCHEDULE_RUNNERS[task]()
+    except Exception as e:
+        logger.exception(f"[排程] {window}/{task} 執行失敗: {str(e)}")
+        outcome, count, message = 'failed', 0, str(e)
+    finally:
+        _dispatch_lock.release()
+
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+    with _schedule_lock:
+        _schedule_stats["runs"] += 1
+        if outcome == 'failed':
+            _schedule_stats["failed"] += 1
+        if task == 'upload':
+            _schedule_stats["uploaded_records"] += count
+        _schedule_history.append({
+            "window": window,
+            "task": task,
+            "started_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "elapsed_ms": elapsed_ms,
+            "outcome": outcome,
+            "records": count,
+            "message": message,
+        })
+    logger.info(f"[排程] {window}/{task} {outcome}：{count} 筆，{elapsed_ms} ms，{message}")
+    return outcome
+
+
+def trigger_schedule_task(task: str, window: str = "manual") -> None:
+    """把工作排入待執行並立即到期（已在等待重試時合併為同一筆，不會重複執行）"""
+    with _schedule_lock:
+        entry = _schedule_pending.setdefault(task, {"window": window, "due": 0.0, "attempts": 0, "last_reason": ""})
+        entry["due"] = time.time()
+        entry["window"] = window
+
+
+def _schedule_tick(now: float) -> None:
+    # 到時的時段把自己的工作排入待執行
+    for window in SCHEDULE_WINDOWS:
+        name = window['name']
+        with _schedule_lock:
+            due = _schedule_next_run.setdefault(name, _next_window_time(window, now))
+            if due > now:
+                continue
+            _schedule_next_run[name] = _next_window_time(window, now)
+        for task in window.get('tasks', ()):
+            trigger_schedule_task(task, name)
+
+    with _schedule_lock:
+        ready = [(task, entry["window"]) for task, entry in _schedule_pending.items() if entry["due"] <= now]
+
+    for task, window in ready:
+        outcome = _run_schedule_task(task, window)
+        with _schedule_lock:
+            entry = _schedule_pending.get(task)
+            if entry is None:
+                continue
+            if outcome == 'done':
+                del _schedule_pending[task]
+                continue
+            entry["attempts"] += 1
+            entry["last_reason"] = outcome
+            # 失敗不重試，等下一個時段；延後與未消化完則稍後再試
+            if outcome == 'failed':
+                del _schedule_pending[task]
+            elif outcome == 'backlog':
+                entry["due"] = time.time() + _SCHEDULE_BACKLOG_RETRY_SEC
+            else:
+                entry["due"] = time.time() + _SCHEDULE_DEFER_RETRY_SEC
+
+
+def _schedule_monitor() -> None:
+    """背景排程：依 SCHEDULE_WINDOWS 定時處理"""
+    while True:
+        time.sleep(_SCHEDULE_TICK_SEC)
+        try:
+            _schedule_tick(time.time())
+        except Exception as e:
+            logger.exception(f"[排程] 執行失敗: {str(e)}")
+
+
+def get_schedule_status() -> dict:
+    def fmt(ts):
+        return datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S') if ts and ts != float('inf') else None
+
+    with _schedule_lock:
+        return {
+            "enabled": SCHEDULER_ENABLED,
+            "windows": [dict(w, next_run=fmt(_schedule_next_run.get(w['name']))) for w in SCHEDULE_WINDOWS],
+            "pending": {task: dict(entry, due=fmt(entry["due"])) for task, entry in _schedule_pending.items()},
+            "dispatch_busy": _dispatch_lock.locked(),
+            "stats": dict(_schedule_stats),
+            "history": list(_schedule_history)[-20:],
+        }
 
 
 # -----------------------
-# CSV 生成函數
+# 請求效能分析（管理員按需啟用）
 # -----------------------
-def create_csv_export(record: dict) -> str:
-    """生成CSV檔案，返回檔案路徑"""
-    dy_serial_num = record.get('dy_serial_num', 'UNKNOWN')
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f"生產日報表修改_{dy_serial_num}_{timestamp}.csv"
-    filepath = os.path.join(LOCAL_EXPORT_DIR, filename)
-    
-    # CSV 欄位順序
-    csv_columns = [
-        '生產日報表序號', '刪除(Y/N)', '發工單號', '工作日期', '工作者編號',
-        '機台編號', '工序編號', '完工數', '不良數', '起工時間', '完工時間',
-        '除外名稱1', '除外時間1', '除外名稱2', '除外時間2', '除外名稱3', '除外時間3',
-        '儲存時間'
-    ]
-    
-    # 轉換刪除標記格式：是→Y，否→N
-    delete_flag = record.get('delete_flag', '否')
-    if delete_flag == '是':
-        delete_flag_csv = 'Y'
-    elif delete_flag == '否':
-        delete_flag_csv = 'N'
-    else:
-        delete_flag_csv = 'N'  # 預設為 N
-    
-    # 準備資料
-    data_row = {
-        '生產日報表序號': record.get('dy_serial_num', ''),
-        '刪除(Y/N)': delete_flag_csv,
-        '發工單號': record.get('pd_num', ''),
-        '工作日期': record.get('work_date_modified', record.get('work_date_original', '')),
-        '工作者編號': record.get('worker_num_modified', record.get('worker_num_original', '')),
-        '機台編號': record.get('machine_num_modified', record.get('machine_num_original', '')),
-        '工序編號': record.get('prod_num_modified', record.get('prod_num_original', '')),
-        '完工數': record.get('finish_qty_modified', record.get('finish_qty_original', '')),
-        '不良數': record.get('bad_qty_modified', record.get('bad_qty_original', '')),
-        '起工時間': record.get('start_time_modified', record.get('start_time_original', '')),
-        '完工時間': record.get('finish_time_modified', record.get('finish_time_original', '')),
-        '除外名稱1': record.get('extra_name1_modified', record.get('extra_name1_original', '')),
-        '除外時間1': record.get('extra_time1_modified', record.get('extra_time1_original', '')),
-        '除外名稱2': record.get('extra_name2_modified', record.get('extra_name2_original', '')),
-        '除外時間2': record.get('extra_time2_modified', record.get('extra_time2_original', '')),
-        '除外名稱3': record.get('extra_name3_modified', record.get('extra_name3_original', '')),
-        '除外時間3': record.get('extra_time3_modified', record.get('extra_time3_original', '')),
-        '儲存時間': record.get('saved_time', ''),
+# 停用時 before_request 只做一次布林判斷，不建立任何 profiler
+_profile_enabled = False
+_profile_settings = {
+    "sample_rate": 0.0,   # 0~1，對所有路由抽樣的比例
+    "routes": [],         # 指定路由（例如 /api/save）一律分析
+    "max_files": 200,     # profiles 目錄最多保留的分析檔數量
+}
+# cProfile 同一時間只能有一個啟用中的 profiler，用鎖確保一次只分析一個請求
+_profile_lock = threading.Lock()
+
+# 不分析的管理與高頻率路由
+_PROFILE_EXCLUDED_PATHS = ('/api/heartbeat', '/api/profiling', '/health')
+
+
+def _is_local_request() -> bool:
+    """管理功能只允許本機呼叫"""
+    return request.remote_addr in ("127.0.0.1", "::1")
+
+
+def _should_profile_request() -> bool:
+    """依指定路由或抽樣比例決定是否分析此請求"""
+    path = request.path
+    if path.startswith(_PROFILE_EXCLUDED_PATHS):
+        return False
+    if path in _profile_settings["routes"]:
+        return True
+    rate = _profile_settings["sample_rate"]
+    return rate > 0 and random.random() < rate
+
+
+def _extract_request_serial() -> str:
+    """從請求內容取出生產日報表序號（供分析檔標記用）"""
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        return normalize_dy_serial(data.get('dySerialNum') or data.get('dy_serial_num'))
+    return normalize_dy_serial(request.args.get('dySerialNum'))
+
+
+@app.before_request
+def _profile_before_request():
+    if not _profile_enabled:
+        return None
+    if not _should_profile_request():
+        return None
+    if not _profile_lock.acquire(blocking=False):
+        return None  # 已有請求正在分析中，略過
+
+    profiler = cProfile.Profile()
+    request.environ['prs.profiler'] = profiler
+    request.environ['prs.profile_start'] = time.perf_counter()
+    profiler.enable()
+    return None
+
+
+@app.after_request
+def _profile_after_request(response):
+    if 'prs.profiler' in request.environ:
+        request.environ['prs.profile_status'] = response.status_code
+    return response
+
+
+@app.after_request
+def _compress_after_request(response):
+    return compress_response(response)
+
+
+@app.teardown_request
+def _profile_teardown_request(exc):
+    profiler = request.environ.pop('prs.profiler', None)
+    if profiler is None:
+        return
+    try:
+        profiler.disable()
+        elapsed_ms = (time.perf_counter() - request.environ['prs.profile_start']) * 1000
+        _dump_request_profile(profiler, elapsed_ms, exc)
+    except Exception as e:
+        logger.warning(f"儲存效能分析失敗: {str(e)}")
+    finally:
+        _profile_lock.release()
+
+
+def _dump_request_profile(profiler, elapsed_ms: float, exc) -> None:
+    """將單一請求的分析結果與路由/序號資訊寫入 profiles 目錄"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+
+    serial = _extract_request_serial()
+    route = request.path.strip('/').replace('/', '_') or 'root'
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+    basename = f"{timestamp}_{route}" + (f"_{serial}" if serial else "")
+
+    profiler.dump_stats(os.path.join(PROFILE_DIR, basename + '.prof'))
+
+    meta = {
+        "route": request.path,
+        "method": request.method,
+        "dy_serial_num": serial,
+        "status": request.environ.get('prs.profile_status'),
+        "error": str(exc) if exc else None,
+        "elapsed_ms": round(elapsed_ms, 2),
+        "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
     }
-    
-    df = pd.DataFrame([data_row], columns=csv_columns)
-    df.to_csv(filepath, index=False, encoding='utf-8-sig')
-    
-    logger.info(f"CSV 已生成: {filepath}")
-    return filepath
+    with open(os.path.join(PROFILE_DIR, basename + '.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    logger.info(f"[效能分析] {request.method} {request.path} 序號={serial or '-'} 耗時 {elapsed_ms:.1f} ms")
+    _prune_profiles()
+
+
+def _prune_profiles() -> None:
+    """超過保留數量時刪除最舊的分析檔"""
+    try:
+        prof_files = sorted(f for f in os.listdir(PROFILE_DIR) if f.endswith('.prof'))
+        for f in prof_files[:max(0, len(prof_files) - _profile_settings["max_files"])]:
+            for ext in ('.prof', '.json'):
+                path = os.path.join(PROFILE_DIR, f[:-len('.prof')] + ext)
+                if os.path.exists(path):
+                    os.remove(path)
+    except Exception as e:
+        logger.warning(f"清理效能分析檔失敗: {str(e)}")
+
+
+def _load_profile_entries(route: str = '', serial: str = '') -> list:
+    """讀取 profiles 目錄中的分析檔資訊（可依路由/序號過濾）"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+
+    entries = []
+    for f in sorted(os.listdir(PROFILE_DIR)):
+        if not f.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(PROFILE_DIR, f), encoding='utf-8') as fp:
+                meta = json.load(fp)
+        except Exception:
+            continue
+        if route and meta.get('route') != route:
+            continue
+        if serial and meta.get('dy_serial_num') != serial:
+            continue
+        prof_path = os.path.join(PROFILE_DIR, f[:-len('.json')] + '.prof')
+        if os.path.exists(prof_path):
+            meta['file'] = os.path.basename(prof_path)
+            entries.append(meta)
+    return entries
+
+
+def summarize_profiles(entries: list, top: int = 30) -> list:
+    """合併多個分析檔，依累計時間排序取前 N 個函數"""
+    if not entries:
+        return []
+
+    stats = pstats.Stats(os.path.join(PROFILE_DIR, entries[0]['file']))
+    for meta in entries[1:]:
+        stats.add(os.path.join(PROFILE_DIR, meta['file']))
+
+    rows = []
+    for (filename, lineno, func), (cc, nc, tt, ct, _callers) in stats.stats.items():
+        rows.append({
+            "function": f"{os.path.basename(filename)}:{lineno}({func})",
+            "calls": nc,
+            "primitive_calls": cc,
+            "total_time_ms": round(tt * 1000, 3),
+            "cumulative_time_ms": round(ct * 1000, 3),
+        })
+    rows.sort(key=lambda r: r["cumulative_time_ms"], reverse=True)
+    return rows[:top]
 
 
 # -----------------------
-# 網路路徑上傳函數
+# 靜態資源快取（指紋網址 + 預先壓縮）與樣板條件式 GET
 # -----------------------
-def upload_to_network_share(local_filepath: str) -> bool:
-    """將檔案上傳到網路共用資料夾"""
+# url_for('static', ...) 自動加上 ?v=<內容雜湊>；帶正確指紋的請求可永久快取
+_STATIC_MAX_AGE_SEC = 365 * 24 * 3600
+_STATIC_COMPRESS_EXTS = ('.css', '.js', '.html', '.svg', '.json', '.txt')
+
+# Windows 登錄檔可能把 .css/.js 對應到 text/plain，明確指定
+mimetypes.add_type('text/css', '.css')
+mimetypes.add_type('application/javascript', '.js')
+
+_static_assets = {}  # filename -> {"mtime", "size", "fingerprint", "mimetype", "variants": {encoding: bytes}}
+_static_assets_lock = threading.Lock()
+
+
+def load_static_asset(filename: str):
+    """讀取靜態檔並建立 gzip/br 壓縮版本（檔案未變更時直接使用快取），不存在時返回 None"""
+    path = safe_join(app.static_folder, filename)
+    if path is None:
+        return None
     try:
-        # 檢查網路路徑是否可用
-        if not os.path.exists(NETWORK_SHARE_PATH):
-            logger.error(f"網路路徑不存在或無法訪問: {NETWORK_SHARE_PATH}")
-            return False
-        
-        filename = os.path.basename(local_filepath)
-        dest_path = os.path.join(NETWORK_SHARE_PATH, filename)
-        
-        shutil.copy2(local_filepath, dest_path)
-        logger.info(f"檔案已上傳: {dest_path}")
-        return True
-        
-    except Exception as e:
-        logger.exception(f"上傳失敗: {str(e)}")
-        return False
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    with _static_assets_lock:
+        asset = _static_assets.get(filename)
+    if asset and asset["mtime"] == st.st_mtime and asset["size"] == st.st_size:
+        return asset
+
+    with open(path, 'rb') as f:
+        body = f.read()
+    variants = {None: body}
+    if filename.lower().endswith(_STATIC_COMPRESS_EXTS):
+        compressed = {'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            compressed['br'] = brotli.compress(body, quality=11)
+        variants.update((enc, data) for enc, data in compressed.items() if len(data) < len(body))
+
+    asset = {
+        "mtime": st.st_mtime,
+        "size": st.st_size,
+        "fingerprint": hashlib.sha256(body).hexdigest()[:12],
+        "mimetype": mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+        "variants": variants,
+    }
+    with _static_assets_lock:
+        _static_assets[filename] = asset
+    return asset
+
+
+def build_static_assets() -> int:
+    """啟動時預先建立所有靜態檔的指紋與壓縮版本，返回檔案數"""
+    count = 0
+    if not os.path.isdir(app.static_folder):
+        return count
+    for root, _, files in os.walk(app.static_folder):
+        for name in files:
+            rel = os.path.relpath(os.path.join(root, name), app.static_folder).replace(os.sep, '/')
+            if load_static_asset(rel) is not None:
+                count += 1
+    return count
+
+
+@app.url_defaults
+def _static_fingerprint(endpoint, values):
+    if endpoint == 'static' and 'filename' in values and 'v' not in values:
+        asset = load_static_asset(values['filename'])
+        if asset is not None:
+            values['v'] = asset["fingerprint"]
+
+
+def serve_static_asset(filename):
+    """取代 Flask 預設的 static 路由：提供預先壓縮版本、ETag 與長期快取標頭"""
+    asset = load_static_asset(filename)
+    if asset is None:
+        abort(404)
+
+    variants = asset["variants"]
+    encoding = _negotiate_encoding(request.headers.get('Accept-Encoding', '')) if len(variants) > 1 else None
+    if encoding not in variants:
+        encoding = None
+
+    response = app.response_class(variants[encoding], mimetype=asset["mimetype"])
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(asset["fingerprint"], weak=True)
+    response.last_modified = datetime.fromtimestamp(asset["mtime"])
+    if request.args.get('v') == asset["fingerprint"]:
+        response.cache_control.public = True
+        response.cache_control.max_age = _STATIC_MAX_AGE_SEC
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+app.view_functions['static'] = serve_static_asset
+
+
+def render_conditional_template(template_name: str, **context):
+    """渲染樣板並加上 ETag；內容未變更時返回 304（每次都需重新驗證）"""
+    response = make_response(render_template(template_name, **context))
+    response.add_etag(weak=True)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 
 # -----------------------
@@ -670,7 +3928,7 @@ def index():
 
 @app.route("/table")
 def table_view():
-    return render_template("index_table.html")
+    return render_conditional_template("index_table.html")
 
 @app.route("/print_page")
 def print_page():
@@ -702,10 +3960,13 @@ def print_page():
     # 列印頁面顯示後，清空 pending_print_records
     # pending_print_records = []  # 不要立即清空，可能需要重新列印
     
-    return render_template("print_template.html", records=records)
+    return render_conditional_template("print_template.html", records=records)
 
 @app.route("/health")
 def health():
+    # 預設維持純文字 "ok"（_is_our_server_running 依此判斷）；?verbose=1 時回傳預熱狀態
+    if request.args.get("verbose"):
+        return jsonify({"status": "ok", "warmup": get_warmup_status()})
     return "ok"
 
 @app.route("/api/heartbeat", methods=["POST"])
@@ -735,71 +3996,179 @@ def shutdown():
 @app.route("/api/query", methods=["POST"])
 def api_query():
     data = request.get_json() or {}
-    dy_serial_num = (data.get("dySerialNum") or "").strip()
+    dy_serial_num = normalize_dy_serial(data.get("dySerialNum"))
+    fmt = str(data.get("format") or "records").lower()
 
     if not dy_serial_num:
         return jsonify({"success": False, "message": "請輸入生產日報表序號"})
 
-    # 如果沒有 DY 前綴，自動添加
-    if not dy_serial_num.upper().startswith("DY"):
-        dy_serial_num = "DY" + dy_serial_num
-    
-    # 統一轉為大寫
-    dy_serial_num = dy_serial_num.upper()
-
-    df = query_production_report(dy_serial_num)
+    if fmt not in QUERY_RESPONSE_FORMATS:
+        return jsonify({"success": False, "message": f"不支援的回應格式: {fmt}"})
 
+    # 預先查詢已載入時直接使用，否則查詢資料庫
+    df = take_prefetched_report(dy_serial_num)
     if df is None:
-        return jsonify({"success": False, "message": "資料庫查詢錯誤"})
+        df = query_production_report(dy_serial_num)
 
-    if df.empty:
-        return jsonify({"success": False, "message": "查無資料"})
+        if df is None:
+            return jsonify({"success": False, "message": "資料庫查詢錯誤"})
 
-    # datetime -> str
-    for col in df.columns:
-        if str(df[col].dtype).startswith("datetime"):
-            df[col] = df[col].dt.strftime("%Y-%m-%d %H:%M:%S")
+        if df.empty:
+            return jsonify({"success": False, "message": "查無資料"})
 
-    df = df.where(pd.notnull(df), None)
+        # datetime -> str，並保留一份給批次儲存比對原始值
+        df = format_report_frame(df)
+        cache_report(dy_serial_num, df)
 
-    return jsonify(
-        {
-            "success": True,
-            "data": df.to_dict("records"),
-            "count": len(df),
-        }
+    # 儲存時以此快照作為原本值，前端只需送回資料列鍵值與修改值
+    store_report_snapshots(dy_serial_num, df)
+    schedule_prefetch(dy_serial_num, df)
+
+    result = {"success": True, "format": fmt, "count": len(df)}
+    result.update(encode_report_frame(df, fmt))
+    return jsonify(result)
+
+@app.route("/api/suggest", methods=["GET"])
+def api_suggest():
+    """序號自動完成：q 為輸入中的序號前綴，可加 date（工作日期）、worker（工作者編號或名稱）篩選"""
+    prefix = (request.args.get("q") or "").strip()
+    if not prefix:
+        return jsonify({"success": True, "suggestions": [], "ready": _suggest_index["loaded_at"] is not None})
+
+    try:
+        limit = min(max(int(request.args.get("limit", _SUGGEST_DEFAULT_LIMIT)), 1), 50)
+    except ValueError:
+        limit = _SUGGEST_DEFAULT_LIMIT
+
+    suggestions = suggest_serials(
+        prefix, limit,
+        work_date=(request.args.get("date") or "").strip(),
+        worker=request.args.get("worker") or "",
     )
+    return jsonify({
+        "success": True,
+        "suggestions": suggestions,
+        "ready": _suggest_index["loaded_at"] is not None,
+    })
+
+
+@app.route("/api/summary", methods=["GET", "POST"])
+def api_summary():
+    """
+    生產彙總：依工作者、機台、部門、日期統計工時、完工數、不良率與除外時間
+    參數 startDate / endDate（YYYY-MM-DD，含起訖日），可用 dimensions 指定只回傳部分維度
+    """
+    data = request.get_json(silent=True) if request.method == "POST" else None
+    data = data or request.args.to_dict()
+    if parse_work_date(data.get('startDate')) is None:
+        return jsonify({"success": False, "message": "請輸入起始日期（YYYY-MM-DD）"})
+    try:
+        start, end = _parse_export_range(data)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)})
+
+    try:
+        result, cached = get_production_summary(start, end)
+    except Exception as e:
+        logger.exception(f"彙總查詢失敗: {str(e)}")
+        return jsonify({"success": False, "message": "資料庫查詢錯誤"})
+
+    dimensions = data.get("dimensions")
+    if isinstance(dimensions, str):
+        dimensions = [d.strip() for d in dimensions.split(",") if d.strip()]
+    summary = result["summary"]
+    if dimensions:
+        summary = {name: rows for name, rows in summary.items() if name in dimensions}
+
+    return jsonify({
+        "success": True,
+        "start_date": start.strftime('%Y-%m-%d'),
+        "end_date": end.strftime('%Y-%m-%d'),
+        "summary": summary,
+        "totals": result["totals"],
+        "generated_at": result["generated_at"],
+        "cached": cached,
+    })
+
 
 @app.route("/api/export", methods=["POST"])
 def api_export():
     data = request.get_json() or {}
-    dy_serial_num = (data.get("dySerialNum") or "").strip()
+    dy_serial_num = normalize_dy_serial(data.get("dySerialNum"))
+
+    # 欄式匯出（Parquet / gzip CSV），可依序號或日期區間
+    export_format = (data.get("format") or "xlsx").strip().lower()
+    if export_format in ("columnar", "parquet", "csv"):
+        return _export_columnar(data, dy_serial_num, export_format)
 
     if not dy_serial_num:
         return jsonify({"success": False, "message": "請輸入生產日報表序號"})
 
-    # 如果沒有 DY 前綴，自動添加
-    if not dy_serial_num.upper().startswith("DY"):
-        dy_serial_num = "DY" + dy_serial_num
-    
-    # 統一轉為大寫
-    dy_serial_num = dy_serial_num.upper()
-
     df = query_production_report(dy_serial_num)
 
     if df is None or df.empty:
         return jsonify({"success": False, "message": "無資料可匯出"})
 
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df.to_excel(writer, sheet_name="生產日報表", index=False)
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine="openpyxl") as writer:
+        df.to_excel(writer, sheet_name="生產日報表", index=False)
+
+    output.seek(0)
+    filename = f"生產日報表_{dy_serial_num}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+
+    return send_file(
+        output,
+        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        as_attachment=True,
+        download_name=filename,
+    )
+
+
+def _export_columnar(data: dict, dy_serial_num: str, export_format: str):
+    """分段讀取報表並以 Parquet（有 pyarrow 時）或 gzip CSV 下載"""
+    fmt = 'parquet' if export_format in ('columnar', 'parquet') and pq is not None else 'csv'
+    if export_format == 'parquet' and fmt != 'parquet':
+        logger.warning("未安裝 pyarrow，Parquet 匯出改用 gzip CSV")
+
+    if dy_serial_num:
+        where_sql = "    WHERE c.DySerialNum = ?"
+        params = [dy_serial_num]
+        name_part = dy_serial_num
+    else:
+        try:
+            start, end = _parse_export_range(data)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)})
+        where_sql = "    WHERE c.CDate >= ? AND c.CDate < ?"
+        params = [start.strftime('%Y-%m-%d'), (end + timedelta(days=1)).strftime('%Y-%m-%d')]
+        name_part = f"{start:%Y%m%d}-{end:%Y%m%d}"
+
+    suffix = '.parquet' if fmt == 'parquet' else '.csv.gz'
+    fd, filepath = tempfile.mkstemp(prefix='prs_export_', suffix=suffix)
+    os.close(fd)
+
+    try:
+        started = time.perf_counter()
+        total = export_report_columnar(where_sql, params, fmt, filepath)
+        logger.info(f"欄式匯出 {name_part}：{total} 筆，{os.path.getsize(filepath)} bytes，"
+                    f"耗時 {time.perf_counter() - started:.2f}s（{fmt}）")
+    except Exception as e:
+        logger.exception(f"欄式匯出失敗: {str(e)}")
+        os.remove(filepath)
+        return jsonify({"success": False, "message": "資料庫查詢錯誤"})
+
+    # 壓縮後的檔案很小，讀回記憶體後即可刪除暫存檔（Windows 無法刪除開啟中的檔案）
+    with open(filepath, 'rb') as f:
+        output = io.BytesIO(f.read())
+    os.remove(filepath)
 
-    output.seek(0)
-    filename = f"生產日報表_{dy_serial_num}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    if total == 0:
+        return jsonify({"success": False, "message": "無資料可匯出"})
 
+    filename = f"生產日報表_{name_part}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{suffix}"
     return send_file(
         output,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        mimetype="application/vnd.apache.parquet" if fmt == 'parquet' else "application/gzip",
         as_attachment=True,
         download_name=filename,
     )
@@ -812,197 +4181,145 @@ def api_save():
     
     data = request.get_json() or {}
     
-    # 驗證：至少要有1個欄位有輸入
-    has_modification = False
-    editable_fields = [
-        'work_date', 'worker_num', 'machine_num', 'prod_num',
-        'finish_qty', 'bad_qty', 'start_time', 'finish_time',
-        'extra_name1', 'extra_time1', 'extra_name2', 'extra_time2',
-        'extra_name3', 'extra_time3'
-    ]
-    
-    delete_flag = data.get('delete_flag', '否')
-    
-    # 如果勾選刪除，則不需要其他欄位
-    if delete_flag == '是':
-        has_modification = True
-    else:
-        for field in editable_fields:
-            if data.get(f'{field}_modified', '').strip():
-                has_modification = True
-                break
+    # 驗證並正規化（至少要有1個欄位有輸入、格式正確），記錄儲存時間
+    try:
+        record = ModificationRecord.from_payload(data)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)})
     
-    if not has_modification:
-        return jsonify({"success": False, "message": "尚未輸入任何修改資訊"})
+    # 同一資料列已在清單中時合併為一筆（CSV 改為合併後的內容）
+    queued, previous = queue_record(record)
     
-    # 加入列印清單（不限筆數）
-    # 不再檢查上限
+    # CSV（每筆記錄一個）與 Excel（每 2 筆一個檔案）改由背景工作生成，先回應使用者
+    csv_job = submit_csv_job([queued])
+    excel_job = submit_excel_job()
+    logger.info(f"已加入列印清單（共 {len(print_queue)} 筆{'，合併同一資料列' if previous else ''}），"
+                f"檔案生成工作：CSV {csv_job.job_id}、Excel {excel_job.job_id}")
     
-    # 記錄儲存時間
-    saved_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    data['saved_time'] = saved_time
+    if previous is not None:
+        message = f"已合併至清單中同一資料列的修改申請（第 {queued.edit_count} 次修改，目前 {len(print_queue)} 筆）"
+    else:
+        message = f"已儲存至列印清單（目前 {len(print_queue)} 筆）"
+    return jsonify({
+        "success": True,
+        "message": message,
+        "merged": previous is not None,
+        "queue_count": len(print_queue),
+        "jobs": [csv_job.job_id, excel_job.job_id],
+    })
+
+
+@app.route("/api/save_batch", methods=["POST"])
+def api_save_batch():
+    """
+    批次儲存多筆修改（可跨多個生產日報表序號）
+    - 原本值以查詢結果為準，向量化檢查格式/數量/起完工時間
+    - 全部通過才一次加入列印清單，只重新生成一次 Excel
+    """
+    data = request.get_json() or {}
+    items = data.get('modifications')
     
-    print_queue.append(data)
+    if not isinstance(items, list) or not items:
+        return jsonify({"success": False, "message": "沒有可儲存的修改資訊"})
     
-    # 刪除舊的 Excel 檔案（如果存在）
-    try:
-        for f in os.listdir(LOCAL_EXPORT_DIR):
-            if f.startswith('生產日報表修改申請_') and f.endswith('.xlsx'):
-                os.remove(os.path.join(LOCAL_EXPORT_DIR, f))
-    except Exception as e:
-        logger.warning(f"清理舊檔案失敗: {str(e)}")
+    records, errors = build_batch_records(items)
+    if errors:
+        logger.warning(f"批次儲存驗證失敗：{len(errors)}/{len(items)} 筆有錯誤")
+        return jsonify({
+            "success": False,
+            "message": f"共 {len(errors)} 筆修改資訊有誤，未儲存任何記錄",
+            "errors": errors,
+        })
     
-    # 生成 Excel 檔案（每 2 筆一個檔案）
+    # 任一檔案生成失敗時整批撤回
     try:
-        excel_files = create_multiple_excel_files(print_queue)
-        logger.info(f"已生成 {len(excel_files)} 個 Excel 檔案（共 {len(print_queue)} 筆記錄）")
-        excel_filenames = [os.path.basename(f) for f in excel_files]
+        csv_files, excel_files = enqueue_batch_records(records)
     except Exception as e:
-        logger.exception(f"生成 Excel 失敗: {str(e)}")
         return jsonify({"success": False, "message": f"儲存失敗: {str(e)}"})
     
-    # 生成 CSV 檔案（每筆記錄一個 CSV）
-    try:
-        csv_filepath = create_csv_export(data)
-    except Exception as e:
-        logger.exception(f"生成 CSV 失敗: {str(e)}")
-        return jsonify({"success": False, "message": f"儲存失敗: {str(e)}"})
+    serials = sorted({r.dy_serial_num for r in records})
+    logger.info(f"批次儲存 {len(records)} 筆（序號：{serials}），已生成 {len(excel_files)} 個 Excel")
     
     return jsonify({
         "success": True,
-        "message": f"已儲存至列印清單（目前 {len(print_queue)} 筆）",
+        "message": f"已批次儲存 {len(records)} 筆至列印清單（目前 {len(print_queue)} 筆）",
         "queue_count": len(print_queue),
-        "excel_files": excel_filenames,
-        "csv_file": os.path.basename(csv_filepath)
+        "saved_count": len(records),
+        "excel_files": [os.path.basename(f) for f in excel_files],
+        "csv_files": [os.path.basename(f) for f in csv_files],
     })
 
 
+def _use_upload_bundle() -> bool:
+    """請求內容可覆寫打包模式設定（只接受 JSON true/false，其他值沿用設定，避免 "false" 被當成開啟）"""
+    data = request.get_json(silent=True)
+    bundle = data.get('bundle') if isinstance(data, dict) else None
+    return bundle if isinstance(bundle, bool) else UPLOAD_BUNDLE_MODE
+
+
 @app.route("/api/upload", methods=["POST"])
 def api_upload():
     """上傳當天記錄到網路資料夾（CSV + 所有Excel）"""
-    global print_queue
-    
+    # 排程正在上傳時稍候，避免同一批檔案被上傳兩次
+    if not _dispatch_lock.acquire(timeout=_DISPATCH_WAIT_SEC):
+        return jsonify({"success": False, "message": "排程上傳進行中，請稍後再試"})
     try:
-        # 分類記錄：當天 vs 非當天
-        same_day_records = [r for r in print_queue if is_same_day_record(r)]
-        different_day_records = [r for r in print_queue if not is_same_day_record(r)]
-        
-        if not same_day_records:
-            return jsonify({"success": False, "message": "沒有當天記錄可上傳"})
-        
-        # 取得當天記錄的序號
-        same_day_serials = [r.get('dy_serial_num', '') for r in same_day_records]
-        logger.info(f"準備上傳當天記錄：{same_day_serials}")
-        
-        # 找出當天記錄對應的 CSV 檔案
-        csv_files_to_upload = []
-        for filename in os.listdir(LOCAL_EXPORT_DIR):
-            if not filename.endswith('.csv'):
-                continue
-            
-            # 檢查檔案名稱是否包含當天記錄的序號
-            for serial in same_day_serials:
-                if serial in filename:
-                    csv_files_to_upload.append(filename)
-                    break
-        
-        # 找出所有 Excel 檔案（不管當天或非當天）
-        excel_files_to_upload = []
-        for filename in os.listdir(LOCAL_EXPORT_DIR):
-            if filename.startswith('生產日報表修改申請_') and filename.endswith('.xlsx'):
-                excel_files_to_upload.append(filename)
-        
-        files_to_upload = csv_files_to_upload + excel_files_to_upload
-        
-        if not files_to_upload:
-            return jsonify({"success": False, "message": "沒有檔案可上傳"})
-        
-        logger.info(f"找到當天記錄的 CSV：{csv_files_to_upload}")
-        logger.info(f"找到所有 Excel：{excel_files_to_upload}")
-        
-        # 上傳檔案
-        success_count = 0
-        failed_files = []
-        
-        for filename in files_to_upload:
-            filepath = os.path.join(LOCAL_EXPORT_DIR, filename)
-            if upload_to_network_share(filepath):
-                success_count += 1
-                logger.info(f"上傳成功：{filename}")
-            else:
-                failed_files.append(filename)
-                logger.error(f"上傳失敗：{filename}")
-        
-        if failed_files:
-            return jsonify({
-                "success": False,
-                "message": f"部分檔案上傳失敗: {', '.join(failed_files)}"
-            })
-        
-        # 上傳成功後，從修改申請清單中移除當天記錄
-        removed_count = len(same_day_records)
-        print_queue = different_day_records
-        
-        logger.info(f"從清單移除 {removed_count} 筆當天記錄，剩餘 {len(print_queue)} 筆非當天記錄")
-        
-        # 刪除已上傳的本機檔案
-        try:
-            for filename in files_to_upload:
-                filepath = os.path.join(LOCAL_EXPORT_DIR, filename)
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                    logger.info(f"刪除本機檔案：{filename}")
-        except Exception as e:
-            logger.warning(f"清理本機檔案失敗: {str(e)}")
-        
-        # 不需要重新生成 Excel
-        # 非當天記錄的 Excel 已經在儲存時生成，不需要重複生成
-        if different_day_records:
-            logger.info(f"剩餘 {len(different_day_records)} 筆非當天記錄（Excel 已在儲存時生成）")
-        
-        return jsonify({
-            "success": True,
-            "message": f"已成功上傳 {removed_count} 筆當天記錄（{len(csv_files_to_upload)} 個 CSV + {len(excel_files_to_upload)} 個 Excel），" +
-                      (f"修改申請清單還有 {len(different_day_records)} 筆非當天記錄" if different_day_records else "修改申請清單已清空"),
-            "queue_count": len(different_day_records)
-        })
-        
-    except Exception as e:
-        logger.exception(f"上傳失敗: {str(e)}")
-        return jsonify({"success": False, "message": f"上傳失敗: {str(e)}"})
+        with _queue_lock:
+            same_day_records = [r for r in print_queue if is_same_day_record(r)]
+        return jsonify(upload_same_day_records(same_day_records, _use_upload_bundle()))
+    finally:
+        _dispatch_lock.release()
 
 
 @app.route("/api/print", methods=["POST"])
 def api_print():
     """列印非當天記錄（只處理非當天記錄）"""
-    global print_queue
+    if not _dispatch_lock.acquire(timeout=_DISPATCH_WAIT_SEC):
+        return jsonify({"success": False, "message": "排程上傳進行中，請稍後再試"})
+    try:
+        return _print_different_day_records()
+    finally:
+        _dispatch_lock.release()
+
+
+def _print_different_day_records():
+    # 分類記錄：當天 vs 非當天
+    with _queue_lock:
+        same_day_records = [r for r in print_queue if is_same_day_record(r)]
+        different_day_records = [r for r in print_queue if not is_same_day_record(r)]
     
-    if not print_queue:
+    if not same_day_records and not different_day_records:
         return jsonify({"success": False, "message": "修改申請清單為空"})
     
+    if not different_day_records:
+        return jsonify({"success": False, "message": "沒有非當天記錄可列印"})
+    
+    # 列印期間同一資料列的新修改另外加入清單，不合併進即將移出的記錄
+    hold_for_dispatch(different_day_records)
     try:
-        # 分類記錄：當天 vs 非當天
-        same_day_records = [r for r in print_queue if is_same_day_record(r)]
-        different_day_records = [r for r in print_queue if not is_same_day_record(r)]
+        return _print_records(same_day_records, different_day_records)
+    finally:
+        release_dispatch(different_day_records)
+
+
+def _print_records(same_day_records: list, different_day_records: list):
+    try:
+        if not is_share_available():
+            return jsonify({"success": False, "message": _share_unavailable_message()})
         
-        if not different_day_records:
-            return jsonify({"success": False, "message": "沒有非當天記錄可列印"})
+        # 等待這些記錄尚未完成的 CSV/Excel 生成工作
+        job_error = wait_for_file_jobs(different_day_records)
+        if job_error:
+            return jsonify({"success": False, "message": job_error})
         
         # 取得非當天記錄的序號
-        different_day_serials = [r.get('dy_serial_num', '') for r in different_day_records]
+        different_day_serials = [r.dy_serial_num for r in different_day_records]
         logger.info(f"準備列印非當天記錄：{different_day_serials}")
         
-        # 找出非當天記錄對應的 CSV 檔案
-        csv_files_to_upload = []
-        for filename in os.listdir(LOCAL_EXPORT_DIR):
-            if not filename.endswith('.csv'):
-                continue
-            
-            # 檢查檔案名稱是否包含非當天記錄的序號
-            for serial in different_day_serials:
-                if serial in filename:
-                    csv_files_to_upload.append(filename)
-                    break
+        # 找出這些記錄各自的 CSV 檔案
+        csv_files_to_upload, missing = find_record_csv_files(different_day_records)
+        if missing:
+            return jsonify({"success": False, "message": f"序號 {', '.join(sorted(set(missing)))} 的 CSV 不存在，請重新儲存後再列印"})
         
         # 找出所有 Excel 檔案
         excel_files_to_upload = []
@@ -1018,18 +4335,8 @@ def api_print():
         logger.info(f"找到非當天記錄的 CSV：{csv_files_to_upload}")
         logger.info(f"找到所有 Excel：{excel_files_to_upload}")
         
-        # 上傳非當天記錄的檔案
-        upload_success_count = 0
-        upload_failed_files = []
-        
-        for filename in files_to_upload:
-            filepath = os.path.join(LOCAL_EXPORT_DIR, filename)
-            if upload_to_network_share(filepath):
-                upload_success_count += 1
-                logger.info(f"上傳成功：{filename}")
-            else:
-                upload_failed_files.append(filename)
-                logger.error(f"上傳失敗：{filename}")
+        # 上傳非當天記錄的檔案（打包模式時整批一次傳送）
+        upload_failed_files = upload_batch_files(files_to_upload, different_day_records, 'different_day', _use_upload_bundle())
         
         if upload_failed_files:
             return jsonify({
@@ -1050,7 +4357,7 @@ def api_print():
         
         # 從修改申請清單中移除非當天記錄
         removed_count = len(different_day_records)
-        print_queue = same_day_records
+        remove_from_queue(different_day_records, 'print')
         
         logger.info(f"從清單移除 {removed_count} 筆非當天記錄，剩餘 {len(print_queue)} 筆當天記錄")
         
@@ -1094,7 +4401,9 @@ def api_get_queue_types():
         "success": True,
         "same_day_count": same_day_count,
         "different_day_count": different_day_count,
-        "total_count": len(print_queue)
+        "total_count": len(print_queue),
+        "share_available": _share_state["available"] is not False,
+        "share_error": _share_state["error"],
     })
 
 
@@ -1102,19 +4411,22 @@ def api_get_queue_types():
 def api_clear_queue():
     """清空所有列印清單"""
     global print_queue
-    count = len(print_queue)
-    print_queue = []
-    
-    # 刪除所有生成的 Excel 和 CSV 檔案
-    try:
-        for f in os.listdir(LOCAL_EXPORT_DIR):
-            if (f.startswith('生產日報表修改申請_') and f.endswith('.xlsx')) or \
-               (f.startswith('生產日報表修改_') and f.endswith('.csv')):
-                filepath = os.path.join(LOCAL_EXPORT_DIR, f)
-                os.remove(filepath)
-                logger.info(f"已刪除: {f}")
-    except Exception as e:
-        logger.warning(f"清理檔案失敗: {str(e)}")
+    with _queue_lock, _excel_lock:
+        count = len(print_queue)
+        journal_remove(print_queue, 'clear')
+        print_queue = []
+        _rebuild_row_index()
+        
+        # 刪除所有生成的 Excel 和 CSV 檔案
+        try:
+            for f in os.listdir(LOCAL_EXPORT_DIR):
+                if (f.startswith('生產日報表修改申請_') and f.endswith('.xlsx')) or \
+                   (f.startswith('生產日報表修改_') and f.endswith('.csv')):
+                    filepath = os.path.join(LOCAL_EXPORT_DIR, f)
+                    os.remove(filepath)
+                    logger.info(f"已刪除: {f}")
+        except Exception as e:
+            logger.warning(f"清理檔案失敗: {str(e)}")
     
     return jsonify({
         "success": True,
@@ -1125,30 +4437,16 @@ def api_clear_queue():
 @app.route("/api/clear_same_day_queue", methods=["POST"])
 def api_clear_same_day_queue():
     """清空當天修改的記錄（上傳後調用）"""
-    global print_queue
-    
     # 找出當天的記錄
-    same_day_records = [r for r in print_queue if r.get('date_type') == 'same_day']
-    same_day_serials = [r.get('dy_serial_num') for r in same_day_records]
+    same_day_records = [r for r in print_queue if r.date_type == 'same_day']
     
     # 移除當天的記錄
-    print_queue = [r for r in print_queue if r.get('date_type') != 'same_day']
+    remove_from_queue(same_day_records, 'clear_same_day')
     
-    # 刪除當天記錄對應的檔案
-    try:
-        for f in os.listdir(LOCAL_EXPORT_DIR):
-            if not (f.endswith('.xlsx') or f.endswith('.csv')):
-                continue
-            
-            # 檢查檔案是否屬於當天的記錄
-            is_same_day_file = any(serial in f for serial in same_day_serials)
-            
-            if is_same_day_file:
-                filepath = os.path.join(LOCAL_EXPORT_DIR, f)
-                os.remove(filepath)
-                logger.info(f"已刪除當天記錄檔案: {f}")
-    except Exception as e:
-        logger.warning(f"清理當天記錄檔案失敗: {str(e)}")
+    # 刪除當天記錄各自的 CSV
+    with _queue_lock:
+        for record in same_day_records:
+            _remove_record_csv(record)
     
     return jsonify({
         "success": True,
@@ -1159,30 +4457,16 @@ def api_clear_same_day_queue():
 @app.route("/api/clear_different_day_queue", methods=["POST"])
 def api_clear_different_day_queue():
     """清空非當天修改的記錄（列印後調用）"""
-    global print_queue
-    
     # 找出非當天的記錄
-    different_day_records = [r for r in print_queue if r.get('date_type') == 'different_day']
-    different_day_serials = [r.get('dy_serial_num') for r in different_day_records]
+    different_day_records = [r for r in print_queue if r.date_type == 'different_day']
     
     # 移除非當天的記錄
-    print_queue = [r for r in print_queue if r.get('date_type') != 'different_day']
+    remove_from_queue(different_day_records, 'clear_different_day')
     
-    # 刪除非當天記錄對應的檔案
-    try:
-        for f in os.listdir(LOCAL_EXPORT_DIR):
-            if not (f.endswith('.xlsx') or f.endswith('.csv')):
-                continue
-            
-            # 檢查檔案是否屬於非當天的記錄
-            is_different_day_file = any(serial in f for serial in different_day_serials)
-            
-            if is_different_day_file:
-                filepath = os.path.join(LOCAL_EXPORT_DIR, f)
-                os.remove(filepath)
-                logger.info(f"已刪除非當天記錄檔案: {f}")
-    except Exception as e:
-        logger.warning(f"清理非當天記錄檔案失敗: {str(e)}")
+    # 刪除非當天記錄各自的 CSV
+    with _queue_lock:
+        for record in different_day_records:
+            _remove_record_csv(record)
     
     return jsonify({
         "success": True,
@@ -1190,13 +4474,126 @@ def api_clear_different_day_queue():
     })
 
 
+@app.route("/api/query_stats", methods=["GET"])
+def api_query_stats():
+    """查詢合併統計（實際 DB 查詢數、被合併省下的查詢數）與預先查詢命中率"""
+    return jsonify({"success": True, "stats": get_query_stats(), "prefetch": get_prefetch_stats()})
+
+
+@app.route("/api/retention", methods=["GET", "POST"])
+def api_retention():
+    """查詢 exports/ 保留政策狀態，或立即執行一次（POST，可 dry_run；僅限本機）"""
+    if request.method == "GET":
+        return jsonify({"success": True, "status": get_retention_status()})
+
+    if not _is_local_request():
+        return jsonify({"success": False, "message": "forbidden"}), 403
+
+    data = request.get_json(silent=True) or {}
+    try:
+        report = run_retention(dry_run=bool(data.get("dry_run")))
+    except OSError as e:
+        logger.exception(f"[保留政策] 執行失敗: {str(e)}")
+        return jsonify({"success": False, "message": f"清理失敗: {str(e)}"})
+    return jsonify({"success": True, "report": report})
+
+
+@app.route("/api/schedule", methods=["GET", "POST"])
+def api_schedule():
+    """查詢排程狀態，或立即執行一次指定工作（POST {"task": "upload" | "prepare_print"}；僅限本機）"""
+    if request.method == "GET":
+        return jsonify({"success": True, "status": get_schedule_status()})
+
+    if not _is_local_request():
+        return jsonify({"success": False, "message": "forbidden"}), 403
+
+    data = request.get_json(silent=True) or {}
+    task = data.get("task", "")
+    if task not in SCHEDULE_TASKS:
+        return jsonify({"success": False, "message": f"task 必須是 {', '.join(SCHEDULE_TASKS)} 之一"})
+    # 由背景排程執行緒處理；未啟用排程時只在此執行這一項工作，不檢查各時段
+    if SCHEDULER_ENABLED:
+        trigger_schedule_task(task)
+        return jsonify({"success": True, "status": get_schedule_status()})
+    outcome = _run_schedule_task(task, "manual")
+    return jsonify({"success": outcome != 'failed', "outcome": outcome, "status": get_schedule_status()})
+
+
+@app.route("/api/import", methods=["POST"])
+def api_import():
+    """
+    由試算表批次匯入修改申請（xlsx 或 CSV，欄位同修改申請 CSV）
+    全部通過才一次加入列印清單；有錯誤時回傳每列的錯誤，不儲存任何記錄
+    """
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify({"success": False, "message": "請選擇要匯入的檔案"})
+
+    try:
+        rows = read_import_rows(upload)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)})
+    except Exception as e:
+        logger.exception(f"讀取匯入檔案失敗: {str(e)}")
+        return jsonify({"success": False, "message": f"無法讀取檔案: {str(e)}"})
+
+    if not rows:
+        return jsonify({"success": False, "message": "檔案沒有資料"})
+
+    items, row_numbers, errors = build_import_items(rows)
+    records = []
+    if items:
+        records, batch_errors = build_batch_records(items)
+        errors.extend({"row": row_numbers[e["index"]], "dy_serial_num": e["dy_serial_num"],
+                       "messages": e["messages"]} for e in batch_errors)
+    if errors:
+        errors.sort(key=lambda e: e["row"])
+        logger.warning(f"匯入驗證失敗：{len(errors)}/{len(rows)} 列有錯誤（{upload.filename}）")
+        return jsonify({
+            "success": False,
+            "message": f"共 {len(errors)} 列有誤，未匯入任何記錄",
+            "errors": errors,
+        })
+
+    try:
+        csv_files, excel_files = enqueue_batch_records(records)
+    except Exception as e:
+        return jsonify({"success": False, "message": f"匯入失敗: {str(e)}"})
+
+    logger.info(f"已匯入 {len(records)} 筆（{upload.filename}），已生成 {len(excel_files)} 個 Excel")
+    return jsonify({
+        "success": True,
+        "message": f"已匯入 {len(records)} 筆至列印清單（目前 {len(print_queue)} 筆）",
+        "queue_count": len(print_queue),
+        "saved_count": len(records),
+        "excel_files": [os.path.basename(f) for f in excel_files],
+        "csv_files": [os.path.basename(f) for f in csv_files],
+    })
+
+
+@app.route("/api/jobs", methods=["GET"])
+def api_jobs():
+    """最近的背景檔案生成工作狀態"""
+    try:
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        limit = 50
+    return jsonify({"success": True, "jobs": get_file_jobs(limit)})
+
+
+@app.route("/api/share_status", methods=["GET"])
+def api_share_status():
+    """網路資料夾的快取健康狀態（可連線、延遲、傳輸速度）"""
+    return jsonify({"success": True, **get_share_status()})
+
+
 @app.route("/api/get_queue_status", methods=["GET"])
 def api_get_queue_status():
     """取得列印清單狀態"""
     return jsonify({
         "success": True,
         "queue_count": len(print_queue),
-        "queue": print_queue
+        "queue": [r.to_queue_json() for r in print_queue]
     })
 
 
@@ -1208,46 +4605,22 @@ def api_delete_queue_item():
     data = request.get_json() or {}
     index = data.get('index')
     
-    if index is None or index < 0 or index >= len(print_queue):
-        return jsonify({"success": False, "message": "無效的索引"})
-    
-    deleted_item = print_queue.pop(index)
-    deleted_serial_num = deleted_item.get('dy_serial_num', 'UNKNOWN')
-    
-    # 刪除對應的 CSV 檔案
-    try:
-        for f in os.listdir(LOCAL_EXPORT_DIR):
-            # 檢查是否為該序號的 CSV 檔案
-            if f.startswith(f'生產日報表修改_{deleted_serial_num}_') and f.endswith('.csv'):
-                csv_filepath = os.path.join(LOCAL_EXPORT_DIR, f)
-                os.remove(csv_filepath)
-                logger.info(f"已刪除 CSV: {f}")
-                break
-    except Exception as e:
-        logger.warning(f"刪除 CSV 失敗: {str(e)}")
+    # 與背景 CSV 工作互斥：移出清單後，尚未生成的 CSV 不會再寫出
+    # 索引檢查也在鎖內，避免期間其他請求使清單變短
+    with _queue_lock:
+        if not isinstance(index, int) or index < 0 or index >= len(print_queue):
+            return jsonify({"success": False, "message": "無效的索引"})
+        deleted_item = print_queue.pop(index)
+        _rebuild_row_index()
+        journal_remove([deleted_item], 'delete')
+        deleted_serial_num = deleted_item.dy_serial_num
+        
+        # 只刪除這筆記錄的 CSV（同序號其他資料列的 CSV 保留）
+        _remove_record_csv(deleted_item)
     
-    # 重新生成 Excel（包含剩餘的記錄）
-    if print_queue:
-        try:
-            # 刪除舊的 Excel 檔案
-            for f in os.listdir(LOCAL_EXPORT_DIR):
-                if f.startswith('生產日報表修改申請_') and f.endswith('.xlsx'):
-                    os.remove(os.path.join(LOCAL_EXPORT_DIR, f))
-            
-            # 生成新的 Excel（可能有多個檔案）
-            excel_files = create_multiple_excel_files(print_queue)
-            
-            logger.info(f"已刪除記錄並重新生成 {len(excel_files)} 個 Excel 檔案")
-        except Exception as e:
-            logger.exception(f"重新生成 Excel 失敗: {str(e)}")
-    else:
-        # 如果清單為空，刪除所有 Excel 檔案
-        try:
-            for f in os.listdir(LOCAL_EXPORT_DIR):
-                if f.startswith('生產日報表修改申請_') and f.endswith('.xlsx'):
-                    os.remove(os.path.join(LOCAL_EXPORT_DIR, f))
-        except Exception as e:
-            logger.warning(f"清理檔案失敗: {str(e)}")
+    # 背景重新生成 Excel（包含剩餘的記錄；清單為空時只刪除舊檔）
+    excel_job = submit_excel_job()
+    logger.info(f"已刪除記錄，Excel 重新生成工作：{excel_job.job_id}")
     
     return jsonify({
         "success": True,
@@ -1256,6 +4629,80 @@ def api_delete_queue_item():
     })
 
 
+@app.route("/api/profiling", methods=["GET", "POST"])
+def api_profiling():
+    """查詢或設定請求效能分析（僅限本機管理員）"""
+    global _profile_enabled
+
+    if not _is_local_request():
+        return jsonify({"success": False, "message": "forbidden"}), 403
+
+    if request.method == "POST":
+        data = request.get_json() or {}
+        try:
+            if 'sample_rate' in data:
+                rate = float(data.get('sample_rate') or 0)
+                _profile_settings["sample_rate"] = min(max(rate, 0.0), 1.0)
+            if 'routes' in data:
+                routes = data.get('routes') or []
+                if isinstance(routes, str):
+                    routes = [routes]
+                _profile_settings["routes"] = [str(r).strip() for r in routes if str(r).strip()]
+            if 'max_files' in data:
+                _profile_settings["max_files"] = max(1, int(data.get('max_files')))
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "message": "無效的效能分析設定"})
+
+        if 'enabled' in data:
+            _profile_enabled = bool(data.get('enabled'))
+
+        logger.info(f"[效能分析] 設定更新：enabled={_profile_enabled}, settings={_profile_settings}")
+
+    return jsonify({
+        "success": True,
+        "enabled": _profile_enabled,
+        "sample_rate": _profile_settings["sample_rate"],
+        "routes": _profile_settings["routes"],
+        "max_files": _profile_settings["max_files"],
+        "profile_dir": PROFILE_DIR,
+        "profile_count": len(_load_profile_entries()),
+    })
+
+
+@app.route("/api/profiling/summary", methods=["GET"])
+def api_profiling_summary():
+    """彙總已儲存的效能分析：依累計時間列出最耗時的函數"""
+    if not _is_local_request():
+        return jsonify({"success": False, "message": "forbidden"}), 403
+
+    route = (request.args.get('route') or '').strip()
+    serial = normalize_dy_serial(request.args.get('dySerialNum'))
+    try:
+        top = int(request.args.get('top', 30))
+    except ValueError:
+        top = 30
+
+    entries = _load_profile_entries(route, serial)
+    if not entries:
+        return jsonify({"success": False, "message": "沒有符合條件的效能分析檔"})
+
+    try:
+        functions = summarize_profiles(entries, top)
+    except Exception as e:
+        logger.exception(f"彙總效能分析失敗: {str(e)}")
+        return jsonify({"success": False, "message": f"彙總失敗: {str(e)}"})
+
+    elapsed = [m.get('elapsed_ms') or 0 for m in entries]
+    return jsonify({
+        "success": True,
+        "request_count": len(entries),
+        "avg_elapsed_ms": round(sum(elapsed) / len(elapsed), 2),
+        "max_elapsed_ms": max(elapsed),
+        "requests": entries[-20:],
+        "functions": functions,
+    })
+
+
 # -----------------------
 # Process control
 # -----------------------
@@ -1292,14 +4739,119 @@ def _idle_monitor():
             time.sleep(2)
             os._exit(0)
 
+# -----------------------
+# 啟動預熱（背景執行，瀏覽器開啟期間完成）
+# -----------------------
+_warmup_state = {
+    "started_at": None,
+    "finished_at": None,
+    "tasks": {},  # 名稱 -> {"status": pending/done/failed, "elapsed_ms", "error"}
+}
+_warmup_lock = threading.Lock()
+
+
+def _warmup_db():
+    """建立第一條 ODBC 連線（之後由驅動程式連線池重用），並以不回傳資料的條件預先編譯報表查詢"""
+    conn = get_db_connection()
+    try:
+        pd.read_sql(REPORT_SELECT_SQL + "    WHERE 1 = 0" + REPORT_ORDER_SQL, conn)
+    finally:
+        conn.close()
+
+
+def _warmup_templates():
+    """預先編譯 Jinja 樣板（結果由 jinja_env 快取）"""
+    for name in ("index_table.html", "print_template.html"):
+        app.jinja_env.get_template(name)
+
+
+def _warmup_static():
+    """預先計算靜態檔指紋並建立壓縮版本"""
+    build_static_assets()
+
+
+def _warmup_pandas_excel():
+    """執行一次查詢結果格式化、JSON 轉換與 openpyxl 套表生成，載入延遲匯入的模組"""
+    import sqlite3
+    # pd.read_sql 首次呼叫時才載入 pandas.io.sql；非 SQLAlchemy 連線（pyodbc 與 sqlite3）走同一條路徑
+    conn = sqlite3.connect(":memory:")
+    try:
+        pd.read_sql("SELECT 1 AS x", conn)
+    finally:
+        conn.close()
+    df = pd.DataFrame({"起工時間": pd.to_datetime(["2000-01-01 08:00:00"]), "完工數": [1.0]})
+    format_report_frame(df).to_dict("records")
+    create_print_template([])
+
+
+_WARMUP_TASKS = (
+    ("db", _warmup_db),
+    ("templates", _warmup_templates),
+    ("static", _warmup_static),
+    ("pandas_excel", _warmup_pandas_excel),
+)
+
+
+def _run_warmup_task(name: str, func) -> None:
+    started = time.perf_counter()
+    try:
+        func()
+        status, error = "done", None
+    except Exception as e:
+        status, error = "failed", str(e)
+        logger.warning(f"[預熱] {name} 失敗: {error}")
+
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+    with _warmup_lock:
+        _warmup_state["tasks"][name] = {"status": status, "elapsed_ms": elapsed_ms, "error": error}
+        if all(t["status"] != "pending" for t in _warmup_state["tasks"].values()):
+            _warmup_state["finished_at"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            logger.info(f"[預熱] 完成：{_warmup_state['tasks']}")
+
+
+def start_warmup() -> None:
+    """各預熱項目各自以背景執行緒執行，互不等待"""
+    with _warmup_lock:
+        _warmup_state["started_at"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        _warmup_state["finished_at"] = None
+        _warmup_state["tasks"] = {
+            name: {"status": "pending", "elapsed_ms": None, "error": None} for name, _ in _WARMUP_TASKS
+        }
+    for name, func in _WARMUP_TASKS:
+        threading.Thread(target=_run_warmup_task, args=(name, func), daemon=True, name=f"warmup-{name}").start()
+
+
+def get_warmup_status() -> dict:
+    with _warmup_lock:
+        tasks = {name: dict(task) for name, task in _warmup_state["tasks"].items()}
+        return {
+            "ready": bool(tasks) and all(t["status"] != "pending" for t in tasks.values()),
+            "started_at": _warmup_state["started_at"],
+            "finished_at": _warmup_state["finished_at"],
+            "tasks": tasks,
+        }
+
+
 def main():
     if _is_our_server_running():
         _open_browser()
         return
 
+    # 還原上次結束（含閒置自動結束或當機）時的列印清單
+    recover_print_queue()
+
     t = threading.Thread(target=_idle_monitor, daemon=True)
     t.start()
 
+    threading.Thread(target=_share_health_monitor, daemon=True).start()
+    threading.Thread(target=_retention_monitor, daemon=True, name="retention").start()
+    threading.Thread(target=_suggest_index_monitor, daemon=True, name="suggest-index").start()
+    if SCHEDULER_ENABLED:
+        threading.Thread(target=_schedule_monitor, daemon=True, name="scheduler").start()
+
+    # 瀏覽器開啟期間先在背景完成 DB 連線、樣板編譯與 pandas/openpyxl 載入
+    start_warmup()
+
     threading.Timer(1.0, _open_browser).start()
 
     logger.info("Starting server at http://%s:%s", HOST, PORT)
@@ -1307,6 +4859,9 @@ def main():
     app.run(host=HOST, port=PORT, debug=False, use_reloader=False, threaded=True)
 
 if __name__ == "__main__":
+    # 打包執行檔中的子行程由此接手，不會重新啟動伺服器
+    multiprocessing.freeze_support()
+    _mp_freeze_support_ready = True
     try:
         main()
     except Exception as e:
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+"""
+多站台負載測試：以替身資料庫與本機暫存資料夾（取代網路資料夾）啟動 app，
+同時模擬 N 個瀏覽器分頁的操作，輸出各路由的吞吐量、p50/p99 延遲與錯誤率。
+
+每個站台的行為同 index_table.html：
+  - 每 3 秒 POST /api/heartbeat
+  - 每 5 秒 GET /api/get_queue_status 與 /api/get_queue_types
+  - 穿插操作：輸入序號（/api/suggest）→ 查詢 → 儲存，偶爾上傳或列印
+
+用法（開發環境，不需連線資料庫或網路資料夾）：
+  python loadtest.py --stations 20 --duration 120
+  python loadtest.py --stations 50 --duration 300 --db-latency-ms 80 --json result.json
+"""
+import argparse
+import gzip
+import http.client
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+from werkzeug.serving import make_server
+
+import app as prs
+
+_HEARTBEAT_SEC = 3
+_POLL_SEC = 5
+_REQUEST_TIMEOUT_SEC = 120
+
+
+# -----------------------
+# 替身資料庫與網路資料夾
+# -----------------------
+class StandInDatabase:
+    """
+    產生固定的生產日報表資料（欄位同 REPORT_SELECT_SQL），取代 SQL Server 查詢
+    latency_ms 模擬每次查詢的往返時間（sleep 期間釋放 GIL，同實際 I/O）
+    """
+
+    def __init__(self, serial_count: int, rows_per_report: int, today_ratio: float,
+                 latency_ms: float, seed: int):
+        self.latency = latency_ms / 1000.0
+        self.queries = 0
+        self._lock = threading.Lock()
+        rng = random.Random(seed)
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.reports = {}
+        for i in range(serial_count):
+            serial = f"DY{20000000 + i:08d}"
+            work_date = today if rng.random() < today_ratio else today - timedelta(days=rng.randint(1, 20))
+            self.reports[serial] = self._make_report(serial, work_date, rows_per_report, rng)
+        self.serials = sorted(self.reports)
+
+    @staticmethod
+    def _make_report(serial: str, work_date: datetime, rows: int, rng: random.Random) -> pd.DataFrame:
+        start = work_date + timedelta(hours=8)
+        records = []
+        for ordinal in range(1, rows + 1):
+            hours = rng.choice((4, 8, 10))
+            records.append({
+                '生產日報表序號': serial, '工作日期': work_date,
+                '工作者編號': f"W{rng.randint(1, 300):04d}", '工作者名稱': f"作業員{rng.randint(1, 300)}",
+                '工序編號': f"P{rng.randint(1, 40):02d}", '工序內容': '車削',
+                '發工單號': f"PD{rng.randint(1, 99999):05d}", '製令序號': f"M{rng.randint(1, 99999):05d}",
+                '產品編號': f"X{rng.randint(1, 999):03d}", '品名規格': '規格',
+                '起工時間': start, '完工時間': start + timedelta(hours=hours), '起工型態': '標準起工',
+                '機台編號': f"C{rng.randint(1, 60):02d}", '機台部門': 'A', '實際工時': float(hours),
+                '完工數': float(rng.randint(10, 500)), '不良數': float(rng.randint(0, 5)),
+                '除外名稱1': None, '除外時間1': None, '除外名稱2': None, '除外時間2': None,
+                '除外名稱3': None, '除外時間3': None,
+                '編輯時間': start + timedelta(hours=hours, minutes=5), '序次': ordinal,
+            })
+        return pd.DataFrame(records)
+
+    def _wait(self) -> None:
+        with self._lock:
+            self.queries += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def query(self, dy_serial_num: str):
+        self._wait()
+        df = self.reports.get(dy_serial_num)
+        return df.copy() if df is not None else pd.DataFrame(columns=list(self.reports[self.serials[0]].columns))
+
+    def query_many(self, dy_serial_nums: list) -> dict:
+        self._wait()
+        empty = pd.DataFrame(columns=list(self.reports[self.serials[0]].columns))
+        return {s: (self.reports[s].copy() if s in self.reports else empty.copy()) for s in dict.fromkeys(dy_serial_nums)}
+
+    def suggest_rows(self, since) -> pd.DataFrame:
+        self._wait()
+        if since is not None:
+            return pd.DataFrame(columns=["DySerialNum", "CDate", "EditTime", "WorkerNum", "WorkerName"])
+        rows = [(s, df['工作日期'].iloc[0].strftime('%Y-%m-%d'), df['編輯時間'].iloc[0],
+                 df['工作者編號'].iloc[0], df['工作者名稱'].iloc[0]) for s, df in self.reports.items()]
+        return pd.DataFrame(rows, columns=["DySerialNum", "CDate", "EditTime", "WorkerNum", "WorkerName"])
+
+
+def install_standins(db: StandInDatabase, workdir: str) -> None:
+    """資料庫查詢改用替身資料；exports/、網路資料夾、上傳記錄、清單日誌改到暫存資料夾"""
+    prs._query_production_report_db = db.query
+    prs.query_production_reports = db.query_many
+    prs._load_suggest_rows = db.suggest_rows
+
+    prs.LOCAL_EXPORT_DIR = os.path.join(workdir, "exports")
+    prs.NETWORK_SHARE_PATH = os.path.join(workdir, "share")
+    prs.PROFILE_DIR = os.path.join(workdir, "profiles")
+    prs.UPLOAD_LEDGER_PATH = os.path.join(workdir, "upload_ledger.json")
+    prs.JOURNAL_PATH = os.path.join(workdir, "queue_journal.jsonl")
+    for path in (prs.LOCAL_EXPORT_DIR, prs.NETWORK_SHARE_PATH, prs.PROFILE_DIR):
+        os.makedirs(path, exist_ok=True)
+
+    # 開發目錄的樣板放在專案根目錄（打包後才在 templates/）
+    if not os.path.isdir(prs.TEMPLATE_DIR):
+        prs.app.template_folder = prs.APP_DIR
+
+
+# -----------------------
+# 模擬站台
+# -----------------------
+class RouteStats:
+    """單一站台的各路由統計（站台結束後再合併，量測期間不需加鎖）"""
+
+    def __init__(self):
+        self.latencies = {}   # 路由 -> [ms]
+        self.errors = {}      # 連線失敗、逾時或 5xx
+        self.rejected = {}    # HTTP 200 但 success=False（例如清單已被其他站台上傳）
+
+    def add(self, route: str, elapsed_ms: float, error: bool, rejected: bool) -> None:
+        self.latencies.setdefault(route, []).append(elapsed_ms)
+        if error:
+            self.errors[route] = self.errors.get(route, 0) + 1
+        if rejected:
+            self.rejected[route] = self.rejected.get(route, 0) + 1
+
+    def merge(self, other: 'RouteStats') -> None:
+        for route, values in other.latencies.items():
+            self.latencies.setdefault(route, []).extend(values)
+        for target, source in ((self.errors, other.errors), (self.rejected, other.rejected)):
+            for route, count in source.items():
+                target[route] = target.get(route, 0) + count
+
+
+class Station(threading.Thread):
+    """一個瀏覽器分頁：固定週期的 heartbeat/輪詢，加上隨機間隔的查詢、儲存、上傳/列印"""
+
+    def __init__(self, index: int, port: int, db: StandInDatabase, deadline: float, options):
+        super().__init__(daemon=True, name=f"station-{index}")
+        self.port = port
+        self.db = db
+        self.deadline = deadline
+        self.options = options
+        self.rng = random.Random(options.seed + index)
+        self.stats = RouteStats()
+        self.conn = None
+        self.queue_types = {}
+
+    def request(self, method: str, path: str, payload: dict = None):
+        """送出請求並記錄延遲，返回解析後的 JSON（失敗或非 JSON 時為 None）"""
+        route = path.split('?', 1)[0]
+        body = json.dumps(payload).encode('utf-8') if payload is not None else None
+        headers = {"Accept-Encoding": "gzip"}
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+        started = time.perf_counter()
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=_REQUEST_TIMEOUT_SEC)
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            data = response.read()
+            status = response.status
+            if response.getheader("Content-Encoding") == "gzip":
+                data = gzip.decompress(data)
+        except (OSError, http.client.HTTPException):
+            self.stats.add(route, (time.perf_counter() - started) * 1000, True, False)
+            self.conn.close()
+            self.conn = None
+            return None
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        result = None
+        if data[:1] == b'{':
+            try:
+                result = json.loads(data.decode('utf-8'))
+            except ValueError:
+                pass
+        rejected = isinstance(result, dict) and result.get("success") is False
+        self.stats.add(route, elapsed_ms, status >= 500, rejected)
+        return result
+
+    def poll(self) -> None:
+        self.request("GET", "/api/get_queue_status")
+        result = self.request("GET", "/api/get_queue_types")
+        if result:
+            self.queue_types = result
+
+    def operate(self) -> None:
+        """輸入序號 → 查詢 → 儲存一筆修改，偶爾上傳當天記錄或列印非當天記錄"""
+        serial = self.rng.choice(self.db.serials)
+        self.request("GET", f"/api/suggest?q={serial[:-3]}")
+        result = self.request("POST", "/api/query", {"dySerialNum": serial, "format": "dict"})
+        if not result or not result.get("success"):
+            return
+
+        report = self.db.reports[serial]
+        index = self.rng.randrange(len(report))
+        row = report.iloc[index]
+        # 與頁面相同，送回查詢結果中的編輯時間（編輯時間欄不做字典編碼）
+        edit_time = result["rows"][index][result["columns"].index('編輯時間')]
+        payload = {
+            "dy_serial_num": serial,
+            "delete_flag": "否",
+            "pd_serial_num": row['製令序號'],
+            "ordinal_num": str(row['序次']),
+            "edit_time": edit_time,
+            "finish_qty_modified": str(int(row['完工數']) + self.rng.randint(1, 20)),
+        }
+        if self.rng.random() < 0.3:
+            payload["bad_qty_modified"] = str(self.rng.randint(0, 10))
+        self.request("POST", "/api/save", payload)
+
+        if self.rng.random() < self.options.dispatch_ratio:
+            if self.queue_types.get("same_day_count") and (
+                    not self.queue_types.get("different_day_count") or self.rng.random() < 0.5):
+                self.request("POST", "/api/upload", {})
+            elif self.queue_types.get("different_day_count"):
+                result = self.request("POST", "/api/print", {})
+                for url in (result or {}).get("print_urls") or []:
+                    self.request("GET", url)
+
+    def run(self) -> None:
+        now = time.time()
+        next_heartbeat = now
+        next_poll = now + self.rng.uniform(0, _POLL_SEC)
+        next_action = now + self.rng.uniform(0, self.options.think_sec)
+        while True:
+            due = min(next_heartbeat, next_poll, next_action)
+            if due >= self.deadline:
+                break
+            time.sleep(max(0.0, due - time.time()))
+            now = time.time()
+            if now >= next_heartbeat:
+                self.request("POST", "/api/heartbeat", {})
+                next_heartbeat += _HEARTBEAT_SEC
+            if now >= next_poll:
+                self.poll()
+                next_poll += _POLL_SEC
+            if now >= next_action:
+                self.operate()
+                next_action = time.time() + self.rng.expovariate(1.0 / self.options.think_sec)
+        if self.conn is not None:
+            self.conn.close()
+
+
+# -----------------------
+# 統計與報表
+# -----------------------
+def percentile(sorted_values: list, p: float) -> float:
+    """nearest-rank 百分位數"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(stats: RouteStats, elapsed_sec: float) -> list:
+    rows = []
+    for route in sorted(stats.latencies, key=lambda r: -len(stats.latencies[r])):
+        values = sorted(stats.latencies[route])
+        count = len(values)
+        rows.append({
+            "route": route,
+            "count": count,
+            "rps": round(count / elapsed_sec, 2),
+            "p50_ms": round(percentile(values, 50), 1),
+            "p99_ms": round(percentile(values, 99), 1),
+            "max_ms": round(values[-1], 1),
+            "error_rate": round(stats.errors.get(route, 0) / count, 4),
+            "rejected_rate": round(stats.rejected.get(route, 0) / count, 4),
+        })
+    return rows
+
+
+def print_report(rows: list, elapsed_sec: float, extra: dict) -> None:
+    total = sum(r["count"] for r in rows)
+    print(f"\n共 {total} 個請求，{elapsed_sec:.1f} 秒，{total / elapsed_sec:.1f} req/s")
+    print(f"{'路由':<28}{'請求數':>8}{'req/s':>9}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'錯誤率':>9}{'拒絕率':>9}")
+    for r in rows:
+        print(f"{r['route']:<30}{r['count']:>8}{r['rps']:>9}{r['p50_ms']:>10}{r['p99_ms']:>10}{r['max_ms']:>10}"
+              f"{r['error_rate']:>10.2%}{r['rejected_rate']:>10.2%}")
+    print(json.dumps(extra, ensure_ascii=False, indent=2, default=str))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="生產日報表修改系統 多站台負載測試")
+    parser.add_argument("--stations", type=int, default=10, help="同時開啟的瀏覽器分頁數")
+    parser.add_argument("--duration", type=float, default=60, help="量測秒數")
+    parser.add_argument("--think-sec", type=float, default=8, help="每個站台兩次操作（查詢+儲存）的平均間隔秒數")
+    parser.add_argument("--dispatch-ratio", type=float, default=0.1, help="每次儲存後接著上傳或列印的機率")
+    parser.add_argument("--serials", type=int, default=2000, help="替身資料庫的生產日報表數")
+    parser.add_argument("--rows", type=int, default=3, help="每張生產日報表的資料列數")
+    parser.add_argument("--today-ratio", type=float, default=0.4, help="工作日期為今天（當天記錄）的比例")
+    parser.add_argument("--db-latency-ms", type=float, default=30, help="替身資料庫每次查詢的延遲")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", default="", help="另存結果 JSON 的路徑（比較不同版本用）")
+    parser.add_argument("--keep-workdir", action="store_true", help="保留暫存資料夾（檢查生成的檔案）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    options = parse_args(argv)
+    # 請求日誌會大量寫入 ProductionReportSystem.log 並影響量測，只保留警告
+    logging.getLogger("prs").setLevel(logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    workdir = tempfile.mkdtemp(prefix="prs_loadtest_")
+    db = StandInDatabase(options.serials, options.rows, options.today_ratio, options.db_latency_ms, options.seed)
+    install_standins(db, workdir)
+    prs.refresh_suggest_index()
+    threading.Thread(target=prs._share_health_monitor, daemon=True).start()
+
+    server = make_server("127.0.0.1", 0, prs.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True, name="loadtest-server").start()
+    print(f"替身伺服器 http://127.0.0.1:{server.server_port}，{options.stations} 個站台，{options.duration:.0f} 秒，暫存資料夾 {workdir}")
+
+    started = time.time()
+    stations = [Station(i, server.server_port, db, started + options.duration, options)
+                for i in range(options.stations)]
+    for station in stations:
+        station.start()
+    for station in stations:
+        station.join()
+    elapsed = time.time() - started
+    server.shutdown()
+
+    stats = RouteStats()
+    for station in stations:
+        stats.merge(station.stats)
+    rows = summarize(stats, elapsed)
+    extra = {
+        "options": vars(options),
+        "db_queries": db.queries,
+        "query_stats": prs.get_query_stats(),
+        "queue_remaining": len(prs.print_queue),
+        "file_jobs": {status: sum(1 for j in prs.get_file_jobs(prs._FILE_JOB_HISTORY) if j["status"] == status)
+                      for status in ("pending", "running", "done", "failed")},
+    }
+    print_report(rows, elapsed, extra)
+
+    if options.json:
+        with open(options.json, 'w', encoding='utf-8') as f:
+            json.dump({"elapsed_sec": round(elapsed, 2), "routes": rows, **extra}, f, ensure_ascii=False, indent=2, default=str)
+    if not options.keep_workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    failed = any(r["error_rate"] > 0 for r in rows)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())